@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+聚合结果直接解码为Arrow
+按游标批次读取原始BSON（aggregate_raw_batches），每个批次解码为一个Arrow RecordBatch，
+不经过逐文档的结果字典、类型转换和JSON编码
+
+- 安装了pymongoarrow时由其C扩展把BSON直接写入Arrow列，不创建每个文档的Python对象
+- 否则用bson.decode_all解码（ObjectId、Decimal128在解码器中直接转为字符串）后按列构造RecordBatch
+
+列类型按声明的schema（字段名 -> 类型名）确定，只输出声明的字段；未声明时根据第一个批次推断
+（包含批次中所有文档出现过的字段），后续批次按相同的schema输出，缺少的字段为null，
+出现第一个批次没有的字段时抛出ArrowDecodeError而不是丢弃该列（结果字段不固定时应声明schema）。
+输出中ObjectId和Decimal128列均为字符串，与JSON响应一致
+"""
+
+import io
+from typing import Any, Dict, List, Optional
+import bson
+from bson import Decimal128, ObjectId
+from bson.codec_options import CodecOptions, TypeDecoder, TypeRegistry
+from bson_encoder import decimal128_bid_to_str, encode_decimal128
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+except ImportError:  # 可选依赖
+    pyarrow = None
+
+try:
+    import numpy
+    from pymongoarrow.context import PyMongoArrowContext
+    from pymongoarrow.schema import Schema as MongoArrowSchema
+    from pymongoarrow.types import Decimal128Type, ObjectIdType
+except ImportError:  # 可选依赖
+    PyMongoArrowContext = None
+
+# 声明schema时可用的类型名
+SCHEMA_TYPES = ("int32", "int64", "double", "string", "bool", "timestamp", "objectid", "decimal128")
+
+
+class ArrowDecodeError(ValueError):
+    """schema不合法或结果无法按schema解码"""
+
+
+class _ObjectIdDecoder(TypeDecoder):
+    bson_type = ObjectId
+
+    def transform_bson(self, value: ObjectId) -> str:
+        return str(value)
+
+
+class _Decimal128Decoder(TypeDecoder):
+    bson_type = Decimal128
+
+    def transform_bson(self, value: Decimal128) -> str:
+        return encode_decimal128(value)
+
+
+# 未安装pymongoarrow时的解码选项
+_CODEC_OPTIONS = CodecOptions(tz_aware=False, type_registry=TypeRegistry([_ObjectIdDecoder(), _Decimal128Decoder()]))
+
+
+def decoder_name() -> str:
+    """当前使用的解码方式"""
+    return "pymongoarrow" if PyMongoArrowContext is not None else "bson"
+
+
+def _arrow_type(type_name: str, native: bool) -> Any:
+    """类型名 -> Arrow类型；native为True时ObjectId、Decimal128使用pymongoarrow的扩展类型"""
+    if type_name == "objectid":
+        return ObjectIdType() if native else pyarrow.string()
+    if type_name == "decimal128":
+        return Decimal128Type() if native else pyarrow.string()
+    return {
+        "int32": pyarrow.int32(),
+        "int64": pyarrow.int64(),
+        "double": pyarrow.float64(),
+        "string": pyarrow.string(),
+        "bool": pyarrow.bool_(),
+        "timestamp": pyarrow.timestamp("ms")
+    }[type_name]
+
+
+def parse_schema(declared: Optional[Dict[str, str]]) -> Optional[Any]:
+    """
+    检查并转换声明的schema
+
+    Args:
+        declared: 字段名 -> 类型名（见SCHEMA_TYPES），None表示根据结果推断
+
+    Returns:
+        pyarrow.Schema: 输出的schema，declared为空时返回None
+
+    Raises:
+        ArrowDecodeError: 未安装pyarrow或类型名不合法
+    """
+    if pyarrow is None:
+        raise ArrowDecodeError("Arrow格式需要安装pyarrow")
+    if not declared:
+        return None
+    unknown = {field: type_name for field, type_name in declared.items() if type_name not in SCHEMA_TYPES}
+    if unknown:
+        raise ArrowDecodeError(f"schema中的类型不支持: {unknown}，支持: {', '.join(SCHEMA_TYPES)}")
+    return pyarrow.schema([(field, _arrow_type(type_name, False)) for field, type_name in declared.items()])
+
+
+if PyMongoArrowContext is not None:
+    _HEX_DIGITS = numpy.array([f"{i:02x}".encode("ascii") for i in range(256)], dtype="S2")
+
+
+def _objectid_strings(column: Any) -> Any:
+    """ObjectId列转为十六进制字符串列（按字节查表，不逐个创建ObjectId）"""
+    storage = column.combine_chunks().storage
+    if len(storage) == 0:
+        return pyarrow.array([], type=pyarrow.string())
+    data = numpy.frombuffer(storage.buffers()[1], dtype=numpy.uint8)
+    data = data[storage.offset * 12:(storage.offset + len(storage)) * 12].reshape(-1, 12)
+    hexed = _HEX_DIGITS[data].view("S24").reshape(-1)
+    return pyarrow.array(hexed, mask=storage.is_null().to_numpy(zero_copy_only=False)).cast(pyarrow.string())
+
+
+def _decimal128_strings(column: Any) -> Any:
+    """
+    Decimal128列转为字符串列（保留全部精度，格式与str(Decimal128)相同）
+
+    常见的值（系数不超过63位、指数不大于0）按指数分组，从BID编码直接拼出Arrow的decimal128再由Arrow转为字符串；
+    其余的值（负零、NaN、超大系数等）逐个转换
+    """
+    storage = column.combine_chunks().storage
+    count = len(storage)
+    if count == 0:
+        return pyarrow.array([], type=pyarrow.string())
+    words = numpy.frombuffer(storage.buffers()[1], dtype=numpy.uint64)
+    words = words[storage.offset * 2:(storage.offset + count) * 2].reshape(-1, 2)
+    low, high = words[:, 0], words[:, 1]
+    negative = (high >> numpy.uint64(63)).astype(bool)
+    exponent = ((high >> numpy.uint64(49)) & numpy.uint64(0x3FFF)).astype(numpy.int64) - 6176
+    fast = (
+        storage.is_valid().to_numpy(zero_copy_only=False)
+        & ((high >> numpy.uint64(61)) & numpy.uint64(3) != 3)
+        & ((high & numpy.uint64(0x1FFFFFFFFFFFF)) == 0)
+        & (low < numpy.uint64(1 << 63))
+        & (exponent <= 0) & (exponent >= -38)
+        & ~(negative & (low == 0))
+    )
+
+    pieces, positions = [], []
+    for value_exponent in numpy.unique(exponent[fast]):
+        rows = numpy.flatnonzero(fast & (exponent == value_exponent))
+        signed = low[rows].astype(numpy.int64)
+        signed = numpy.where(negative[rows], -signed, signed)
+        # 128位补码：低64位为系数，高64位为符号扩展
+        unscaled = numpy.empty(len(rows) * 2, dtype=numpy.uint64)
+        unscaled[0::2] = signed.view(numpy.uint64)
+        unscaled[1::2] = numpy.where(signed < 0, numpy.uint64(0xFFFFFFFFFFFFFFFF), numpy.uint64(0))
+        decimals = pyarrow.Array.from_buffers(
+            pyarrow.decimal128(38, int(-value_exponent)), len(rows), [None, pyarrow.py_buffer(unscaled)]
+        )
+        pieces.append(decimals.cast(pyarrow.string()))
+        positions.append(rows)
+
+    rest = numpy.flatnonzero(~fast)
+    if len(rest):
+        pieces.append(pyarrow.array([
+            None if bid is None else decimal128_bid_to_str(bid) for bid in storage.take(rest).to_pylist()
+        ], type=pyarrow.string()))
+        positions.append(rest)
+
+    if len(pieces) == 1 and len(positions[0]) == count:
+        return pieces[0]
+    # 按原来的行顺序重新排列各组的结果
+    order = numpy.empty(count, dtype=numpy.int64)
+    order[numpy.concatenate(positions)] = numpy.arange(count)
+    return pyarrow.concat_arrays(pieces).take(pyarrow.array(order))
+
+
+class ArrowBatchDecoder:
+    """
+    把原始BSON批次解码为RecordBatch
+
+    同一个解码器的所有批次使用相同的schema，可以直接写入同一个Arrow IPC流
+    """
+
+    # 推断schema时，后续批次出现新字段的错误提示
+    NEW_FIELDS_MESSAGE = "结果中出现第一个批次没有的字段: {fields}，字段不固定时请通过schema（arrow_schema）声明输出的列"
+
+    def __init__(self, schema: Optional[Dict[str, str]] = None):
+        """
+        Args:
+            schema: 字段名 -> 类型名，None表示根据第一个批次推断
+
+        Raises:
+            ArrowDecodeError: 未安装pyarrow或schema不合法
+        """
+        self.schema = parse_schema(schema)
+        self.declared = self.schema is not None
+        self.native_schema = None
+        if schema and PyMongoArrowContext is not None:
+            self.native_schema = MongoArrowSchema({
+                field: _arrow_type(type_name, True) for field, type_name in schema.items()
+            })
+
+    def decode(self, raw_batch: bytes) -> Optional[Any]:
+        """
+        解码一个批次
+
+        Args:
+            raw_batch: 游标批次的原始BSON（多个文档首尾相连）
+
+        Returns:
+            pyarrow.RecordBatch: 解码结果，空批次返回None
+
+        Raises:
+            ArrowDecodeError: 文档中的值与schema不符
+        """
+        if not raw_batch:
+            return None
+        try:
+            if PyMongoArrowContext is not None:
+                table = self._decode_native(raw_batch)
+            else:
+                table = self._decode_documents(bson.decode_all(raw_batch, _CODEC_OPTIONS))
+            if self.schema is None:
+                # 后续批次按第一个批次推断出的schema输出，保证同一个流中的批次schema一致
+                self.schema = table.schema
+            elif self.declared:
+                if table.schema != self.schema:
+                    table = table.cast(self.schema)
+            elif table.schema != self.schema:
+                table = self._conform(table)
+        except ArrowDecodeError:
+            raise
+        except Exception as e:
+            raise ArrowDecodeError(f"结果无法按schema解码为Arrow: {e}")
+        return table.combine_chunks().to_batches()[0]
+
+    def _decode_documents(self, documents: List[Dict[str, Any]]) -> Any:
+        """按声明的schema构造表；否则按批次中所有文档的字段推断（from_pylist只看第一个文档的字段）"""
+        if self.declared:
+            return pyarrow.Table.from_pylist(documents, schema=self.schema)
+        return pyarrow.Table.from_batches([pyarrow.RecordBatch.from_struct_array(pyarrow.array(documents))])
+
+    def _conform(self, table: Any) -> Any:
+        """把后续批次对齐到推断出的schema：缺少的字段补null，出现新字段时报错"""
+        names = set(table.schema.names)
+        new_fields = [name for name in table.schema.names if name not in self.schema.names]
+        if new_fields:
+            raise ArrowDecodeError(self.NEW_FIELDS_MESSAGE.format(fields=new_fields))
+        columns = [
+            table.column(field.name) if field.name in names else pyarrow.nulls(table.num_rows, field.type)
+            for field in self.schema
+        ]
+        return pyarrow.Table.from_arrays(columns, names=self.schema.names).cast(self.schema)
+
+    def _decode_native(self, raw_batch: bytes) -> Any:
+        """用pymongoarrow解码，再把ObjectId、Decimal128扩展类型的列转为字符串"""
+        # 未声明schema时每个批次都推断，按schema解码会丢弃新出现的字段，由_conform检查
+        context = PyMongoArrowContext(self.native_schema)
+        context.process_bson_stream(raw_batch)
+        table = context.finish()
+        for index, field in enumerate(table.schema):
+            if isinstance(field.type, ObjectIdType):
+                table = table.set_column(index, field.name, _objectid_strings(table.column(index)))
+            elif isinstance(field.type, Decimal128Type):
+                table = table.set_column(index, field.name, _decimal128_strings(table.column(index)))
+        return table
+
+
+class ArrowStreamWriter:
+    """把RecordBatch逐个编码为Arrow IPC流的分块"""
+
+    def __init__(self, schema: Any):
+        self.buffer = io.BytesIO()
+        self.writer = pyarrow.ipc.new_stream(self.buffer, schema)
+
+    def _take(self) -> bytes:
+        chunk = self.buffer.getvalue()
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        return chunk
+
+    def write(self, batch: Any) -> bytes:
+        """写入一个批次，返回新产生的字节（第一次调用时包含schema）"""
+        self.writer.write_batch(batch)
+        return self._take()
+
+    def close(self) -> bytes:
+        """结束流，返回结束标记"""
+        self.writer.close()
+        return self._take()
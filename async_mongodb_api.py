@@ -0,0 +1,867 @@
+from typing import AsyncIterator, Dict, List, Any, Optional
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import BulkWriteError, ConnectionFailure, ServerSelectionTimeoutError, OperationFailure
+from datetime import datetime
+import logging
+from mongo_client_pool import async_mongo_client_pool
+from config import Config
+from pagination import PageTokenError, finish_page, page_query
+from bulk_operations import BulkOperationError, build_write_concern, merge_result, new_summary, parse_operations, summary_message
+from bson_encoder import encode_documents, encode_value
+from query_plans import summarize_plan
+from arrow_decoding import ArrowBatchDecoder
+from tracing import mongodb_attributes, span, traced
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class AsyncMongoDBQueryAPI:
+    """
+    MongoDB异步查询API类
+
+    与MongoDBQueryAPI方法一致，基于Motor实现，查询期间不会阻塞事件循环，
+    适合在FastAPI的async接口中使用
+    """
+
+    def __init__(self):
+        self.client = None
+        self.db = None
+        self.collection = None
+        # 从连接池获取客户端时记录连接字符串，关闭时归还而不是断开
+        self.pooled_connection_string = None
+
+    @traced("mongodb.connect", mongodb_attributes)
+    async def connect_to_mongodb(self,
+                                 connection_string: str,
+                                 database_name: str,
+                                 collection_name: str,
+                                 use_pool: bool = False) -> Dict[str, Any]:
+        """
+        连接到MongoDB数据库
+
+        Args:
+            connection_string: MongoDB连接字符串
+            database_name: 数据库名称
+            collection_name: 集合名称
+            use_pool: 是否从进程级连接池复用客户端（复用时只在首次创建客户端时ping）
+
+        Returns:
+            Dict: 包含连接状态和信息的字典
+        """
+        try:
+            # 重新连接前先归还（连接池）或关闭（非连接池）之前的客户端，
+            # 避免切换连接方式时泄漏客户端或使用计数
+            if self.client is not None:
+                self.close_connection()
+
+            if use_pool:
+                # 从连接池获取客户端
+                self.client = await async_mongo_client_pool.acquire(connection_string)
+                self.pooled_connection_string = connection_string
+            else:
+                # 创建MongoDB客户端
+                self.client = AsyncIOMotorClient(connection_string, serverSelectionTimeoutMS=5000)
+
+                # 测试连接
+                with span("mongodb.ping"):
+                    await self.client.admin.command('ping')
+
+            # 获取数据库和集合
+            self.db = self.client[database_name]
+            self.collection = self.db[collection_name]
+
+            logger.info(f"成功连接到MongoDB数据库: {database_name}, 集合: {collection_name}")
+
+            return {
+                "status": "success",
+                "message": "连接成功",
+                "database": database_name,
+                "collection": collection_name,
+                "timestamp": datetime.now().isoformat()
+            }
+
+        except ConnectionFailure as e:
+            error_msg = f"连接失败: {str(e)}"
+            logger.error(error_msg)
+            return {
+                "status": "error",
+                "message": error_msg,
+                "timestamp": datetime.now().isoformat()
+            }
+        except ServerSelectionTimeoutError as e:
+            error_msg = f"服务器选择超时: {str(e)}"
+            logger.error(error_msg)
+            return {
+                "status": "error",
+                "message": error_msg,
+                "timestamp": datetime.now().isoformat()
+            }
+        except Exception as e:
+            error_msg = f"未知错误: {str(e)}"
+            logger.error(error_msg)
+            return {
+                "status": "error",
+                "message": error_msg,
+                "timestamp": datetime.now().isoformat()
+            }
+
+    @traced("mongodb.find", mongodb_attributes)
+    async def query_documents(self,
+                              query_filter: Dict[str, Any] = None,
+                              projection: Dict[str, Any] = None,
+                              sort: List[tuple] = None,
+                              limit: int = None,
+                              skip: int = None,
+                              explain: bool = False) -> Dict[str, Any]:
+        """
+        查询MongoDB文档
+
+        Args:
+            query_filter: 查询条件字典
+            projection: 投影字段字典
+            sort: 排序条件列表，如 [("field", 1)] 或 [("field", -1)]
+            limit: 限制返回文档数量
+            skip: 跳过文档数量
+            explain: 为True时只返回执行计划摘要（胜出计划、扫描的键和文档数量），不返回文档
+
+        Returns:
+            Dict: 包含查询结果的字典
+        """
+        if self.collection is None:
+            return {
+                "status": "error",
+                "message": "未连接到MongoDB，请先调用connect_to_mongodb方法",
+                "timestamp": datetime.now().isoformat()
+            }
+
+        try:
+            # 设置默认查询条件
+            if query_filter is None:
+                query_filter = {}
+
+            # 如果projection为空字典，则表示返回所有字段
+            if projection == {}:
+                projection = None
+
+            # 构建查询
+            cursor = self.collection.find(query_filter, projection)
+
+            # 应用排序
+            if sort:
+                cursor = cursor.sort(sort)
+
+            # 应用跳过
+            if skip is not None:
+                cursor = cursor.skip(skip)
+
+            # 应用限制
+            if limit is not None:
+                cursor = cursor.limit(limit)
+
+            # explain模式：只返回执行计划摘要，不返回文档
+            if explain:
+                plan = summarize_plan(await cursor.explain())
+                logger.info(f"获取执行计划成功: {plan['plan']}")
+                return {
+                    "status": "success",
+                    "message": f"获取执行计划成功: {plan['plan']}",
+                    "data": plan,
+                    "query_filter": query_filter,
+                    "timestamp": datetime.now().isoformat()
+                }
+
+            # 获取结果
+            with span("mongodb.cursor"):
+                documents = await cursor.to_list(length=None)
+
+            # 转换ObjectId、Decimal128等MongoDB类型（包括嵌套字段）
+            with span("bson.encode"):
+                documents = encode_documents(documents)
+
+            logger.info(f"查询成功，返回 {len(documents)} 个文档")
+
+            return {
+                "status": "success",
+                "message": f"查询成功，返回 {len(documents)} 个文档",
+                "data": documents,
+                "count": len(documents),
+                "query_filter": query_filter,
+                "timestamp": datetime.now().isoformat()
+            }
+
+        except OperationFailure as e:
+            error_msg = f"查询操作失败: {str(e)}"
+            logger.error(error_msg)
+            return {
+                "status": "error",
+                "message": error_msg,
+                "timestamp": datetime.now().isoformat()
+            }
+        except Exception as e:
+            error_msg = f"查询时发生未知错误: {str(e)}"
+            logger.error(error_msg)
+            return {
+                "status": "error",
+                "message": error_msg,
+                "timestamp": datetime.now().isoformat()
+            }
+
+    @traced("mongodb.find_page", mongodb_attributes)
+    async def query_page(self,
+                         query_filter: Dict[str, Any] = None,
+                         projection: Dict[str, Any] = None,
+                         sort: List[tuple] = None,
+                         limit: int = None,
+                         page_token: str = None) -> Dict[str, Any]:
+        """
+        键集分页查询：按排序键的范围条件定位下一页，代替skip
+
+        Args:
+            query_filter: 查询条件字典
+            projection: 投影字段字典
+            sort: 排序条件列表，如 [("field", 1)] 或 [("field", -1)]，末尾会自动追加_id
+            limit: 每页文档数量，默认使用配置中的default_limit
+            page_token: 上一页返回的next_page_token，为空时查询第一页
+
+        Returns:
+            Dict: 包含本页文档和next_page_token的字典，没有下一页时next_page_token为None
+        """
+        if self.collection is None:
+            return {
+                "status": "error",
+                "message": "未连接到MongoDB，请先调用connect_to_mongodb方法",
+                "timestamp": datetime.now().isoformat()
+            }
+
+        try:
+            if limit is None:
+                limit = Config.get_query_config()["default_limit"]
+            page = page_query(self.collection.full_name, query_filter, projection, sort, page_token)
+
+            documents = []
+            if page["filter"] is not None:
+                # 多取一条用于判断是否还有下一页
+                cursor = self.collection.find(page["filter"], page["projection"]).sort(page["sort"]).limit(limit + 1)
+                with span("mongodb.cursor"):
+                    documents = await cursor.to_list(length=limit + 1)
+            documents, next_page_token = finish_page(documents, limit, page)
+
+            # 转换ObjectId、Decimal128等MongoDB类型（包括嵌套字段）
+            with span("bson.encode"):
+                documents = encode_documents(documents)
+
+            logger.info(f"分页查询成功，返回 {len(documents)} 个文档")
+
+            return {
+                "status": "success",
+                "message": f"查询成功，返回 {len(documents)} 个文档",
+                "data": documents,
+                "count": len(documents),
+                "next_page_token": next_page_token,
+                "timestamp": datetime.now().isoformat()
+            }
+
+        except PageTokenError as e:
+            logger.error(str(e))
+            return {
+                "status": "error",
+                "message": str(e),
+                "timestamp": datetime.now().isoformat()
+            }
+        except OperationFailure as e:
+            error_msg = f"查询操作失败: {str(e)}"
+            logger.error(error_msg)
+            return {
+                "status": "error",
+                "message": error_msg,
+                "timestamp": datetime.now().isoformat()
+            }
+        except Exception as e:
+            error_msg = f"查询时发生未知错误: {str(e)}"
+            logger.error(error_msg)
+            return {
+                "status": "error",
+                "message": error_msg,
+                "timestamp": datetime.now().isoformat()
+            }
+
+    @traced("mongodb.find_one", mongodb_attributes)
+    async def query_one_document(self,
+                                 query_filter: Dict[str, Any] = None,
+                                 projection: Dict[str, Any] = None,
+                                 sort: List[tuple] = None,
+                                 explain: bool = False) -> Dict[str, Any]:
+        """
+        查询MongoDB单个文档
+
+        Args:
+            query_filter: 查询条件字典
+            projection: 投影字段字典
+            sort: 排序条件列表，如 [("field", 1)] 或 [("field", -1)]
+            explain: 为True时只返回执行计划摘要，不返回文档
+
+        Returns:
+            Dict: 包含查询结果的字典
+        """
+        if self.collection is None:
+            return {
+                "status": "error",
+                "message": "未连接到MongoDB，请先调用connect_to_mongodb方法",
+                "timestamp": datetime.now().isoformat()
+            }
+
+        try:
+            # 设置默认查询条件
+            if query_filter is None:
+                query_filter = {}
+
+            # 如果projection为空字典，则表示返回所有字段
+            if projection == {}:
+                projection = None
+
+            # 构建查询
+            cursor = self.collection.find(query_filter, projection)
+
+            # 应用排序
+            if sort:
+                cursor = cursor.sort(sort)
+
+            # explain模式：只返回执行计划摘要，不返回文档
+            if explain:
+                plan = summarize_plan(await cursor.limit(1).explain())
+                logger.info(f"获取执行计划成功: {plan['plan']}")
+                return {
+                    "status": "success",
+                    "message": f"获取执行计划成功: {plan['plan']}",
+                    "data": plan,
+                    "query_filter": query_filter,
+                    "timestamp": datetime.now().isoformat()
+                }
+
+            # 获取第一个文档
+            with span("mongodb.cursor"):
+                documents = await cursor.limit(1).to_list(length=1)
+
+            if not documents:
+                # 没有找到匹配的文档
+                logger.info(f"没有找到匹配的文档")
+                return {
+                    "status": "info",
+                    "message": "没有找到匹配的文档",
+                    "data": None,
+                    "query_filter": query_filter,
+                    "timestamp": datetime.now().isoformat()
+                }
+
+            document = documents[0]
+
+            # 转换ObjectId、Decimal128等MongoDB类型（包括嵌套字段）
+            document = encode_value(document)
+
+            logger.info(f"查询单个文档成功")
+
+            return {
+                "status": "success",
+                "message": "查询单个文档成功",
+                "data": document,
+                "query_filter": query_filter,
+                "timestamp": datetime.now().isoformat()
+            }
+
+        except OperationFailure as e:
+            error_msg = f"查询操作失败: {str(e)}"
+            logger.error(error_msg)
+            return {
+                "status": "error",
+                "message": error_msg,
+                "timestamp": datetime.now().isoformat()
+            }
+        except Exception as e:
+            error_msg = f"查询时发生未知错误: {str(e)}"
+            logger.error(error_msg)
+            return {
+                "status": "error",
+                "message": error_msg,
+                "timestamp": datetime.now().isoformat()
+            }
+
+    @traced("mongodb.aggregate", mongodb_attributes)
+    async def aggregate_pipeline(self, pipeline: List[Dict[str, Any]], explain: bool = False) -> Dict[str, Any]:
+        """
+        执行聚合管道查询
+
+        Args:
+            pipeline: 聚合管道列表
+            explain: 为True时只返回执行计划摘要（executionStats模式，管道会实际执行），不返回文档
+
+        Returns:
+            Dict: 包含聚合结果的字典
+        """
+        if self.collection is None:
+            return {
+                "status": "error",
+                "message": "未连接到MongoDB，请先调用connect_to_mongodb方法",
+                "timestamp": datetime.now().isoformat()
+            }
+
+        try:
+            # explain模式：只返回执行计划摘要，不返回文档
+            if explain:
+                plan = summarize_plan(await self.db.command(
+                    "explain",
+                    {"aggregate": self.collection.name, "pipeline": pipeline, "cursor": {}},
+                    verbosity="executionStats"
+                ))
+                logger.info(f"获取执行计划成功: {plan['plan']}")
+                return {
+                    "status": "success",
+                    "message": f"获取执行计划成功: {plan['plan']}",
+                    "data": plan,
+                    "pipeline": pipeline,
+                    "timestamp": datetime.now().isoformat()
+                }
+
+            # 执行聚合查询
+            cursor = self.collection.aggregate(pipeline)
+            with span("mongodb.cursor"):
+                documents = await cursor.to_list(length=None)
+
+            # 转换ObjectId、Decimal128等MongoDB类型（包括嵌套字段）
+            with span("bson.encode"):
+                documents = encode_documents(documents)
+
+            logger.info(f"聚合查询成功，返回 {len(documents)} 个文档")
+
+            return {
+                "status": "success",
+                "message": f"聚合查询成功，返回 {len(documents)} 个文档",
+                "data": documents,
+                "count": len(documents),
+                "pipeline": pipeline,
+                "timestamp": datetime.now().isoformat()
+            }
+
+        except OperationFailure as e:
+            error_msg = f"聚合查询失败: {str(e)}"
+            logger.error(error_msg)
+            return {
+                "status": "error",
+                "message": error_msg,
+                "timestamp": datetime.now().isoformat()
+            }
+        except Exception as e:
+            error_msg = f"聚合查询时发生未知错误: {str(e)}"
+            logger.error(error_msg)
+            return {
+                "status": "error",
+                "message": error_msg,
+                "timestamp": datetime.now().isoformat()
+            }
+
+    @traced("mongodb.distinct", mongodb_attributes)
+    async def distinct_values(self, field: str, query_filter: Dict[str, Any] = None) -> Dict[str, Any]:
+        """
+        查询指定字段的唯一值
+
+        Args:
+            field: 要查询唯一值的字段名
+            query_filter: 可选的查询条件字典，用于过滤文档
+
+        Returns:
+            Dict: 包含唯一值列表的字典
+        """
+        if self.collection is None:
+            return {
+                "status": "error",
+                "message": "未连接到MongoDB，请先调用connect_to_mongodb方法",
+                "timestamp": datetime.now().isoformat()
+            }
+
+        try:
+            # 设置默认查询条件
+            if query_filter is None:
+                query_filter = {}
+
+            # 执行distinct查询
+            distinct_values = await self.collection.distinct(field, query_filter)
+
+            # 转换ObjectId、Decimal128等MongoDB类型
+            processed_values = encode_value(distinct_values)
+
+            logger.info(f"distinct查询成功，字段 '{field}' 返回 {len(processed_values)} 个唯一值")
+
+            return {
+                "status": "success",
+                "message": f"distinct查询成功，字段 '{field}' 返回 {len(processed_values)} 个唯一值",
+                "data": {
+                    "field": field,
+                    "values": processed_values,
+                    "count": len(processed_values)
+                },
+                "query_filter": query_filter,
+                "timestamp": datetime.now().isoformat()
+            }
+
+        except OperationFailure as e:
+            error_msg = f"distinct查询失败: {str(e)}"
+            logger.error(error_msg)
+            return {
+                "status": "error",
+                "message": error_msg,
+                "timestamp": datetime.now().isoformat()
+            }
+        except Exception as e:
+            error_msg = f"distinct查询时发生未知错误: {str(e)}"
+            logger.error(error_msg)
+            return {
+                "status": "error",
+                "message": error_msg,
+                "timestamp": datetime.now().isoformat()
+            }
+
+    @traced("mongodb.bulk_write", mongodb_attributes)
+    async def bulk_write(self,
+                         operations: List[Dict[str, Any]],
+                         ordered: bool = True,
+                         write_concern: Optional[Dict[str, Any]] = None,
+                         chunk_size: int = None) -> Dict[str, Any]:
+        """
+        批量写入（插入、更新、upsert、替换、删除），超过chunk_size的批次分块执行
+
+        Args:
+            operations: 写操作列表，格式见bulk_operations模块
+            ordered: 是否按顺序执行；顺序模式下遇到第一个错误即停止（包括后续的块），
+                     非顺序模式下所有操作都会执行
+            write_concern: 写关注，如 {"w": "majority", "j": True, "wtimeout": 5000}
+            chunk_size: 每次bulk_write发送的操作数，默认使用配置中的chunk_size
+
+        Returns:
+            Dict: 包含插入、匹配、修改、删除、upsert数量和写入错误的结果字典
+        """
+        if self.collection is None:
+            return {
+                "status": "error",
+                "message": "未连接到MongoDB，请先调用connect_to_mongodb方法",
+                "timestamp": datetime.now().isoformat()
+            }
+
+        try:
+            requests = parse_operations(operations)
+            concern = build_write_concern(write_concern)
+        except BulkOperationError as e:
+            return {
+                "status": "error",
+                "message": str(e),
+                "timestamp": datetime.now().isoformat()
+            }
+
+        collection = self.collection if concern is None else self.collection.with_options(write_concern=concern)
+        chunk_size = chunk_size or Config.get_bulk_write_config()["chunk_size"]
+        summary = new_summary(len(requests), ordered)
+
+        try:
+            for offset in range(0, len(requests), chunk_size):
+                try:
+                    result = await collection.bulk_write(requests[offset:offset + chunk_size], ordered=ordered)
+                    details = result.bulk_api_result if result.acknowledged else None
+                except BulkWriteError as e:
+                    details = e.details
+                merge_result(summary, details, offset)
+                if ordered and summary["write_errors"]:
+                    # 顺序模式下出错后不再执行后续的块
+                    break
+        except Exception as e:
+            # 之前的块已经写入，一并返回已完成部分的统计
+            error_msg = f"批量写入失败（已完成 {summary['chunks']} 块）: {str(e)}"
+            logger.error(error_msg)
+            return {
+                "status": "error",
+                "message": error_msg,
+                "data": summary,
+                "timestamp": datetime.now().isoformat()
+            }
+
+        message = summary_message(summary)
+        logger.info(message)
+        failed = summary["write_errors"] or summary["write_concern_errors"]
+        return {
+            "status": "error" if failed else "success",
+            "message": message,
+            "data": summary,
+            "count": len(requests),
+            "timestamp": datetime.now().isoformat()
+        }
+
+    @traced("mongodb.insert", mongodb_attributes)
+    async def insert_documents(self, documents: List[Dict[str, Any]], ordered: bool = True) -> Dict[str, Any]:
+        """
+        批量插入文档（insert_many）
+
+        Args:
+            documents: 要插入的文档列表
+            ordered: 是否按顺序插入；顺序模式下遇到第一个错误即停止
+
+        Returns:
+            Dict: 包含插入数量和写入错误的结果字典
+        """
+        if self.collection is None:
+            return {
+                "status": "error",
+                "message": "未连接到MongoDB，请先调用connect_to_mongodb方法",
+                "timestamp": datetime.now().isoformat()
+            }
+
+        try:
+            result = await self.collection.insert_many(documents, ordered=ordered)
+            inserted_count = len(result.inserted_ids)
+            logger.info(f"批量插入成功，插入 {inserted_count} 个文档")
+            return {
+                "status": "success",
+                "message": f"批量插入成功，插入 {inserted_count} 个文档",
+                "data": {"inserted_count": inserted_count, "write_errors": []},
+                "count": inserted_count,
+                "timestamp": datetime.now().isoformat()
+            }
+
+        except BulkWriteError as e:
+            inserted_count = e.details.get("nInserted", 0)
+            write_errors = [
+                {"index": error["index"], "code": error.get("code"), "errmsg": error.get("errmsg")}
+                for error in e.details.get("writeErrors", [])
+            ]
+            error_msg = f"批量插入部分失败，插入 {inserted_count} 个文档，{len(write_errors)} 个文档出错"
+            logger.error(error_msg)
+            return {
+                "status": "error",
+                "message": error_msg,
+                "data": {"inserted_count": inserted_count, "write_errors": write_errors},
+                "timestamp": datetime.now().isoformat()
+            }
+        except Exception as e:
+            error_msg = f"批量插入失败: {str(e)}"
+            logger.error(error_msg)
+            return {
+                "status": "error",
+                "message": error_msg,
+                "timestamp": datetime.now().isoformat()
+            }
+
+    async def iter_document_batches(self,
+                                    query_filter: Dict[str, Any] = None,
+                                    projection: Dict[str, Any] = None,
+                                    sort: List[tuple] = None,
+                                    limit: int = None,
+                                    skip: int = None,
+                                    batch_size: int = None) -> AsyncIterator[List[Dict[str, Any]]]:
+        """
+        按游标批次逐批返回查询结果（流式模式）
+
+        与query_documents不同，不会把全部结果读入内存；查询错误直接抛出，由调用方处理
+
+        Args:
+            query_filter: 查询条件字典
+            projection: 投影字段字典
+            sort: 排序条件列表，如 [("field", 1)] 或 [("field", -1)]
+            limit: 限制返回文档数量
+            skip: 跳过文档数量
+            batch_size: 每批文档数量，默认使用QUERY_CONFIG中的stream_batch_size
+
+        Yields:
+            List[Dict]: 一个游标批次的文档
+        """
+        if self.collection is None:
+            raise ConnectionFailure("未连接到MongoDB，请先调用connect_to_mongodb方法")
+
+        if batch_size is None:
+            batch_size = Config.get_query_config()["stream_batch_size"]
+
+        # 如果projection为空字典，则表示返回所有字段
+        if projection == {}:
+            projection = None
+
+        cursor = self.collection.find(query_filter or {}, projection, batch_size=batch_size)
+        if sort:
+            cursor = cursor.sort(sort)
+        if skip is not None:
+            cursor = cursor.skip(skip)
+        if limit is not None:
+            cursor = cursor.limit(limit)
+
+        try:
+            while True:
+                documents = await cursor.to_list(length=batch_size)
+                if not documents:
+                    break
+
+                # 转换ObjectId、Decimal128等MongoDB类型（包括嵌套字段）
+                documents = encode_documents(documents)
+
+                yield documents
+        finally:
+            await cursor.close()
+
+    async def iter_aggregate_batches(self,
+                                     pipeline: List[Dict[str, Any]],
+                                     batch_size: int = None) -> AsyncIterator[List[Dict[str, Any]]]:
+        """
+        按游标批次逐批返回聚合结果（流式模式）
+
+        Args:
+            pipeline: 聚合管道列表
+            batch_size: 每批文档数量，默认使用QUERY_CONFIG中的stream_batch_size
+
+        Yields:
+            List[Dict]: 一个游标批次的文档
+        """
+        if self.collection is None:
+            raise ConnectionFailure("未连接到MongoDB，请先调用connect_to_mongodb方法")
+
+        if batch_size is None:
+            batch_size = Config.get_query_config()["stream_batch_size"]
+
+        cursor = self.collection.aggregate(pipeline, batchSize=batch_size)
+
+        try:
+            while True:
+                documents = await cursor.to_list(length=batch_size)
+                if not documents:
+                    break
+
+                # 转换ObjectId、Decimal128等MongoDB类型（包括嵌套字段）
+                documents = encode_documents(documents)
+
+                yield documents
+        finally:
+            await cursor.close()
+
+    async def iter_aggregate_arrow_batches(self,
+                                           pipeline: List[Dict[str, Any]],
+                                           schema: Dict[str, str] = None,
+                                           batch_size: int = None) -> AsyncIterator[Any]:
+        """
+        按游标批次把聚合结果直接解码为Arrow RecordBatch（流式模式stream_format=arrow）
+
+        Args:
+            pipeline: 聚合管道列表
+            schema: 字段名 -> 类型名，None表示根据第一个批次推断
+            batch_size: 每批文档数量，默认使用QUERY_CONFIG中的stream_batch_size
+
+        Yields:
+            pyarrow.RecordBatch: 一个游标批次的结果，所有批次的schema相同
+
+        Raises:
+            ArrowDecodeError: 未安装pyarrow、schema不合法或结果与schema不符
+        """
+        if self.collection is None:
+            raise ConnectionFailure("未连接到MongoDB，请先调用connect_to_mongodb方法")
+
+        if batch_size is None:
+            batch_size = Config.get_query_config()["stream_batch_size"]
+
+        decoder = ArrowBatchDecoder(schema)
+        cursor = self.collection.aggregate_raw_batches(pipeline, batchSize=batch_size)
+
+        try:
+            async for raw_batch in cursor:
+                batch = decoder.decode(raw_batch)
+                if batch is not None:
+                    yield batch
+        finally:
+            await cursor.close()
+
+    @traced("mongodb.collection_stats", mongodb_attributes)
+    async def get_collection_stats(self) -> Dict[str, Any]:
+        """
+        获取集合统计信息
+
+        Returns:
+            Dict: 包含集合统计信息的字典
+        """
+        if self.collection is None:
+            return {
+                "status": "error",
+                "message": "未连接到MongoDB，请先调用connect_to_mongodb方法",
+                "timestamp": datetime.now().isoformat()
+            }
+
+        try:
+            # 获取集合统计信息
+            stats = await self.db.command("collstats", self.collection.name)
+
+            return {
+                "status": "success",
+                "message": "获取集合统计信息成功",
+                "data": {
+                    "collection_name": stats.get("ns", ""),
+                    "count": stats.get("count", 0),
+                    "size": stats.get("size", 0),
+                    "avgObjSize": stats.get("avgObjSize", 0),
+                    "storageSize": stats.get("storageSize", 0),
+                    "indexes": stats.get("nindexes", 0)
+                },
+                "timestamp": datetime.now().isoformat()
+            }
+
+        except Exception as e:
+            error_msg = f"获取集合统计信息失败: {str(e)}"
+            logger.error(error_msg)
+            return {
+                "status": "error",
+                "message": error_msg,
+                "timestamp": datetime.now().isoformat()
+            }
+
+    def close_connection(self) -> Dict[str, Any]:
+        """
+        关闭MongoDB连接（Motor的close为同步操作，可直接在finally中调用）
+
+        Returns:
+            Dict: 包含关闭状态信息的字典
+        """
+        try:
+            if self.client and self.pooled_connection_string is not None:
+                # 连接池中的客户端只归还，不断开
+                async_mongo_client_pool.release(self.pooled_connection_string)
+                self.pooled_connection_string = None
+                self.client = None
+                self.db = None
+                self.collection = None
+
+                return {
+                    "status": "success",
+                    "message": "MongoDB连接已归还到连接池",
+                    "timestamp": datetime.now().isoformat()
+                }
+            elif self.client:
+                self.client.close()
+                self.client = None
+                self.db = None
+                self.collection = None
+
+                logger.info("MongoDB连接已关闭")
+
+                return {
+                    "status": "success",
+                    "message": "MongoDB连接已关闭",
+                    "timestamp": datetime.now().isoformat()
+                }
+            else:
+                return {
+                    "status": "info",
+                    "message": "没有活动的MongoDB连接",
+                    "timestamp": datetime.now().isoformat()
+                }
+
+        except Exception as e:
+            error_msg = f"关闭连接时发生错误: {str(e)}"
+            logger.error(error_msg)
+            return {
+                "status": "error",
+                "message": error_msg,
+                "timestamp": datetime.now().isoformat()
+            }
+
+    def __del__(self):
+        """析构函数，确保连接被关闭"""
+        self.close_connection()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Arrow聚合结果解码基准测试
+用预先编码的原始BSON批次模拟聚合游标（不连接数据库），对比：
+- 旧的字典路径：逐文档解码为字典 -> encode_documents -> 按列转换为Arrow表（或编码为JSON）
+- ArrowBatchDecoder：原始BSON批次直接解码为RecordBatch（bson解码 / pymongoarrow）
+
+用法:
+    python benchmarks/bench_arrow_aggregate.py [--rows 200000] [--batch-size 10000]
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+import bson
+from bson import Decimal128, ObjectId
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import arrow_decoding  # noqa: E402
+from arrow_decoding import ArrowBatchDecoder  # noqa: E402
+from bson_encoder import encode_documents  # noqa: E402
+from columnar import to_arrow_table  # noqa: E402
+from json_encoding import dumps  # noqa: E402
+
+
+def generate_raw_batches(num_rows: int, batch_size: int) -> list:
+    """生成与$group输出结构相同的扁平行，并按游标批次编码为原始BSON"""
+    base_time = datetime(2024, 1, 1)
+    batches = []
+    for start in range(0, num_rows, batch_size):
+        batches.append(b"".join(bson.encode({
+            "_id": ObjectId(),
+            "department": random.choice(["技术部", "销售部", "市场部", "人事部", "财务部"]),
+            "count": random.randint(1, 1000),
+            "avg_age": random.uniform(20, 60),
+            "total_salary": Decimal128(f"{random.randint(5000, 5000000)}.{random.randint(0, 99):02d}"),
+            "last_login": base_time + timedelta(seconds=random.randint(0, 10 ** 7))
+        }) for _ in range(min(batch_size, num_rows - start))))
+    return batches
+
+
+def dict_to_arrow(raw_batches: list) -> int:
+    documents = []
+    for raw_batch in raw_batches:
+        documents.extend(encode_documents(bson.decode_all(raw_batch)))
+    return to_arrow_table(documents).num_rows
+
+
+def dict_to_json(raw_batches: list) -> int:
+    documents = []
+    for raw_batch in raw_batches:
+        documents.extend(encode_documents(bson.decode_all(raw_batch)))
+    dumps(documents)
+    return len(documents)
+
+
+def batch_decoder(raw_batches: list) -> int:
+    decoder = ArrowBatchDecoder()
+    return sum(decoder.decode(raw_batch).num_rows for raw_batch in raw_batches)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Arrow聚合结果解码基准测试")
+    parser.add_argument("--rows", type=int, default=200000, help="结果行数")
+    parser.add_argument("--batch-size", type=int, default=10000, help="每个游标批次的行数")
+    args = parser.parse_args()
+
+    random.seed(42)
+    raw_batches = generate_raw_batches(args.rows, args.batch_size)
+
+    candidates = [
+        ("字典 -> JSON (旧实现)", dict_to_json),
+        ("字典 -> Arrow表", dict_to_arrow),
+    ]
+    native_context = arrow_decoding.PyMongoArrowContext
+    if native_context is not None:
+        candidates.append(("ArrowBatchDecoder (pymongoarrow)", batch_decoder))
+
+    def bson_decoder(batches: list) -> int:
+        arrow_decoding.PyMongoArrowContext = None
+        try:
+            return batch_decoder(batches)
+        finally:
+            arrow_decoding.PyMongoArrowContext = native_context
+
+    candidates.append(("ArrowBatchDecoder (bson)", bson_decoder))
+
+    print(f"行数: {args.rows}, 批次大小: {args.batch_size}, 原始BSON: {sum(map(len, raw_batches)) / 1024 / 1024:.1f} MB")
+    print(f"{'处理方式':<36}{'耗时(ms)':>12}{'行/秒':>14}{'相对旧实现':>12}")
+    baseline_ms = None
+    for label, run in candidates:
+        start = time.perf_counter()
+        rows = run(raw_batches)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        if baseline_ms is None:
+            baseline_ms = elapsed_ms
+        print(f"{label:<36}{elapsed_ms:>12.1f}{rows / elapsed_ms * 1000:>14.0f}{baseline_ms / elapsed_ms:>11.1f}x")
+
+
+if __name__ == "__main__":
+    main()
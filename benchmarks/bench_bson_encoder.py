@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+BSON类型转换基准测试
+在多层嵌套的文档上对比旧的逐文档处理（只转换顶层_id，嵌套类型留给JSON编码的default回调）
+与encode_documents一次遍历转换所有层级的耗时，以及两者之后每次编码响应的耗时
+
+旧实现每次编码响应（包括缓存命中）都要通过default回调转换嵌套类型，
+encode_documents只在查询时转换一次，缓存的结果已经是JSON原生类型
+
+用法:
+    python benchmarks/bench_bson_encoder.py [--docs 1000] [--depth 4] [--rounds 20]
+"""
+
+import argparse
+import copy
+import gc
+import json
+import os
+import random
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from bson import Binary, Decimal128, ObjectId, json_util
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bson_encoder import encode_documents  # noqa: E402
+from json_encoding import dumps, orjson  # noqa: E402
+
+
+def generate_node(depth: int) -> dict:
+    """生成一层嵌套的子文档，包含ObjectId、Decimal128、datetime、Binary等类型"""
+    node = {
+        "ref_id": ObjectId(),
+        "amount": Decimal128(f"{random.randint(0, 100000)}.{random.randint(0, 99):02d}"),
+        "updated_at": datetime(2024, 1, 1) + timedelta(seconds=random.randint(0, 10 ** 7)),
+        "label": f"节点{random.randint(0, 1000)}",
+        "score": random.random(),
+        "flags": [random.randint(0, 9) for _ in range(3)]
+    }
+    if depth > 1:
+        node["child"] = generate_node(depth - 1)
+        node["items"] = [{"sku": ObjectId(), "qty": random.randint(1, 5)} for _ in range(2)]
+    return node
+
+
+def generate_documents(num_docs: int, depth: int) -> list:
+    return [{
+        "_id": ObjectId(),
+        "name": f"用户{i}",
+        "token": Binary.from_uuid(uuid.uuid4()),
+        "avatar": Binary(os.urandom(16)),
+        "profile": generate_node(depth)
+    } for i in range(num_docs)]
+
+
+def legacy_convert(documents: list) -> list:
+    """旧实现：只处理顶层_id"""
+    for doc in documents:
+        if '_id' in doc:
+            doc['_id'] = str(doc['_id'])
+    return documents
+
+
+def legacy_default(value):
+    """旧实现的JSON编码兜底：嵌套的ObjectId、Decimal128等在每次编码响应时转字符串"""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+def legacy_dumps(value) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(value, default=legacy_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"), default=legacy_default).encode("utf-8")
+
+
+def measure(run, inputs: list) -> float:
+    # 与timeit一样关闭垃圾回收，避免大量副本触发的回收计入耗时
+    gc.disable()
+    try:
+        start = time.perf_counter()
+        for value in inputs:
+            run(value)
+        return (time.perf_counter() - start) * 1000 / len(inputs)
+    finally:
+        gc.enable()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="BSON类型转换基准测试")
+    parser.add_argument("--docs", type=int, default=1000, help="每批文档数")
+    parser.add_argument("--depth", type=int, default=4, help="文档嵌套层数")
+    parser.add_argument("--rounds", type=int, default=20, help="重复次数")
+    args = parser.parse_args()
+
+    random.seed(42)
+    documents = generate_documents(args.docs, args.depth)
+    legacy_converted = legacy_convert(copy.deepcopy(documents))
+    converted = encode_documents(documents)
+
+    # 查询时的转换只执行一次，之后每次响应（包括缓存命中）都要编码JSON
+    candidates = [
+        ("查询: 顶层_id循环 (旧实现)", legacy_convert, True),
+        ("查询: encode_documents", encode_documents, False),
+        ("响应: default回调 (旧实现)", lambda value: legacy_dumps(legacy_converted), False),
+        ("响应: 已转换的文档", lambda value: dumps(converted), False),
+        ("参考: json_util.dumps", json_util.dumps, False)
+    ]
+
+    print(f"文档数: {args.docs}, 嵌套层数: {args.depth}, 重复次数: {args.rounds}, "
+          f"orjson: {'已安装' if orjson is not None else '未安装（使用json）'}")
+    print(f"{'处理方式':<30}{'每批(ms)':>12}{'每文档(µs)':>14}")
+    for label, run, mutates in candidates:
+        # 旧实现会原地修改文档，每轮使用新的副本（复制耗时不计入）
+        inputs = [copy.deepcopy(documents) if mutates else documents for _ in range(args.rounds)]
+        elapsed_ms = measure(run, inputs)
+        print(f"{label:<30}{elapsed_ms:>12.3f}{elapsed_ms * 1000 / args.docs:>14.2f}")
+
+
+if __name__ == "__main__":
+    main()
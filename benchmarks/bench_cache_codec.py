@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+缓存编解码基准测试
+对比旧的JSON路径（json.dumps(default=str) / json.loads）与BSON、msgpack及zstd/lz4压缩的
+编码耗时、解码耗时和序列化后的大小
+
+用法:
+    python benchmarks/bench_cache_codec.py [--docs 1000] [--rounds 50]
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+from bson import Decimal128, ObjectId
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cache_codec import CacheCodec, lz4_frame, msgpack, zstandard  # noqa: E402
+
+
+def generate_result(num_docs: int) -> dict:
+    """生成与/query接口缓存内容结构一致的结果字典"""
+    departments = ["技术部", "销售部", "市场部", "人事部", "财务部"]
+    base_time = datetime(2024, 1, 1)
+    data = []
+    for i in range(num_docs):
+        data.append({
+            "_id": ObjectId(),
+            "name": f"用户{i}",
+            "age": random.randint(20, 60),
+            "department": random.choice(departments),
+            "salary": Decimal128(f"{random.randint(5000, 50000)}.{random.randint(0, 99):02d}"),
+            "created_at": base_time + timedelta(seconds=random.randint(0, 10 ** 7)),
+            "tags": [f"tag{random.randint(0, 20)}" for _ in range(3)],
+            "address": {"city": random.choice(["北京", "上海", "深圳"]), "zip": f"{random.randint(100000, 999999)}"}
+        })
+    return {
+        "status": "success",
+        "message": f"查询成功，返回 {num_docs} 条文档",
+        "timestamp": datetime.now().isoformat(),
+        "count": num_docs,
+        "data": data
+    }
+
+
+def legacy_json_encode(value) -> bytes:
+    return json.dumps(value, default=str).encode("utf-8")
+
+
+def legacy_json_decode(data: bytes):
+    return json.loads(data)
+
+
+def measure(encode, decode, value, rounds: int):
+    encoded = encode(value)
+    start = time.perf_counter()
+    for _ in range(rounds):
+        encode(value)
+    encode_ms = (time.perf_counter() - start) * 1000 / rounds
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        decode(encoded)
+    decode_ms = (time.perf_counter() - start) * 1000 / rounds
+    return encode_ms, decode_ms, len(encoded)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="缓存编解码基准测试")
+    parser.add_argument("--docs", type=int, default=1000, help="每个结果包含的文档数")
+    parser.add_argument("--rounds", type=int, default=50, help="每种编码重复的次数")
+    args = parser.parse_args()
+
+    random.seed(42)
+    value = generate_result(args.docs)
+
+    candidates = [("json (旧实现)", legacy_json_encode, legacy_json_decode)]
+    combos = [("json", "none"), ("bson", "none")]
+    if msgpack is not None:
+        combos.append(("msgpack", "none"))
+    for compression, module in (("zstd", zstandard), ("lz4", lz4_frame)):
+        if module is not None:
+            combos.append(("bson", compression))
+            if msgpack is not None:
+                combos.append(("msgpack", compression))
+    for codec_name, compression in combos:
+        codec = CacheCodec(codec_name, compression, compress_min_bytes=0)
+        label = codec_name if compression == "none" else f"{codec_name}+{compression}"
+        candidates.append((label, codec.encode, codec.decode))
+
+    print(f"文档数: {args.docs}, 重复次数: {args.rounds}")
+    print(f"{'编码':<16}{'编码(ms)':>12}{'解码(ms)':>12}{'大小(bytes)':>14}{'相对JSON':>10}")
+    baseline_size = None
+    for label, encode, decode in candidates:
+        encode_ms, decode_ms, size = measure(encode, decode, value, args.rounds)
+        if baseline_size is None:
+            baseline_size = size
+        print(f"{label:<16}{encode_ms:>12.3f}{decode_ms:>12.3f}{size:>14}{size / baseline_size:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
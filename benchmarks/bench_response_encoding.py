@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+查询响应编码基准测试
+对比旧的响应路径（ApiResponse(**result) -> FastAPI按response_model校验和jsonable_encoder -> JSONResponse）
+与新的响应路径（api_response直接编码结果字典）每个文档的CPU耗时
+
+用法:
+    python benchmarks/bench_response_encoding.py [--docs 1000] [--rounds 50]
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi_mongodb import ApiResponse, api_response, app  # noqa: E402
+from json_encoding import orjson  # noqa: E402
+
+
+def generate_result(num_docs: int) -> dict:
+    """生成与/query接口返回结构一致的结果字典（_id已转为字符串）"""
+    departments = ["技术部", "销售部", "市场部", "人事部", "财务部"]
+    base_time = datetime(2024, 1, 1)
+    data = []
+    for i in range(num_docs):
+        data.append({
+            "_id": f"{i:024x}",
+            "name": f"用户{i}",
+            "age": random.randint(20, 60),
+            "department": random.choice(departments),
+            "salary": random.randint(5000, 50000) + random.randint(0, 99) / 100,
+            "created_at": base_time + timedelta(seconds=random.randint(0, 10 ** 7)),
+            "tags": [f"tag{random.randint(0, 20)}" for _ in range(3)],
+            "address": {"city": random.choice(["北京", "上海", "深圳"]), "zip": f"{random.randint(100000, 999999)}"}
+        })
+    return {
+        "status": "success",
+        "message": f"查询成功，返回 {num_docs} 个文档",
+        "data": data,
+        "count": num_docs,
+        "cache_ttl": 300,
+        "timestamp": datetime.now().isoformat()
+    }
+
+
+def legacy_encoder():
+    """旧路径：与接口返回ApiResponse时FastAPI的处理相同"""
+    route = next(route for route in app.routes if getattr(route, "path", None) == "/query")
+    loop = asyncio.new_event_loop()
+
+    def encode(result: dict) -> bytes:
+        content = loop.run_until_complete(serialize_response(
+            field=route.response_field,
+            response_content=ApiResponse(**result),
+            is_coroutine=True
+        ))
+        return JSONResponse(content).body
+
+    return encode
+
+
+def fast_encode(result: dict) -> bytes:
+    return api_response(result).body
+
+
+def measure(encode, result: dict, rounds: int) -> float:
+    encode(result)
+    start = time.perf_counter()
+    for _ in range(rounds):
+        encode(result)
+    return (time.perf_counter() - start) * 1000 / rounds
+
+
+def main():
+    parser = argparse.ArgumentParser(description="查询响应编码基准测试")
+    parser.add_argument("--docs", type=int, default=1000, help="每个结果包含的文档数")
+    parser.add_argument("--rounds", type=int, default=50, help="每种编码重复的次数")
+    args = parser.parse_args()
+
+    random.seed(42)
+    result = generate_result(args.docs)
+
+    print(f"文档数: {args.docs}, 重复次数: {args.rounds}, orjson: {'已安装' if orjson is not None else '未安装（使用json）'}")
+    print(f"{'响应路径':<26}{'每次(ms)':>12}{'每文档(µs)':>14}{'相对旧路径':>12}")
+    baseline_ms = None
+    for label, encode in (("ApiResponse (旧实现)", legacy_encoder()), ("api_response", fast_encode)):
+        elapsed_ms = measure(encode, result, args.rounds)
+        if baseline_ms is None:
+            baseline_ms = elapsed_ms
+        print(f"{label:<26}{elapsed_ms:>12.3f}{elapsed_ms * 1000 / args.docs:>14.2f}{elapsed_ms / baseline_ms:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+基准测试数据生成
+按example_usage.py中users集合的结构批量生成文档（姓名、年龄、邮箱、部门、职位、薪资、状态、入职日期），
+相同的seed生成相同的数据，保证多次测试结果可以对比
+
+用法:
+    python benchmarks/data_generator.py [--count 100000] [--connection-string mongodb://localhost:27017/]
+"""
+
+import argparse
+import random
+from datetime import date, timedelta
+from typing import Any, Dict, Iterator, List
+
+from pymongo import MongoClient
+
+DEPARTMENTS = {
+    "技术部": ["软件工程师", "高级工程师", "架构师", "测试工程师"],
+    "销售部": ["销售代表", "销售经理", "客户经理"],
+    "人事部": ["HR专员", "招聘经理"],
+    "市场部": ["市场专员", "品牌经理"],
+    "财务部": ["会计", "财务经理"]
+}
+SURNAMES = "张李王赵钱孙周吴郑冯陈褚卫蒋沈韩杨朱秦许"
+GIVEN_NAMES = "伟芳娜敏静丽强磊军洋勇艳杰涛明超秀霞平刚"
+
+
+def generate_users(count: int, seed: int = 42) -> Iterator[Dict[str, Any]]:
+    """
+    生成users集合的文档
+
+    Args:
+        count: 文档数量
+        seed: 随机种子
+
+    Returns:
+        Iterator[Dict]: 逐个生成的文档
+    """
+    rng = random.Random(seed)
+    departments = list(DEPARTMENTS)
+    first_day = date(2015, 1, 1)
+    for i in range(count):
+        department = rng.choice(departments)
+        yield {
+            "name": rng.choice(SURNAMES) + rng.choice(GIVEN_NAMES) + rng.choice(["", *GIVEN_NAMES]),
+            "age": rng.randint(20, 60),
+            "email": f"user{i}@example.com",
+            "department": department,
+            "position": rng.choice(DEPARTMENTS[department]),
+            "salary": rng.randrange(5000, 50000, 500),
+            "status": "active" if rng.random() < 0.85 else "inactive",
+            "join_date": (first_day + timedelta(days=rng.randint(0, 3650))).isoformat()
+        }
+
+
+def generate_batches(count: int, batch_size: int = 5000, seed: int = 42) -> Iterator[List[Dict[str, Any]]]:
+    """按批次生成文档，用于insert_many"""
+    batch = []
+    for document in generate_users(count, seed):
+        batch.append(document)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def load_users(collection: Any, count: int, seed: int = 42, drop: bool = True) -> int:
+    """
+    把生成的文档写入集合（同步pymongo集合或兼容的集合对象）
+
+    Args:
+        collection: 目标集合
+        count: 文档数量
+        seed: 随机种子
+        drop: 写入前是否清空集合
+
+    Returns:
+        int: 写入的文档数量
+    """
+    if drop:
+        collection.delete_many({})
+    inserted = 0
+    for batch in generate_batches(count, seed=seed):
+        collection.insert_many(batch, ordered=False)
+        inserted += len(batch)
+    return inserted
+
+
+def main():
+    parser = argparse.ArgumentParser(description="生成基准测试数据（users集合）")
+    parser.add_argument("--connection-string", default="mongodb://localhost:27017/", help="MongoDB连接字符串")
+    parser.add_argument("--database", default="test_db", help="数据库名称")
+    parser.add_argument("--collection", default="users", help="集合名称")
+    parser.add_argument("--count", type=int, default=100000, help="文档数量")
+    parser.add_argument("--seed", type=int, default=42, help="随机种子")
+    parser.add_argument("--append", action="store_true", help="追加写入，不清空集合")
+    args = parser.parse_args()
+
+    client = MongoClient(args.connection_string, serverSelectionTimeoutMS=5000)
+    try:
+        collection = client[args.database][args.collection]
+        inserted = load_users(collection, args.count, args.seed, drop=not args.append)
+        print(f"已写入 {inserted} 个文档到 {args.database}.{args.collection}")
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,364 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+端到端负载测试
+按场景（冷查询、缓存命中、深度skip、大结果集聚合等）并发请求各个接口，统计吞吐量、p50/p99延迟和内存，
+可以保存为基准并在之后与基准对比（超出容差或错误数比基准多时退出码为1，可用于CI）
+
+运行方式:
+- --backend memory: 在进程内运行应用，MongoDB和Redis使用内存替身（需要安装mongomock-motor和fakeredis），
+  不依赖任何外部服务；替身的查询性能与mongod不同，只适合对比本项目代码（缓存、编码、中间件等）的变化
+- --backend local: 在进程内运行应用，连接本地mongod（--connection-string）和Redis（config.py中的REDIS_CONFIG）
+- --url http://localhost:8000: 对已启动的服务发请求，数据需事先用data_generator.py写入，不统计内存
+
+用法:
+    python benchmarks/load_test.py --backend memory --save-baseline benchmarks/baseline.json
+    python benchmarks/load_test.py --backend memory --baseline benchmarks/baseline.json
+    python benchmarks/load_test.py --backend local --scenarios query_cold,deep_skip --requests 500
+
+需要安装httpx（进程内运行时通过ASGI直接调用应用，不经过网络）
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import logging
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from data_generator import DEPARTMENTS, generate_batches  # noqa: E402
+
+# 场景：请求序号 -> (路径, 请求体)
+Scenario = Callable[[int], Tuple[str, Dict[str, Any]]]
+
+# 对比基准时各指标的方向：1表示越大越好，-1表示越小越好
+COMPARED_METRICS = {"throughput_rps": 1, "p50_ms": -1, "p99_ms": -1, "peak_memory_mb": -1}
+
+
+def build_scenarios(connection: Dict[str, str], docs: int) -> Dict[str, Scenario]:
+    """
+    各接口的测试场景
+
+    - *_cold: cache_ttl=0，每次都查询数据库，且每个请求的条件不同
+    - *_cached: 条件固定，预热后都命中缓存
+    - deep_skip: 跳过接近集合末尾的文档（skip需要逐条跳过）
+    - aggregate_large: 返回大部分文档的聚合，主要消耗在游标读取、类型转换和响应编码
+
+    Args:
+        connection: 连接字符串、数据库和集合名称
+        docs: 集合中的文档数量
+    """
+    departments = list(DEPARTMENTS)
+
+    def query_cold(i: int):
+        return "/query", {**connection, "query_filter": {"age": {"$gte": 20 + i % 40}, "department": departments[i % 5]},
+                          "sort": [["age", 1]], "limit": 50, "cache_ttl": 0}
+
+    def query_cached(i: int):
+        return "/query", {**connection, "query_filter": {"age": {"$gte": 30}, "department": "技术部"},
+                          "sort": [["age", 1]], "limit": 50}
+
+    def query_one_cold(i: int):
+        return "/query_one", {**connection, "query_filter": {"email": f"user{i * 7919 % docs}@example.com"}, "cache_ttl": 0}
+
+    def query_one_cached(i: int):
+        return "/query_one", {**connection, "query_filter": {"email": "user1@example.com"}}
+
+    def distinct_cold(i: int):
+        return "/distinct", {**connection, "field": "position", "query_filter": {"department": departments[i % 5]},
+                             "cache_ttl": 0}
+
+    def distinct_cached(i: int):
+        return "/distinct", {**connection, "field": "position", "query_filter": {"department": "技术部"}}
+
+    def deep_skip(i: int):
+        return "/query", {**connection, "query_filter": {}, "sort": [["_id", 1]],
+                          "skip": max(0, docs - 100 - i % 50), "limit": 20, "cache_ttl": 0}
+
+    def aggregate_group(i: int):
+        return "/aggregate", {**connection, "pipeline": [
+            {"$match": {"age": {"$gte": 20 + i % 40}}},
+            {"$group": {"_id": "$department", "avg_salary": {"$avg": "$salary"}, "count": {"$sum": 1}}}
+        ], "cache_ttl": 0}
+
+    def aggregate_large(i: int):
+        return "/aggregate", {**connection, "pipeline": [
+            {"$match": {"status": "active", "age": {"$gte": 20 + i % 3}}},
+            {"$project": {"_id": 0, "name": 1, "age": 1, "department": 1, "salary": 1, "join_date": 1}}
+        ], "cache_ttl": 0}
+
+    def batch_cached(i: int):
+        return "/batch", {"operations": [
+            {"op": "query", **query_cached(i)[1]},
+            {"op": "query_one", **query_one_cached(i)[1]},
+            {"op": "distinct", **distinct_cached(i)[1]},
+            {"op": "aggregate", **connection, "pipeline": [{"$group": {"_id": "$status", "count": {"$sum": 1}}}]}
+        ]}
+
+    return {
+        "query_cold": query_cold,
+        "query_cached": query_cached,
+        "query_one_cold": query_one_cold,
+        "query_one_cached": query_one_cached,
+        "distinct_cold": distinct_cold,
+        "distinct_cached": distinct_cached,
+        "deep_skip": deep_skip,
+        "aggregate_group": aggregate_group,
+        "aggregate_large": aggregate_large,
+        "batch_cached": batch_cached
+    }
+
+
+def percentile(sorted_values: List[float], percent: float) -> float:
+    """已排序数据的百分位（最近秩）"""
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, int(round(percent / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def is_error(response: httpx.Response) -> bool:
+    """HTTP错误或接口返回status=error（响应的第一个字段是status，不需要解析整个响应）"""
+    return response.status_code != 200 or response.content.startswith(b'{"status":"error"')
+
+
+async def run_requests(client: httpx.AsyncClient, scenario: Scenario, count: int,
+                       concurrency: int) -> Tuple[List[float], int, float]:
+    """
+    用concurrency个并发任务发送count个请求
+
+    Returns:
+        Tuple: (每个请求的延迟（毫秒）, 错误数, 总耗时（秒）)
+    """
+    latencies: List[float] = []
+    errors = 0
+    sequence = iter(range(count))
+
+    async def worker():
+        nonlocal errors
+        for i in sequence:
+            path, body = scenario(i)
+            start = time.perf_counter()
+            response = await client.post(path, json=body)
+            latencies.append((time.perf_counter() - start) * 1000)
+            if is_error(response):
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, errors, time.perf_counter() - start
+
+
+async def run_scenario(client: httpx.AsyncClient, name: str, scenario: Scenario, args: argparse.Namespace,
+                       measure_memory: bool) -> Dict[str, Any]:
+    """预热后计时运行一个场景；进程内运行时再用tracemalloc跑一轮较短的请求统计内存峰值"""
+    await run_requests(client, scenario, args.warmup, 1)
+    latencies, errors, elapsed = await run_requests(client, scenario, args.requests, args.concurrency)
+    latencies.sort()
+    result = {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput_rps": round(len(latencies) / elapsed, 1),
+        "mean_ms": round(sum(latencies) / len(latencies), 3),
+        "p50_ms": round(percentile(latencies, 50), 3),
+        "p99_ms": round(percentile(latencies, 99), 3),
+        "max_ms": round(latencies[-1], 3),
+        "peak_memory_mb": None
+    }
+    if measure_memory:
+        # tracemalloc会明显拖慢请求，单独运行，不影响上面的计时
+        tracemalloc.start()
+        await run_requests(client, scenario, min(args.requests, args.memory_requests), args.concurrency)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        result["peak_memory_mb"] = round(peak / 1024 / 1024, 2)
+    return result
+
+
+async def seed_collection(collection: Any, docs: int, seed: int):
+    """写入测试数据（Motor或内存替身的异步集合）"""
+    await collection.delete_many({})
+    for batch in generate_batches(docs, seed=seed):
+        await collection.insert_many(batch, ordered=False)
+
+
+def use_memory_backend():
+    """把MongoDB客户端和Redis客户端替换为内存替身"""
+    import fakeredis
+    import mongomock_motor
+    import mongo_client_pool
+    from redis_cache import async_redis_cache
+
+    mongo_client_pool.AsyncIOMotorClient = mongomock_motor.AsyncMongoMockClient
+    async_redis_cache.client = fakeredis.aioredis.FakeRedis(server=fakeredis.FakeServer())
+
+
+@contextlib.asynccontextmanager
+async def in_process_client(args: argparse.Namespace, connection: Dict[str, str]):
+    """在进程内启动应用（执行lifespan），写入测试数据，返回通过ASGI直接调用应用的客户端"""
+    if args.backend == "memory":
+        use_memory_backend()
+    from fastapi_mongodb import app
+    from mongo_client_pool import async_mongo_client_pool
+
+    async with app.router.lifespan_context(app):
+        client = await async_mongo_client_pool.acquire(args.connection_string)
+        try:
+            await seed_collection(client[args.database][args.collection], args.docs, args.seed)
+        finally:
+            async_mongo_client_pool.release(args.connection_string)
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as http_client:
+            yield http_client
+
+
+def compare_with_baseline(results: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """
+    与基准对比，打印各指标的变化
+
+    Args:
+        results: 本次结果
+        baseline: 基准结果
+        tolerance: 容差（0.15表示变差超过15%视为退化）
+
+    Returns:
+        List[str]: 退化的指标（错误数比基准多的场景也视为退化）
+    """
+    if results["meta"]["config"] != baseline["meta"]["config"]:
+        print(f"注意：测试参数与基准不同\n  本次: {results['meta']['config']}\n  基准: {baseline['meta']['config']}")
+
+    regressions = []
+    print(f"\n与基准对比（{baseline['meta']['timestamp']}，容差 {tolerance:.0%}）")
+    print(f"{'场景':<20}" + "".join(f"{metric:>18}" for metric in COMPARED_METRICS))
+    for name, current in results["scenarios"].items():
+        previous = baseline["scenarios"].get(name)
+        if previous is None:
+            print(f"{name:<20}  基准中没有该场景")
+            continue
+        # 接口出错时通常返回得更快，延迟和吞吐量会显得“变好”，所以先检查错误数
+        if current["errors"] > previous.get("errors", 0):
+            regressions.append(f"{name}.errors: {previous.get('errors', 0)} -> {current['errors']}")
+            print(f"{name:<20}  错误数增加: {previous.get('errors', 0)} -> {current['errors']}（不对比延迟和吞吐量）")
+            continue
+        cells = []
+        for metric, direction in COMPARED_METRICS.items():
+            if not current.get(metric) or not previous.get(metric):
+                cells.append(f"{'-':>18}")
+                continue
+            change = current[metric] / previous[metric] - 1
+            regressed = change * direction < -tolerance
+            if regressed:
+                regressions.append(f"{name}.{metric}: {previous[metric]} -> {current[metric]} ({change:+.1%})")
+            cells.append(f"{change:>+16.1%}{' !' if regressed else '  '}")
+        print(f"{name:<20}" + "".join(cells))
+    return regressions
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    connection = {
+        "connection_string": args.connection_string,
+        "database_name": args.database,
+        "collection_name": args.collection
+    }
+    scenarios = build_scenarios(connection, args.docs)
+    selected = args.scenarios.split(",") if args.scenarios else list(scenarios)
+    unknown = [name for name in selected if name not in scenarios]
+    if unknown:
+        raise SystemExit(f"未知的场景: {unknown}，可选: {', '.join(scenarios)}")
+
+    if args.url:
+        client_context = httpx.AsyncClient(base_url=args.url, timeout=None)
+    else:
+        client_context = in_process_client(args, connection)
+
+    out = sys.stdout
+    results = {}
+    print(f"{'场景':<20}{'请求数':>8}{'错误':>6}{'吞吐量(rps)':>14}{'p50(ms)':>10}{'p99(ms)':>10}{'内存峰值(MB)':>14}")
+    async with client_context as client:
+        for name in selected:
+            # 应用每个请求都会打印日志，测试期间丢弃
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                result = await run_scenario(client, name, scenarios[name], args, measure_memory=not args.url)
+            results[name] = result
+            memory = "-" if result["peak_memory_mb"] is None else result["peak_memory_mb"]
+            print(f"{name:<20}{result['requests']:>8}{result['errors']:>6}{result['throughput_rps']:>14}"
+                  f"{result['p50_ms']:>10}{result['p99_ms']:>10}{memory:>14}", file=out)
+
+    return {
+        "meta": {
+            "timestamp": datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "config": {
+                "backend": "url" if args.url else args.backend,
+                "docs": args.docs,
+                "requests": args.requests,
+                "concurrency": args.concurrency
+            }
+        },
+        "scenarios": results
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="端到端负载测试与基准对比")
+    parser.add_argument("--backend", choices=["memory", "local"], default="memory",
+                        help="memory: 内存替身；local: 本地mongod/redis")
+    parser.add_argument("--url", help="对已启动的服务发请求（如 http://localhost:8000），不在进程内运行应用")
+    parser.add_argument("--connection-string", default="mongodb://localhost:27017/", help="MongoDB连接字符串")
+    parser.add_argument("--database", default="bench_db", help="数据库名称")
+    parser.add_argument("--collection", default="users", help="集合名称")
+    parser.add_argument("--docs", type=int,
+                        help="写入的文档数量（--url时为已有的文档数量），默认memory为2000，其余为20000")
+    parser.add_argument("--seed", type=int, default=42, help="数据的随机种子")
+    parser.add_argument("--scenarios", help="逗号分隔的场景名称，默认运行全部场景")
+    parser.add_argument("--requests", type=int, default=200, help="每个场景计时的请求数")
+    parser.add_argument("--concurrency", type=int, default=8, help="并发请求数")
+    parser.add_argument("--warmup", type=int, default=10, help="每个场景计时前的预热请求数")
+    parser.add_argument("--memory-requests", type=int, default=50, help="统计内存峰值时的请求数")
+    parser.add_argument("--output", help="把结果写入JSON文件")
+    parser.add_argument("--save-baseline", help="把结果保存为基准（JSON文件）")
+    parser.add_argument("--baseline", help="与基准文件对比，有指标变差超过容差或错误数比基准多时退出码为1")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="对比基准的容差（默认0.15，即15%%）")
+    args = parser.parse_args()
+
+    if args.docs is None:
+        # 内存替身每次查询都会复制整个集合，文档太多时单个请求就要数百毫秒
+        args.docs = 2000 if args.backend == "memory" and not args.url else 20000
+
+    # 应用的INFO日志（每次缓存命中/查询）和慢查询日志会影响计时
+    logging.disable(logging.WARNING)
+    baseline = None
+    if args.baseline:
+        # 先读取基准，--save-baseline指向同一个文件时与旧的基准对比
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    results = asyncio.run(run(args))
+
+    for path in filter(None, (args.output, args.save_baseline)):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"结果已写入 {path}")
+
+    if baseline is not None:
+        regressions = compare_with_baseline(results, baseline, args.tolerance)
+        if regressions:
+            print("\n性能退化:\n  " + "\n  ".join(regressions))
+            sys.exit(1)
+        print("\n没有超出容差的退化")
+
+
+if __name__ == "__main__":
+    main()
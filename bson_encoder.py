@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+BSON类型转换
+查询、聚合、distinct、游标等所有结果路径共用的转换：一次递归遍历，把文档中任意层级的
+MongoDB类型转换为JSON可以表示的值
+
+- ObjectId、Decimal128、Decimal、UUID、Regex等 -> 字符串（Decimal128保留全部精度）
+- Binary（UUID子类型除外）、bytes -> base64字符串
+- Int64 -> int，SON、RawBSONDocument -> dict，tuple -> list
+- datetime保持不变：缓存编解码和JSON响应编码都能直接处理，且保留原始精度
+
+按type()精确匹配分派，常见的str/int/float/dict/list不经过isinstance判断
+"""
+
+import base64
+from datetime import datetime
+from decimal import Decimal
+from collections.abc import Mapping
+from typing import Any, Callable, Dict, List
+from uuid import UUID
+from bson import Binary, Decimal128, Int64, ObjectId
+from bson.binary import UUID_SUBTYPE
+
+
+# Decimal128（BID编码）的系数位、指数偏置
+_COEFFICIENT_MASK = (1 << 113) - 1
+_EXPONENT_BIAS = 6176
+
+
+def decimal128_bid_to_str(bid: bytes) -> str:
+    """
+    Decimal128的BID编码（16字节）转字符串，结果与str(Decimal128.from_bid(bid))相同
+
+    str(Decimal128)每次都在临时的decimal上下文中按位构造Decimal，这里直接从BID编码取出系数和指数
+    """
+    bits = int.from_bytes(bid, "little")
+    if (bits >> 125) & 3 == 3:
+        # 无穷大、NaN等特殊值很少见，交给pymongo处理
+        return str(Decimal128.from_bid(bid))
+    sign = "-" if bits >> 127 else ""
+    exponent = ((bits >> 113) & 0x3FFF) - _EXPONENT_BIAS
+    return str(Decimal(f"{sign}{bits & _COEFFICIENT_MASK}E{exponent}"))
+
+
+def encode_decimal128(value: Decimal128) -> str:
+    """Decimal128转字符串，结果与str(value)相同"""
+    return decimal128_bid_to_str(value.bid)
+
+
+def _encode_binary(value: Binary) -> str:
+    if value.subtype == UUID_SUBTYPE:
+        return str(value.as_uuid())
+    return base64.b64encode(value).decode("ascii")
+
+
+def _encode_bytes(value: bytes) -> str:
+    return base64.b64encode(value).decode("ascii")
+
+
+# 原样返回的类型
+_PASSTHROUGH = frozenset({str, int, float, bool, type(None), datetime})
+
+# 类型 -> 转换函数（只处理标量，dict和list在encode_value中递归）
+_ENCODERS: Dict[type, Callable[[Any], Any]] = {
+    ObjectId: str,
+    Decimal128: encode_decimal128,
+    Decimal: str,
+    UUID: str,
+    Int64: int,
+    Binary: _encode_binary,
+    bytes: _encode_bytes
+}
+
+
+def _encode_other(value: Any) -> Any:
+    """不在分派表中的类型：按基类处理，未知类型转字符串"""
+    if isinstance(value, Mapping):
+        return {key: encode_value(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [encode_value(item) for item in value]
+    for base, encoder in _ENCODERS.items():
+        if isinstance(value, base):
+            return encoder(value)
+    if isinstance(value, (str, int, float, datetime)):
+        return value
+    return str(value)
+
+
+def encode_value(value: Any) -> Any:
+    """
+    递归转换一个值中的MongoDB类型
+
+    Args:
+        value: 文档、列表或标量
+
+    Returns:
+        Any: 转换后的值（dict和list返回新的对象，不修改原值）
+    """
+    value_type = type(value)
+    if value_type in _PASSTHROUGH:
+        return value
+    # 标量在推导式中直接判断，省去一次函数调用
+    if value_type is dict:
+        return {key: item if type(item) in _PASSTHROUGH else encode_value(item) for key, item in value.items()}
+    if value_type is list:
+        return [item if type(item) in _PASSTHROUGH else encode_value(item) for item in value]
+    encoder = _ENCODERS.get(value_type)
+    if encoder is not None:
+        return encoder(value)
+    return _encode_other(value)
+
+
+def encode_documents(documents: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    转换一批文档
+
+    Args:
+        documents: MongoDB返回的文档列表
+
+    Returns:
+        List[Dict]: 转换后的文档列表
+    """
+    return [encode_value(document) for document in documents]
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+批量写入
+把请求中的写操作转换为pymongo的批量写入请求，按块执行bulk_write并合并各块的结果
+
+操作格式与pymongo一致，每个操作是只有一个键的字典：
+- {"insert_one": {"document": {...}}}
+- {"update_one": {"filter": {...}, "update": {...}, "upsert": false, "array_filters": [...]}}
+- {"update_many": {"filter": {...}, "update": {...}, "upsert": false, "array_filters": [...]}}
+- {"replace_one": {"filter": {...}, "replacement": {...}, "upsert": false}}
+- {"delete_one": {"filter": {...}}}
+- {"delete_many": {"filter": {...}}}
+"""
+
+from typing import Any, Dict, List, Optional
+from pymongo import DeleteMany, DeleteOne, InsertOne, ReplaceOne, UpdateMany, UpdateOne
+from pymongo.errors import ConfigurationError
+from pymongo.write_concern import WriteConcern
+
+# 操作名 -> (pymongo请求类, 必填参数, 可选参数)
+WRITE_OPERATIONS = {
+    "insert_one": (InsertOne, ("document",), ()),
+    "update_one": (UpdateOne, ("filter", "update"), ("upsert", "array_filters")),
+    "update_many": (UpdateMany, ("filter", "update"), ("upsert", "array_filters")),
+    "replace_one": (ReplaceOne, ("filter", "replacement"), ("upsert",)),
+    "delete_one": (DeleteOne, ("filter",), ()),
+    "delete_many": (DeleteMany, ("filter",), ())
+}
+
+
+class BulkOperationError(ValueError):
+    """写操作格式错误"""
+
+
+def _check_update(index: int, update: Any):
+    # 更新必须是操作符文档（$set等）或聚合管道，避免误把整个文档替换掉
+    if isinstance(update, list):
+        return
+    if not isinstance(update, dict) or not update or not all(str(key).startswith("$") for key in update):
+        raise BulkOperationError(f"第 {index} 个操作的update必须是更新操作符文档（如$set）或聚合管道")
+
+
+def _check_replacement(index: int, replacement: Any):
+    if not isinstance(replacement, dict) or any(str(key).startswith("$") for key in replacement):
+        raise BulkOperationError(f"第 {index} 个操作的replacement必须是不含更新操作符的文档")
+
+
+def parse_operation(index: int, operation: Dict[str, Any]) -> Any:
+    """
+    把一个写操作转换为pymongo的请求对象
+
+    Args:
+        index: 操作在请求中的位置（用于错误消息）
+        operation: 写操作，如 {"delete_one": {"filter": {"name": "张三"}}}
+
+    Returns:
+        pymongo的InsertOne、UpdateOne等请求对象
+
+    Raises:
+        BulkOperationError: 操作类型未知或参数不合法
+    """
+    if not isinstance(operation, dict) or len(operation) != 1:
+        raise BulkOperationError(f"第 {index} 个操作格式错误，应为 {{操作类型: 参数}}")
+    name, arguments = next(iter(operation.items()))
+    if name not in WRITE_OPERATIONS:
+        raise BulkOperationError(f"第 {index} 个操作类型未知: {name}，支持: {', '.join(WRITE_OPERATIONS)}")
+    if not isinstance(arguments, dict):
+        raise BulkOperationError(f"第 {index} 个操作的参数必须是字典")
+
+    request_class, required, optional = WRITE_OPERATIONS[name]
+    missing = [field for field in required if field not in arguments]
+    if missing:
+        raise BulkOperationError(f"第 {index} 个操作缺少参数: {', '.join(missing)}")
+    unknown = set(arguments) - set(required) - set(optional)
+    if unknown:
+        raise BulkOperationError(f"第 {index} 个操作包含不支持的参数: {', '.join(sorted(unknown))}")
+
+    if "filter" in arguments and not isinstance(arguments["filter"], dict):
+        raise BulkOperationError(f"第 {index} 个操作的filter必须是字典")
+    if "document" in arguments and not isinstance(arguments["document"], dict):
+        raise BulkOperationError(f"第 {index} 个操作的document必须是字典")
+    if "update" in arguments:
+        _check_update(index, arguments["update"])
+    if "replacement" in arguments:
+        _check_replacement(index, arguments["replacement"])
+
+    return request_class(**arguments)
+
+
+def parse_operations(operations: List[Dict[str, Any]]) -> List[Any]:
+    """
+    转换所有写操作；任何一个操作不合法时整批拒绝，不会写入任何数据
+
+    Raises:
+        BulkOperationError: 有操作不合法
+    """
+    return [parse_operation(index, operation) for index, operation in enumerate(operations)]
+
+
+def build_write_concern(options: Optional[Dict[str, Any]]) -> Optional[WriteConcern]:
+    """
+    根据请求参数创建写关注
+
+    Args:
+        options: 包含w、j、wtimeout的字典，None表示使用连接字符串或服务器的默认值
+
+    Returns:
+        WriteConcern: 写关注，options为空时返回None
+
+    Raises:
+        BulkOperationError: 参数组合不合法（如w=0且j=true）
+    """
+    options = {key: value for key, value in (options or {}).items() if value is not None}
+    if not options:
+        return None
+    try:
+        return WriteConcern(**options)
+    except (ConfigurationError, TypeError, ValueError) as e:
+        raise BulkOperationError(f"写关注参数不合法: {e}")
+
+
+def new_summary(total: int, ordered: bool) -> Dict[str, Any]:
+    """创建合并各块结果用的汇总"""
+    return {
+        "operations": total,
+        "ordered": ordered,
+        "acknowledged": True,
+        "chunks": 0,
+        "inserted_count": 0,
+        "matched_count": 0,
+        "modified_count": 0,
+        "deleted_count": 0,
+        "upserted_count": 0,
+        "upserted_ids": {},
+        "write_errors": [],
+        "write_concern_errors": []
+    }
+
+
+def merge_result(summary: Dict[str, Any], details: Optional[Dict[str, Any]], offset: int):
+    """
+    把一块的bulk_write结果合并到汇总中
+
+    Args:
+        summary: new_summary创建的汇总
+        details: BulkWriteResult.bulk_api_result或BulkWriteError.details，未确认的写入为None
+        offset: 该块第一个操作在整个请求中的位置，用于换算操作下标
+    """
+    summary["chunks"] += 1
+    if details is None:
+        # w=0时服务器不返回结果
+        summary["acknowledged"] = False
+        return
+
+    summary["inserted_count"] += details.get("nInserted", 0)
+    summary["matched_count"] += details.get("nMatched", 0)
+    summary["modified_count"] += details.get("nModified", 0)
+    summary["deleted_count"] += details.get("nRemoved", 0)
+    summary["upserted_count"] += details.get("nUpserted", 0)
+    for upserted in details.get("upserted", []):
+        summary["upserted_ids"][str(upserted["index"] + offset)] = str(upserted["_id"])
+    # 错误中只保留位置和原因，不回传操作内容
+    for error in details.get("writeErrors", []):
+        summary["write_errors"].append({
+            "index": error["index"] + offset,
+            "code": error.get("code"),
+            "errmsg": error.get("errmsg")
+        })
+    for error in details.get("writeConcernErrors", []):
+        summary["write_concern_errors"].append({
+            "code": error.get("code"),
+            "errmsg": error.get("errmsg")
+        })
+
+
+def summary_message(summary: Dict[str, Any]) -> str:
+    """根据汇总生成响应消息"""
+    if not summary["acknowledged"]:
+        return f"批量写入已提交（未确认写入），共 {summary['operations']} 个操作"
+    message = (f"插入 {summary['inserted_count']} 个，匹配 {summary['matched_count']} 个，"
+               f"修改 {summary['modified_count']} 个，删除 {summary['deleted_count']} 个，"
+               f"upsert {summary['upserted_count']} 个")
+    if summary["write_errors"] or summary["write_concern_errors"]:
+        return (f"批量写入部分失败，{len(summary['write_errors'])} 个操作出错，"
+                f"{len(summary['write_concern_errors'])} 个写关注错误；已{message}")
+    return f"批量写入成功，{message}"
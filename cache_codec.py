@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+缓存编解码
+把缓存数据编码为二进制（BSON/msgpack/JSON），超过阈值时可选zstd/lz4压缩，
+BSON和msgpack能原样还原ObjectId、datetime、Decimal128等MongoDB类型
+
+存储格式：1字节魔数(0x00) + 1字节编码ID + 1字节压缩ID + 数据。
+旧版本写入的JSON文本没有该头部，解码时自动按JSON处理
+"""
+
+import json
+import logging
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+import bson
+from bson import Binary, Decimal128, ObjectId
+from bson.codec_options import CodecOptions
+from config import Config
+
+try:
+    import msgpack
+except ImportError:  # 可选依赖
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:  # 可选依赖
+    zstandard = None
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:  # 可选依赖
+    lz4_frame = None
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+HEADER_MAGIC = 0x00
+
+# 编码ID
+CODEC_JSON = 1
+CODEC_BSON = 2
+CODEC_MSGPACK = 3
+
+# 压缩ID
+COMPRESSION_NONE = 0
+COMPRESSION_ZSTD = 1
+COMPRESSION_LZ4 = 2
+
+# msgpack扩展类型
+_EXT_OBJECT_ID = 1
+_EXT_DATETIME = 2
+_EXT_DECIMAL128 = 3
+_EXT_BINARY = 4
+
+_BSON_OPTIONS = CodecOptions(tz_aware=False)
+
+
+def _json_default(value: Any) -> Any:
+    """JSON编码兜底：datetime转ISO格式，其余类型转字符串"""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+def _msgpack_default(value: Any) -> Any:
+    """msgpack扩展类型编码"""
+    if isinstance(value, ObjectId):
+        return msgpack.ExtType(_EXT_OBJECT_ID, value.binary)
+    if isinstance(value, datetime):
+        # 带时区的时间统一转为UTC后去掉时区，与MongoDB返回的naive UTC时间一致
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        return msgpack.ExtType(_EXT_DATETIME, value.isoformat().encode("ascii"))
+    if isinstance(value, Decimal128):
+        return msgpack.ExtType(_EXT_DECIMAL128, value.bid)
+    if isinstance(value, Binary):
+        return msgpack.ExtType(_EXT_BINARY, bytes([value.subtype]) + bytes(value))
+    return str(value)
+
+
+def _msgpack_ext_hook(code: int, data: bytes) -> Any:
+    """msgpack扩展类型解码"""
+    if code == _EXT_OBJECT_ID:
+        return ObjectId(data)
+    if code == _EXT_DATETIME:
+        return datetime.fromisoformat(data.decode("ascii"))
+    if code == _EXT_DECIMAL128:
+        return Decimal128.from_bid(data)
+    if code == _EXT_BINARY:
+        return Binary(data[1:], data[0])
+    return msgpack.ExtType(code, data)
+
+
+class CacheCodec:
+    """
+    可插拔的缓存编解码器
+
+    - json: 兼容旧格式，MongoDB类型会变成字符串
+    - bson: pymongo自带，原样保留ObjectId/datetime/Decimal128/Binary（datetime精度为毫秒）
+    - msgpack: 需要安装msgpack，通过扩展类型保留MongoDB类型
+    - 序列化后超过compress_min_bytes时按配置使用zstd或lz4压缩
+    """
+
+    def __init__(self, codec: str = "bson", compression: Optional[str] = None, compress_min_bytes: int = 16384):
+        codec_ids = {"json": CODEC_JSON, "bson": CODEC_BSON, "msgpack": CODEC_MSGPACK}
+        if codec not in codec_ids:
+            raise ValueError(f"不支持的缓存编码: {codec}")
+        if codec == "msgpack" and msgpack is None:
+            logger.warning("未安装msgpack，缓存编码退回bson")
+            codec = "bson"
+        self.codec = codec
+        self.codec_id = codec_ids[codec]
+
+        compression = (compression or "none").lower()
+        if compression == "zstd" and zstandard is None:
+            logger.warning("未安装zstandard，缓存不压缩")
+            compression = "none"
+        if compression == "lz4" and lz4_frame is None:
+            logger.warning("未安装lz4，缓存不压缩")
+            compression = "none"
+        if compression not in ("none", "zstd", "lz4"):
+            raise ValueError(f"不支持的缓存压缩算法: {compression}")
+        self.compression = compression
+        self.compress_min_bytes = compress_min_bytes
+
+        self._zstd_compressor = zstandard.ZstdCompressor(level=3) if compression == "zstd" else None
+        self._zstd_decompressor = zstandard.ZstdDecompressor() if zstandard is not None else None
+
+    def _serialize(self, value: Any) -> (int, bytes):
+        if self.codec_id == CODEC_BSON:
+            try:
+                return CODEC_BSON, bson.encode({"v": value}, codec_options=_BSON_OPTIONS)
+            except (OverflowError, TypeError, bson.errors.InvalidDocument) as e:
+                # 超过8字节的整数、set等BSON无法表示的值退回JSON
+                logger.warning(f"BSON编码失败，退回JSON: {e}")
+        elif self.codec_id == CODEC_MSGPACK:
+            try:
+                return CODEC_MSGPACK, msgpack.packb(value, default=_msgpack_default, use_bin_type=True)
+            except (OverflowError, TypeError, ValueError) as e:
+                logger.warning(f"msgpack编码失败，退回JSON: {e}")
+        return CODEC_JSON, json.dumps(value, default=_json_default, ensure_ascii=False).encode("utf-8")
+
+    def encode(self, value: Any) -> bytes:
+        """
+        编码缓存数据
+
+        Args:
+            value: 要缓存的数据
+
+        Returns:
+            bytes: 带头部的二进制数据
+        """
+        codec_id, payload = self._serialize(value)
+
+        compression_id = COMPRESSION_NONE
+        if self.compression != "none" and len(payload) >= self.compress_min_bytes:
+            if self.compression == "zstd":
+                payload = self._zstd_compressor.compress(payload)
+                compression_id = COMPRESSION_ZSTD
+            else:
+                payload = lz4_frame.compress(payload)
+                compression_id = COMPRESSION_LZ4
+
+        return bytes((HEADER_MAGIC, codec_id, compression_id)) + payload
+
+    def decode(self, data: bytes) -> Any:
+        """
+        解码缓存数据，支持任意编码/压缩组合写入的数据以及旧版JSON文本
+
+        Args:
+            data: Redis中读取的原始数据
+
+        Returns:
+            Any: 还原后的数据
+        """
+        if isinstance(data, str):
+            return json.loads(data)
+        if not data or data[0] != HEADER_MAGIC:
+            # 旧版本写入的JSON文本
+            return json.loads(data)
+
+        codec_id, compression_id = data[1], data[2]
+        payload = memoryview(data)[3:]
+
+        if compression_id == COMPRESSION_ZSTD:
+            if self._zstd_decompressor is None:
+                raise ValueError("缓存数据使用zstd压缩，但未安装zstandard")
+            payload = self._zstd_decompressor.decompress(payload)
+        elif compression_id == COMPRESSION_LZ4:
+            if lz4_frame is None:
+                raise ValueError("缓存数据使用lz4压缩，但未安装lz4")
+            payload = lz4_frame.decompress(payload)
+
+        if codec_id == CODEC_BSON:
+            return bson.decode(payload, codec_options=_BSON_OPTIONS)["v"]
+        if codec_id == CODEC_MSGPACK:
+            if msgpack is None:
+                raise ValueError("缓存数据使用msgpack编码，但未安装msgpack")
+            return msgpack.unpackb(payload, ext_hook=_msgpack_ext_hook, raw=False)
+        return json.loads(bytes(payload))
+
+    def describe(self) -> Dict[str, Any]:
+        """返回当前编码配置"""
+        return {
+            "codec": self.codec,
+            "compression": self.compression,
+            "compress_min_bytes": self.compress_min_bytes
+        }
+
+
+def create_cache_codec() -> CacheCodec:
+    """根据REDIS_CONFIG创建缓存编解码器"""
+    redis_config = Config.get_redis_config()
+    return CacheCodec(
+        codec=redis_config["codec"],
+        compression=redis_config["compression"],
+        compress_min_bytes=redis_config["compress_min_bytes"]
+    )
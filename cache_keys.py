@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+缓存键生成
+把请求参数规范化后再哈希，使语义相同的查询落到同一个缓存键：
+- 去掉cache_ttl、force_refresh等不影响查询结果的字段
+- 连接字符串替换为不含密码的集群标识（主机排序，只保留影响结果的选项）
+- 规范化查询条件、投影、排序和聚合管道中的$match
+- 使用xxhash（未安装时退回blake2b）代替MD5
+"""
+
+import hashlib
+import json
+from typing import Any, Dict, List, Optional
+from urllib.parse import parse_qsl, unquote
+
+try:
+    import xxhash
+except ImportError:  # 可选依赖
+    xxhash = None
+
+# 不影响查询结果（或请求不经过缓存，如explain）的请求字段，不参与缓存键
+NON_SEMANTIC_FIELDS = {"cache_ttl", "force_refresh", "stream_format", "batch_size", "format", "arrow_schema", "explain"}
+
+# 会影响查询结果的连接选项（小写），其余选项（超时、连接池大小等）不参与集群标识
+RESULT_AFFECTING_OPTIONS = {
+    "replicaset", "readpreference", "readpreferencetags", "maxstalenessseconds",
+    "readconcernlevel", "authsource", "directconnection"
+}
+
+# 值是数组、但元素顺序不影响匹配结果的操作符
+UNORDERED_ARRAY_OPERATORS = {"$in", "$nin", "$all"}
+
+# 值是子查询列表的逻辑操作符
+LOGICAL_OPERATORS = {"$and", "$or", "$nor"}
+
+
+def _dumps(value: Any) -> str:
+    """紧凑、确定的JSON序列化（不排序键，键顺序由规范化过程决定）"""
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False, default=str)
+
+
+def _normalize_number(value: Any) -> Any:
+    """整数值的浮点数转为整数（MongoDB按数值比较，25.0和25匹配相同的文档）"""
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def _is_operator_document(value: Any) -> bool:
+    return isinstance(value, dict) and bool(value) and all(str(key).startswith("$") for key in value)
+
+
+def _normalize_literal(value: Any) -> Any:
+    """字面量值：保留嵌入文档的键顺序（MongoDB对嵌入文档的相等匹配区分字段顺序）"""
+    if isinstance(value, dict):
+        return {key: _normalize_literal(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_normalize_literal(item) for item in value]
+    return _normalize_number(value)
+
+
+def _normalize_operators(operators: Dict[str, Any]) -> Dict[str, Any]:
+    """规范化操作符文档，如 {"$lte": 30, "$gte": 20}"""
+    normalized = {}
+    for operator in sorted(operators):
+        value = operators[operator]
+        if operator in UNORDERED_ARRAY_OPERATORS and isinstance(value, list):
+            items = [_normalize_literal(item) for item in value]
+            normalized[operator] = sorted(items, key=_dumps)
+        elif operator == "$elemMatch" and isinstance(value, dict):
+            # $elemMatch既可以是查询条件也可以是操作符文档
+            normalized[operator] = (_normalize_operators(value) if _is_operator_document(value)
+                                    else normalize_filter(value))
+        elif operator == "$not" and _is_operator_document(value):
+            normalized[operator] = _normalize_operators(value)
+        elif operator in LOGICAL_OPERATORS and isinstance(value, list):
+            normalized[operator] = _normalize_clauses(value)
+        else:
+            normalized[operator] = _normalize_literal(value)
+    return normalized
+
+
+def _normalize_clauses(clauses: List[Any]) -> List[Any]:
+    """$and/$or/$nor的子条件顺序不影响结果，规范化后排序"""
+    items = [normalize_filter(clause) if isinstance(clause, dict) else _normalize_literal(clause)
+             for clause in clauses]
+    return sorted(items, key=_dumps)
+
+
+def normalize_filter(query_filter: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    规范化查询条件
+
+    查询层级的字段和操作符按键排序，$in/$nin/$all的数组和$and/$or/$nor的子条件排序，
+    作为字面量比较的嵌入文档保持原有顺序
+
+    Args:
+        query_filter: 查询条件，None等价于空条件
+
+    Returns:
+        Dict: 规范化后的查询条件
+    """
+    if not query_filter:
+        return {}
+
+    normalized = {}
+    for key in sorted(query_filter):
+        value = query_filter[key]
+        if key in LOGICAL_OPERATORS and isinstance(value, list):
+            normalized[key] = _normalize_clauses(value)
+        elif _is_operator_document(value):
+            normalized[key] = _normalize_operators(value)
+        else:
+            normalized[key] = _normalize_literal(value)
+    return normalized
+
+
+def normalize_projection(projection: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """规范化投影：按字段排序，True/False统一为1/0；空投影等价于不投影"""
+    if not projection:
+        return None
+    normalized = {}
+    for key in sorted(projection):
+        value = projection[key]
+        if isinstance(value, bool):
+            value = int(value)
+        normalized[key] = _normalize_literal(value)
+    return normalized
+
+
+def normalize_sort(sort: Optional[List[List[Any]]]) -> Optional[List[List[Any]]]:
+    """规范化排序：保留字段顺序（顺序决定排序优先级），方向统一为整数"""
+    if not sort:
+        return None
+    return [[item[0], _normalize_number(item[1])] if len(item) == 2 else list(item) for item in sort]
+
+
+def normalize_pipeline(pipeline: Optional[List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    """规范化聚合管道：只规范化$match阶段，其余阶段的键顺序可能影响输出，保持不变"""
+    normalized = []
+    for stage in pipeline or []:
+        if isinstance(stage, dict) and len(stage) == 1 and "$match" in stage:
+            normalized.append({"$match": normalize_filter(stage["$match"])})
+        else:
+            normalized.append(_normalize_literal(stage))
+    return normalized
+
+
+def _split_connection_string(connection_string: str):
+    """拆分连接字符串为 (scheme, 用户信息, 主机列表, 选项)"""
+    scheme, separator, rest = connection_string.strip().partition("://")
+    if not separator:
+        scheme, rest = "mongodb", scheme
+
+    # 主机列表在第一个 "/" 或 "?" 之前，用户信息在其中最后一个 "@" 之前
+    host_end = min((index for index in (rest.find("/"), rest.find("?")) if index != -1), default=len(rest))
+    userinfo, _, hosts_part = rest[:host_end].rpartition("@")
+    query = rest[host_end:].partition("?")[2]
+    return scheme.lower(), userinfo, hosts_part, query
+
+
+def cluster_id(connection_string: str) -> str:
+    """
+    生成不含用户名和密码的集群标识
+
+    同一集群的不同写法（主机顺序、大小写、默认端口、无关选项）得到相同的标识，
+    例如 mongodb://u:p@B,a:27017/?appName=x 的标识是 mongodb://a:27017,b:27017
+
+    Args:
+        connection_string: MongoDB连接字符串
+
+    Returns:
+        str: 集群标识
+    """
+    scheme, _, hosts_part, query = _split_connection_string(connection_string)
+
+    hosts = []
+    for host in hosts_part.split(","):
+        host = unquote(host).lower()
+        # mongodb+srv只有域名，不补端口
+        if host and scheme == "mongodb" and ":" not in host.rsplit("]", 1)[-1]:
+            host = f"{host}:27017"
+        hosts.append(host)
+
+    # 按选项名稳定排序，同名选项（如多个readPreferenceTags）保持原有顺序
+    options = sorted(
+        ((name.lower(), value) for name, value in parse_qsl(query, keep_blank_values=True)
+         if name.lower() in RESULT_AFFECTING_OPTIONS),
+        key=lambda option: option[0]
+    )
+    identifier = f"{scheme}://{','.join(sorted(hosts))}"
+    if options:
+        identifier += "?" + "&".join(f"{name}={value}" for name, value in options)
+    return identifier
+
+
+def _principal(connection_string: str) -> Optional[str]:
+    """
+    连接用户的摘要
+
+    不同用户的权限可能不同，缓存必须按用户隔离；只参与哈希，不保存明文凭据
+    """
+    userinfo = _split_connection_string(connection_string)[1]
+    if not userinfo:
+        return None
+    return hashlib.blake2b(unquote(userinfo).encode("utf-8"), digest_size=16).hexdigest()
+
+
+def canonical_params(params: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    把请求参数转换为规范形式（用于生成缓存键）
+
+    Args:
+        params: 请求参数字典（通常是request.dict()）
+
+    Returns:
+        Dict: 去掉无关字段、规范化各查询参数后的字典，键按名称排序
+    """
+    normalizers = {
+        "query_filter": normalize_filter,
+        "projection": normalize_projection,
+        "sort": normalize_sort,
+        "pipeline": normalize_pipeline
+    }
+    canonical = {}
+    for key in sorted(params):
+        if key in NON_SEMANTIC_FIELDS:
+            continue
+        value = params[key]
+        if key == "connection_string":
+            canonical["cluster"] = cluster_id(value)
+            canonical["principal"] = _principal(value)
+        elif key in normalizers:
+            canonical[key] = normalizers[key](value)
+        elif key == "skip" and not value:
+            # skip为0与不传等价
+            canonical[key] = None
+        else:
+            canonical[key] = _normalize_literal(value)
+    return canonical
+
+
+def hash_payload(payload: str) -> str:
+    """使用xxh3-128（未安装xxhash时使用blake2b-128）计算摘要"""
+    data = payload.encode("utf-8")
+    if xxhash is not None:
+        return xxhash.xxh3_128_hexdigest(data)
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def build_cache_key(prefix: str, params: Dict[str, Any]) -> str:
+    """
+    根据参数生成一个稳定的缓存键（同步和异步缓存共用）
+
+    Args:
+        prefix: 缓存键前缀 (如: "query", "aggregate")
+        params: 包含所有查询参数的字典
+
+    Returns:
+        str: 生成的缓存键
+    """
+    hash_part = hash_payload(_dumps(canonical_params(params)))
+    return f"mongodb_api:{prefix}:{hash_part}"
@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+基于变更流（change stream）的缓存失效
+缓存写入时按 (集群, 数据库, 集合) 打标签，后台监听这些集合的变更流，
+集合发生写入时只删除受影响的缓存条目，因此可以放心使用更长的缓存时间
+
+变更流需要MongoDB副本集或分片集群；单机部署时自动跳过监听，
+通过本服务的写入（/bulk_write）仍会立即失效缓存，其他途径的写入只能等缓存按TTL过期
+"""
+
+import asyncio
+import uuid
+import logging
+from typing import Any, Dict, List, Optional, Set
+from pymongo.errors import OperationFailure
+from config import Config
+from cache_keys import cluster_id, hash_payload
+from mongo_client_pool import AsyncMongoClientPool, async_mongo_client_pool
+from redis_cache import AsyncRedisCache, async_redis_cache
+from tiered_cache import TieredCache, tiered_cache
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 单机MongoDB不支持变更流时返回的错误码
+CHANGE_STREAM_NOT_SUPPORTED_CODE = 40573
+
+# 变更流只需要事件类型，不需要文档内容（_id即恢复令牌，必须保留）
+CHANGE_EVENT_PROJECTION = [{"$project": {"operationType": 1}}]
+
+
+def pipeline_collections(pipeline: Optional[List[Dict[str, Any]]]) -> List[str]:
+    """
+    找出聚合管道中引用的其他集合（$lookup、$graphLookup、$unionWith及其子管道、$facet）
+
+    Args:
+        pipeline: 聚合管道
+
+    Returns:
+        List[str]: 集合名称列表（去重，保持出现顺序）
+    """
+    collections: List[str] = []
+
+    def visit(stages: Any):
+        if not isinstance(stages, list):
+            return
+        for stage in stages:
+            if not isinstance(stage, dict):
+                continue
+            for operator, spec in stage.items():
+                if operator in ("$lookup", "$graphLookup") and isinstance(spec, dict):
+                    if isinstance(spec.get("from"), str):
+                        collections.append(spec["from"])
+                    visit(spec.get("pipeline"))
+                elif operator == "$unionWith":
+                    if isinstance(spec, str):
+                        collections.append(spec)
+                    elif isinstance(spec, dict):
+                        if isinstance(spec.get("coll"), str):
+                            collections.append(spec["coll"])
+                        visit(spec.get("pipeline"))
+                elif operator == "$facet" and isinstance(spec, dict):
+                    for sub_pipeline in spec.values():
+                        visit(sub_pipeline)
+
+    visit(pipeline)
+    return list(dict.fromkeys(collections))
+
+
+class ChangeStreamInvalidator:
+    """
+    变更流缓存失效
+
+    - track在缓存写入前调用，返回该查询的标签，并确保对应集合的监听任务已启动
+    - 失效时同时递增标签的版本号；查询前后版本号不同（查询期间集合被写入）时结果不会留在缓存中，
+      避免失效发生在新缓存键加入标签之前，写入前读到的数据被缓存整个TTL
+    - invalidate_collection在通过本服务写入后调用，直接按标签失效，不依赖变更流
+    - 每个集合的监听任务先获取Redis租约，多个工作进程中只有一个真正打开变更流
+    - 收到写入事件时删除该集合标签下的所有缓存（两级），并通知其他工作进程
+    - 监听在没有恢复令牌的情况下（首次启动、接管租约、历史丢失）打开变更流时，
+      先失效该集合的全部缓存，避免遗漏无人监听期间的写入
+    """
+
+    def __init__(self,
+                 cache: TieredCache,
+                 remote: AsyncRedisCache,
+                 client_pool: AsyncMongoClientPool,
+                 stream_config: Dict[str, Any] = None):
+        stream_config = stream_config or Config.get_change_stream_config()
+        self.cache = cache
+        self.remote = remote
+        self.client_pool = client_pool
+        self.enabled = stream_config["enabled"]
+        self.max_namespaces = stream_config["max_namespaces"]
+        self.lease_ttl_ms = stream_config["lease_ttl_ms"]
+        self.reconnect_delay_seconds = stream_config["reconnect_delay_seconds"]
+        # 标签 -> 监听任务
+        self._watchers: Dict[str, asyncio.Task] = {}
+        # 不支持变更流的集群（单机部署），不再打标签
+        self._unsupported_clusters: Set[str] = set()
+        self.stats = {"events": 0, "invalidations": 0, "keys_invalidated": 0, "errors": 0}
+
+    @staticmethod
+    def namespace_tag(connection_string: str, database_name: str, collection_name: str) -> str:
+        """
+        生成集合的标签（不含凭据）
+
+        Args:
+            connection_string: MongoDB连接字符串
+            database_name: 数据库名称
+            collection_name: 集合名称
+
+        Returns:
+            str: 标签，即Redis中保存该集合缓存键的集合名
+        """
+        cluster_hash = hash_payload(cluster_id(connection_string))
+        return f"mongodb_api:tag:{cluster_hash}:{database_name}.{collection_name}"
+
+    def track(self, connection_string: str, database_name: str, collection_names: List[str]) -> List[str]:
+        """
+        登记查询读取的集合，返回缓存条目应携带的标签，并启动对应的变更流监听
+
+        标签总是返回（通过本服务写入时按标签失效）；未启用变更流、集群不支持或监听数量已达上限时
+        只是不启动监听，其他途径的写入只能等缓存按TTL过期
+
+        Args:
+            connection_string: MongoDB连接字符串
+            database_name: 数据库名称
+            collection_names: 查询读取的集合（聚合查询包括$lookup等引用的集合）
+
+        Returns:
+            List[str]: 缓存条目应携带的标签
+        """
+        tags = [self.namespace_tag(connection_string, database_name, collection_name)
+                for collection_name in collection_names]
+        if not self.enabled or cluster_id(connection_string) in self._unsupported_clusters:
+            return tags
+
+        for tag, collection_name in zip(tags, collection_names):
+            if tag in self._watchers:
+                continue
+            if len(self._watchers) >= self.max_namespaces:
+                logger.warning(f"变更流监听数量已达上限 {self.max_namespaces}，{database_name}.{collection_name} 的缓存只在本服务写入时失效或按TTL过期")
+                continue
+            self._watchers[tag] = asyncio.create_task(
+                self._watch(tag, connection_string, database_name, collection_name)
+            )
+        return tags
+
+    async def invalidate_collection(self, connection_string: str, database_name: str, collection_name: str) -> int:
+        """
+        失效读取了某个集合的所有缓存（通过本服务写入后调用，不依赖变更流）
+
+        Args:
+            connection_string: MongoDB连接字符串
+            database_name: 数据库名称
+            collection_name: 集合名称
+
+        Returns:
+            int: 失效的缓存键数量
+        """
+        tag = self.namespace_tag(connection_string, database_name, collection_name)
+        return await self._invalidate(tag, "集合已写入")
+
+    async def _invalidate(self, tag: str, reason: str) -> int:
+        count = await self.cache.invalidate_tag(tag)
+        self.stats["invalidations"] += 1
+        self.stats["keys_invalidated"] += count
+        if count:
+            logger.info(f"{reason}，已失效 {count} 个缓存: {tag}")
+        return count
+
+    async def _watch(self, tag: str, connection_string: str, database_name: str, collection_name: str):
+        """监听一个集合的变更流，断线后自动重连"""
+        lease_key = f"{tag}:watcher"
+        token = uuid.uuid4().hex
+        lease_interval = self.lease_ttl_ms / 1000 / 3
+        resume_token = None
+        holding = False
+
+        try:
+            while True:
+                if holding:
+                    holding = await self.remote.extend_lock(lease_key, token, self.lease_ttl_ms)
+                if not holding:
+                    holding = await self.remote.acquire_lock(lease_key, token, self.lease_ttl_ms)
+                if not holding:
+                    # 其他工作进程正在监听该集合，稍后再尝试接管
+                    resume_token = None
+                    await asyncio.sleep(lease_interval)
+                    continue
+
+                client = None
+                try:
+                    client = await self.client_pool.acquire(connection_string)
+                    collection = client[database_name][collection_name]
+                    async with collection.watch(CHANGE_EVENT_PROJECTION,
+                                                resume_after=resume_token,
+                                                max_await_time_ms=int(lease_interval * 1000)) as stream:
+                        logger.info(f"开始监听变更流: {database_name}.{collection_name}")
+                        if resume_token is None:
+                            await self._invalidate(tag, "变更流（重新）开始监听")
+
+                        while stream.alive:
+                            change = await stream.try_next()
+                            resume_token = stream.resume_token
+                            if change is not None:
+                                self.stats["events"] += 1
+                                await self._invalidate(tag, f"集合发生 {change.get('operationType')} 操作")
+                                if change.get("operationType") == "invalidate":
+                                    # 集合被删除或重命名，变更流已关闭，无法继续恢复
+                                    resume_token = None
+                            # 定期续约，失去租约时交给其他工作进程监听
+                            if not await self.remote.extend_lock(lease_key, token, self.lease_ttl_ms):
+                                logger.info(f"变更流租约已被其他进程接管: {database_name}.{collection_name}")
+                                holding = False
+                                resume_token = None
+                                break
+
+                except OperationFailure as e:
+                    if e.code == CHANGE_STREAM_NOT_SUPPORTED_CODE:
+                        logger.warning(f"MongoDB不支持变更流（需要副本集），缓存只按TTL过期: {database_name}.{collection_name}")
+                        self._unsupported_clusters.add(cluster_id(connection_string))
+                        return
+                    # 恢复令牌失效、历史已被覆盖等错误，重新开始监听
+                    self.stats["errors"] += 1
+                    logger.error(f"变更流出错，{self.reconnect_delay_seconds}秒后重新监听: {e}")
+                    resume_token = None
+                    await asyncio.sleep(self.reconnect_delay_seconds)
+                except Exception as e:
+                    self.stats["errors"] += 1
+                    logger.error(f"变更流中断，{self.reconnect_delay_seconds}秒后重连: {e}")
+                    await asyncio.sleep(self.reconnect_delay_seconds)
+                finally:
+                    if client is not None:
+                        self.client_pool.release(connection_string)
+        finally:
+            await self.remote.release_lock(lease_key, token)
+            self._watchers.pop(tag, None)
+
+    async def stop(self):
+        """停止所有监听任务（应用关闭时调用）"""
+        tasks = list(self._watchers.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._watchers.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        获取变更流失效统计
+
+        Returns:
+            Dict: 是否启用、监听中的集合数量、事件和失效次数
+        """
+        return {
+            **self.stats,
+            "enabled": self.enabled,
+            "watched_namespaces": len(self._watchers),
+            "unsupported_clusters": len(self._unsupported_clusters)
+        }
+
+
+# 创建一个全局的ChangeStreamInvalidator实例，方便在应用中复用
+change_stream_invalidator = ChangeStreamInvalidator(tiered_cache, async_redis_cache, async_mongo_client_pool)
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+按列返回查询结果
+分析类客户端一次拉取大量扁平文档时，逐行JSON在每个对象中重复字段名；按列返回时字段名只出现一次
+
+- columns: {"fields": [字段名...], "columns": [[第1列的值...], [第2列的值...]]}，文档缺少的字段为null
+- arrow: Apache Arrow IPC流，pandas/polars可直接零拷贝读取（需要安装pyarrow）
+- parquet: Parquet文件（需要安装pyarrow）
+"""
+
+from typing import Any, Dict, List
+from json_encoding import dumps
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:  # 可选依赖
+    pyarrow = None
+
+# 二进制格式 -> 响应的Content-Type
+BINARY_FORMATS = {
+    "arrow": "application/vnd.apache.arrow.stream",
+    "parquet": "application/vnd.apache.parquet"
+}
+
+
+class ColumnarFormatError(ValueError):
+    """结果无法转换为请求的格式"""
+
+
+def column_fields(documents: List[Dict[str, Any]]) -> List[str]:
+    """所有文档字段的并集，按首次出现的顺序排列"""
+    fields: Dict[str, None] = {}
+    for document in documents:
+        for field in document:
+            if field not in fields:
+                fields[field] = None
+    return list(fields)
+
+
+def to_columns(documents: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    把文档列表转换为按列的格式
+
+    Args:
+        documents: 文档列表（已经过encode_documents转换）
+
+    Returns:
+        Dict: {"fields": 字段列表, "columns": 与fields对应的值数组列表}
+    """
+    fields = column_fields(documents)
+    return {
+        "fields": fields,
+        "columns": [[document.get(field) for document in documents] for field in fields]
+    }
+
+
+def _arrow_column(values: List[Any]) -> Any:
+    try:
+        return pyarrow.array(values)
+    except (pyarrow.ArrowInvalid, pyarrow.ArrowTypeError):
+        # 同一字段在不同文档中类型不一致（如数字和字符串混用）时，整列按JSON文本保存
+        return pyarrow.array([
+            None if value is None else value if isinstance(value, str) else dumps(value).decode("utf-8")
+            for value in values
+        ], type=pyarrow.string())
+
+
+def to_arrow_table(documents: List[Dict[str, Any]]) -> Any:
+    """
+    把文档列表转换为Arrow表，列类型由pyarrow根据值推断
+
+    Raises:
+        ColumnarFormatError: 未安装pyarrow
+    """
+    if pyarrow is None:
+        raise ColumnarFormatError("arrow和parquet格式需要安装pyarrow")
+    columns = to_columns(documents)
+    return pyarrow.table({
+        field: _arrow_column(values) for field, values in zip(columns["fields"], columns["columns"])
+    })
+
+
+def encode_binary(documents: List[Dict[str, Any]], result_format: str) -> bytes:
+    """
+    把文档列表编码为Arrow IPC流或Parquet文件
+
+    Args:
+        documents: 文档列表
+        result_format: arrow或parquet
+
+    Returns:
+        bytes: 编码后的数据
+
+    Raises:
+        ColumnarFormatError: 未安装pyarrow
+    """
+    table = to_arrow_table(documents)
+    sink = pyarrow.BufferOutputStream()
+    if result_format == "parquet":
+        pyarrow.parquet.write_table(table, sink)
+    else:
+        with pyarrow.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+    return sink.getvalue().to_pybytes()
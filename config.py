@@ -55,6 +55,110 @@ class Config:
         "db": int(os.getenv("REDIS_DB", 9)),
         "password": os.getenv("REDIS_PASSWORD", 'lobbyredisLock527788'),
         "default_ttl_seconds": 86400,  # 默认缓存时间24小时 (24 * 60 * 60)
+        "max_connections": int(os.getenv("REDIS_MAX_CONNECTIONS", "50")),  # 异步客户端连接池上限
+        "pool_timeout_seconds": int(os.getenv("REDIS_POOL_TIMEOUT", "5")),  # 连接池耗尽时等待空闲连接的时间
+        "codec": os.getenv("CACHE_CODEC", "bson"),  # 缓存编码: json / bson / msgpack
+        "compression": os.getenv("CACHE_COMPRESSION", "none"),  # 缓存压缩: none / zstd / lz4
+        "compress_min_bytes": int(os.getenv("CACHE_COMPRESS_MIN_BYTES", "16384")),  # 超过该字节数才压缩
+    }
+    
+    # 进程内一级缓存配置（位于Redis之前）
+    LOCAL_CACHE_CONFIG = {
+        "enabled": os.getenv("LOCAL_CACHE_ENABLED", "True").lower() == "true",
+        "max_entries": int(os.getenv("LOCAL_CACHE_MAX_ENTRIES", "10000")),  # 最多缓存的条目数
+        "max_bytes": int(os.getenv("LOCAL_CACHE_MAX_BYTES", str(64 * 1024 * 1024))),  # 估算内存上限，默认64MB
+        "max_ttl_seconds": int(os.getenv("LOCAL_CACHE_MAX_TTL", "60")),  # 本地条目最长存活时间，不超过请求的cache_ttl
+        "invalidation_channel": "mongodb_api:cache:invalidate"  # 跨工作进程失效通知的Redis频道
+    }
+    
+    # 缓存刷新配置
+    CACHE_REFRESH_CONFIG = {
+        # 软过期后继续保留并返回陈旧数据的时间窗口，期间后台刷新；0表示到期即删除
+        "stale_while_revalidate_seconds": int(os.getenv("CACHE_STALE_WHILE_REVALIDATE", "60")),
+        # XFetch提前刷新系数，越大越早刷新；0表示关闭
+        "xfetch_beta": float(os.getenv("CACHE_XFETCH_BETA", "1.0")),
+        # 启用XFetch提前刷新的缓存键前缀（计算代价高的查询）
+        "xfetch_prefixes": ["aggregate"]
+    }
+    
+    # 请求合并（single-flight）配置：相同缓存键的并发未命中只查询一次数据库
+    SINGLE_FLIGHT_CONFIG = {
+        "enabled": os.getenv("SINGLE_FLIGHT_ENABLED", "True").lower() == "true",
+        "lock_ttl_ms": int(os.getenv("SINGLE_FLIGHT_LOCK_TTL_MS", "30000")),  # 跨进程锁的过期时间，应大于查询超时
+        "wait_timeout_seconds": float(os.getenv("SINGLE_FLIGHT_WAIT_TIMEOUT", "30")),  # 等待其他进程结果的最长时间
+        "poll_interval_ms": int(os.getenv("SINGLE_FLIGHT_POLL_INTERVAL_MS", "50"))  # 等待期间轮询缓存的间隔
+    }
+    
+    # 基于变更流（change stream）的缓存失效配置，需要MongoDB副本集或分片集群
+    CHANGE_STREAM_CONFIG = {
+        "enabled": os.getenv("CACHE_CHANGE_STREAM_ENABLED", "False").lower() == "true",
+        "max_namespaces": int(os.getenv("CACHE_CHANGE_STREAM_MAX_NAMESPACES", "100")),  # 每个进程最多监听的集合数
+        "lease_ttl_ms": int(os.getenv("CACHE_CHANGE_STREAM_LEASE_TTL_MS", "15000")),  # 监听租约，保证每个集合只有一个进程监听
+        "reconnect_delay_seconds": float(os.getenv("CACHE_CHANGE_STREAM_RECONNECT_DELAY", "5"))  # 变更流中断后的重连间隔
+    }
+    
+    # 服务端游标会话配置（游标保存在工作进程内存中）
+    CURSOR_SESSION_CONFIG = {
+        "max_sessions": int(os.getenv("CURSOR_MAX_SESSIONS", "200")),  # 每个工作进程最多同时打开的游标数
+        "max_sessions_per_client": int(os.getenv("CURSOR_MAX_SESSIONS_PER_CLIENT", "5")),  # 每个客户端最多同时打开的游标数
+        "idle_timeout_seconds": int(os.getenv("CURSOR_IDLE_TIMEOUT", "300")),  # 空闲超过该时间的游标会被回收，应小于MongoDB的10分钟游标超时
+        "reap_interval_seconds": int(os.getenv("CURSOR_REAP_INTERVAL", "30")),  # 回收空闲游标的检查间隔
+        "default_fetch_size": 1000,  # 每次获取的默认文档数量
+        "max_fetch_size": 10000  # 每次获取的最大文档数量
+    }
+    
+    # 批量查询配置（/batch）
+    BATCH_CONFIG = {
+        "max_operations": int(os.getenv("BATCH_MAX_OPERATIONS", "100")),  # 单次请求最多包含的操作数
+        "max_concurrency": int(os.getenv("BATCH_MAX_CONCURRENCY", "8"))  # 缓存未命中的操作同时查询数据库的最大数量
+    }
+    
+    # 批量写入配置（/bulk_write）
+    BULK_WRITE_CONFIG = {
+        "chunk_size": int(os.getenv("BULK_WRITE_CHUNK_SIZE", "1000")),  # 每次bulk_write发送的操作数，超出时分块执行
+        "max_operations": int(os.getenv("BULK_WRITE_MAX_OPERATIONS", "100000"))  # 单次请求最多包含的写操作数
+    }
+    
+    # NDJSON流式导入配置（/ingest）
+    INGEST_CONFIG = {
+        "batch_size": int(os.getenv("INGEST_BATCH_SIZE", "1000")),  # 每次insert_many的文档数量
+        "max_in_flight": int(os.getenv("INGEST_MAX_IN_FLIGHT", "4")),  # 同时写入中的批次上限，达到上限时暂停读取请求体
+        "max_line_bytes": 16 * 1024 * 1024,  # 单行最大字节数（MongoDB单个文档上限16MB）
+        "checkpoint_ttl_seconds": int(os.getenv("INGEST_CHECKPOINT_TTL", "86400")),  # 导入检查点在Redis中的保留时间
+        "lease_ttl_ms": 60000  # 同一个导入任务的租约时间，防止同一ingest_id被并发导入
+    }
+    
+    # 索引建议配置（/index_advice，查询形状保存在工作进程内存中）
+    INDEX_ADVISOR_CONFIG = {
+        "max_namespaces": int(os.getenv("INDEX_ADVISOR_MAX_NAMESPACES", "100")),  # 最多统计的集合数量，超出后淘汰最久未查询的集合
+        "max_shapes": int(os.getenv("INDEX_ADVISOR_MAX_SHAPES", "200")),  # 每个集合最多保存的查询形状数量
+        "sample_size": int(os.getenv("INDEX_ADVISOR_SAMPLE_SIZE", "1000")),  # 估算选择性时抽样的文档数量
+        "max_recommendations": 20  # 每次分析的查询形状数量（按查询次数从多到少）
+    }
+    
+    # 查询形状耗时统计与慢查询日志配置（/query_stats，统计保存在工作进程内存中）
+    QUERY_METRICS_CONFIG = {
+        "enabled": os.getenv("QUERY_METRICS_ENABLED", "True").lower() == "true",
+        "max_shapes": int(os.getenv("QUERY_METRICS_MAX_SHAPES", "500")),  # 最多统计的查询形状数量，超出后淘汰最久未出现的形状
+        "slow_query_ms": float(os.getenv("SLOW_QUERY_MS", "500")),  # 慢查询阈值（毫秒），0表示不记录慢查询
+        "slow_log_size": int(os.getenv("SLOW_QUERY_LOG_SIZE", "100"))  # 保留最近的慢查询条数
+    }
+    
+    # Prometheus指标配置（/metrics）
+    PROMETHEUS_CONFIG = {
+        "enabled": os.getenv("PROMETHEUS_ENABLED", "True").lower() == "true",
+        # 多个工作进程（gunicorn -w 4）时各进程把指标写入该目录，/metrics汇总所有进程；为空时只导出当前进程
+        "multiproc_dir": os.getenv("PROMETHEUS_MULTIPROC_DIR", "")
+    }
+    
+    # OpenTelemetry追踪配置（需要安装opentelemetry-sdk，默认关闭）
+    TRACING_CONFIG = {
+        "enabled": os.getenv("TRACING_ENABLED", "False").lower() == "true",
+        "exporter": os.getenv("TRACING_EXPORTER", "otlp"),  # otlp（OTLP/HTTP发送到采集器）、file（每行一个span的JSON）、console
+        "otlp_endpoint": os.getenv("OTEL_EXPORTER_OTLP_TRACES_ENDPOINT", "http://localhost:4318/v1/traces"),
+        "file_path": os.getenv("TRACING_FILE", "traces.jsonl"),
+        "service_name": os.getenv("OTEL_SERVICE_NAME", "mongodb-api"),
+        "sample_ratio": float(os.getenv("TRACING_SAMPLE_RATIO", "1.0"))  # 没有上游trace context时的采样比例
     }
     
     # API配置
@@ -73,13 +177,21 @@ class Config:
         "file": os.getenv("LOG_FILE", "mongodb_api.log")
     }
     
+    # MongoDB客户端复用配置（进程级，按连接字符串复用MongoClient）
+    CLIENT_POOL_CONFIG = {
+        "max_clients": int(os.getenv("MONGODB_MAX_CLIENTS", "32")),  # 最多缓存的客户端数量，超出后按LRU淘汰
+        "idle_timeout_seconds": int(os.getenv("MONGODB_CLIENT_IDLE_TIMEOUT", "600")),  # 客户端空闲超时时间
+        "evict_interval_seconds": int(os.getenv("MONGODB_CLIENT_EVICT_INTERVAL", "60"))  # 检查空闲客户端的间隔
+    }
+    
     # 查询配置
     QUERY_CONFIG = {
         "default_limit": 100,
         "max_limit": 1000,
         "default_skip": 0,
         "max_skip": 10000,
-        "timeout_seconds": 30
+        "timeout_seconds": 30,
+        "stream_batch_size": 500  # 流式返回时每个游标批次的文档数量
     }
     
     @classmethod
@@ -105,6 +217,126 @@ class Config:
         """
         return cls.REDIS_CONFIG
     
+    @classmethod
+    def get_local_cache_config(cls) -> Dict[str, Any]:
+        """
+        获取进程内一级缓存配置
+        
+        Returns:
+            Dict: 本地缓存配置字典
+        """
+        return cls.LOCAL_CACHE_CONFIG
+    
+    @classmethod
+    def get_cache_refresh_config(cls) -> Dict[str, Any]:
+        """
+        获取缓存刷新配置
+        
+        Returns:
+            Dict: 缓存刷新配置字典
+        """
+        return cls.CACHE_REFRESH_CONFIG
+    
+    @classmethod
+    def get_single_flight_config(cls) -> Dict[str, Any]:
+        """
+        获取请求合并配置
+        
+        Returns:
+            Dict: 请求合并配置字典
+        """
+        return cls.SINGLE_FLIGHT_CONFIG
+    
+    @classmethod
+    def get_change_stream_config(cls) -> Dict[str, Any]:
+        """
+        获取变更流缓存失效配置
+        
+        Returns:
+            Dict: 变更流配置字典
+        """
+        return cls.CHANGE_STREAM_CONFIG
+    
+    @classmethod
+    def get_cursor_session_config(cls) -> Dict[str, Any]:
+        """
+        获取服务端游标会话配置
+        
+        Returns:
+            Dict: 游标会话配置字典
+        """
+        return cls.CURSOR_SESSION_CONFIG
+    
+    @classmethod
+    def get_batch_config(cls) -> Dict[str, Any]:
+        """
+        获取批量查询配置
+        
+        Returns:
+            Dict: 批量查询配置字典
+        """
+        return cls.BATCH_CONFIG
+    
+    @classmethod
+    def get_bulk_write_config(cls) -> Dict[str, Any]:
+        """
+        获取批量写入配置
+        
+        Returns:
+            Dict: 批量写入配置字典
+        """
+        return cls.BULK_WRITE_CONFIG
+    
+    @classmethod
+    def get_ingest_config(cls) -> Dict[str, Any]:
+        """
+        获取NDJSON流式导入配置
+        
+        Returns:
+            Dict: 流式导入配置字典
+        """
+        return cls.INGEST_CONFIG
+    
+    @classmethod
+    def get_index_advisor_config(cls) -> Dict[str, Any]:
+        """
+        获取索引建议配置
+        
+        Returns:
+            Dict: 索引建议配置字典
+        """
+        return cls.INDEX_ADVISOR_CONFIG
+    
+    @classmethod
+    def get_query_metrics_config(cls) -> Dict[str, Any]:
+        """
+        获取查询形状统计配置
+        
+        Returns:
+            Dict: 查询形状统计配置字典
+        """
+        return cls.QUERY_METRICS_CONFIG
+    
+    @classmethod
+    def get_prometheus_config(cls) -> Dict[str, Any]:
+        """
+        获取Prometheus指标配置
+        
+        Returns:
+            Dict: Prometheus指标配置字典
+        """
+        return cls.PROMETHEUS_CONFIG
+    
+    @classmethod
+    def get_tracing_config(cls) -> Dict[str, Any]:
+        """
+        获取OpenTelemetry追踪配置
+        
+        Returns:
+            Dict: 追踪配置字典
+        """
+        return cls.TRACING_CONFIG
+    
     @classmethod
     def get_api_config(cls) -> Dict[str, Any]:
         """
@@ -125,6 +357,16 @@ class Config:
         """
         return cls.LOGGING_CONFIG
     
+    @classmethod
+    def get_client_pool_config(cls) -> Dict[str, Any]:
+        """
+        获取MongoDB客户端复用配置
+        
+        Returns:
+            Dict: 客户端复用配置字典
+        """
+        return cls.CLIENT_POOL_CONFIG
+    
     @classmethod
     def get_query_config(cls) -> Dict[str, Any]:
         """
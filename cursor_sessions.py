@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+服务端游标会话
+为大结果集导出保留一个活动的MongoDB游标，客户端分批获取，
+整个读取过程只执行一次查询，之后每批只是增量的getMore
+
+游标保存在工作进程内存中：同一个游标的请求需要落在同一个工作进程
+（复用同一个HTTP keep-alive连接即可），配额也按工作进程计算
+"""
+
+import asyncio
+import secrets
+import time
+import logging
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+from config import Config
+from bson_encoder import encode_documents
+from mongo_client_pool import AsyncMongoClientPool, async_mongo_client_pool
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class CursorSession:
+    """一个打开的游标及其所属客户端"""
+
+    def __init__(self, cursor_id: str, client_id: str, connection_string: str, cursor: Any):
+        self.cursor_id = cursor_id
+        self.client_id = client_id
+        self.connection_string = connection_string
+        self.cursor = cursor
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+        self.fetched = 0
+        # 同一个游标的并发获取需要串行执行
+        self.lock = asyncio.Lock()
+
+
+class CursorSessionManager:
+    """
+    游标会话管理
+
+    - open创建游标（此时不执行查询），从连接池借出的客户端在游标关闭前保持使用中，不会被淘汰
+    - fetch获取下一批文档，读完后自动关闭游标
+    - 后台任务定期回收空闲超时的游标
+    - 按客户端标识限制同时打开的游标数量
+    """
+
+    def __init__(self, client_pool: AsyncMongoClientPool, session_config: Dict[str, Any] = None):
+        session_config = session_config or Config.get_cursor_session_config()
+        self.client_pool = client_pool
+        self.max_sessions = session_config["max_sessions"]
+        self.max_sessions_per_client = session_config["max_sessions_per_client"]
+        self.idle_timeout_seconds = session_config["idle_timeout_seconds"]
+        self.reap_interval_seconds = session_config["reap_interval_seconds"]
+        self.default_fetch_size = session_config["default_fetch_size"]
+        self.max_fetch_size = session_config["max_fetch_size"]
+        self._sessions: Dict[str, CursorSession] = {}
+        self._reaper_task: Optional[asyncio.Task] = None
+        self.stats = {"opened": 0, "closed": 0, "reaped": 0, "rejected": 0}
+
+    @staticmethod
+    def _error(message: str) -> Dict[str, Any]:
+        return {
+            "status": "error",
+            "message": message,
+            "timestamp": datetime.now().isoformat()
+        }
+
+    def _get_session(self, client_id: str, cursor_id: str) -> Optional[CursorSession]:
+        session = self._sessions.get(cursor_id)
+        # 只有打开游标的客户端才能访问
+        if session is None or session.client_id != client_id:
+            return None
+        return session
+
+    def _check_quota(self, client_id: str) -> Optional[str]:
+        """检查游标数量配额，超出时返回错误消息"""
+        if len(self._sessions) >= self.max_sessions:
+            self.stats["rejected"] += 1
+            return f"打开的游标数量已达上限 {self.max_sessions}，请稍后重试"
+        client_sessions = sum(1 for session in self._sessions.values() if session.client_id == client_id)
+        if client_sessions >= self.max_sessions_per_client:
+            self.stats["rejected"] += 1
+            return f"每个客户端最多同时打开 {self.max_sessions_per_client} 个游标，请先关闭不再使用的游标"
+        return None
+
+    async def open(self,
+                   client_id: str,
+                   connection_string: str,
+                   database_name: str,
+                   collection_name: str,
+                   query_filter: Dict[str, Any] = None,
+                   projection: Dict[str, Any] = None,
+                   sort: List[tuple] = None,
+                   limit: int = None,
+                   skip: int = None,
+                   batch_size: int = None) -> Dict[str, Any]:
+        """
+        打开游标
+
+        Args:
+            client_id: 客户端标识，用于配额和访问控制
+            connection_string: MongoDB连接字符串
+            database_name: 数据库名称
+            collection_name: 集合名称
+            query_filter: 查询条件字典
+            projection: 投影字段字典
+            sort: 排序条件列表
+            limit: 最多返回的文档总数
+            skip: 跳过文档数量
+            batch_size: 每次getMore从服务器取回的文档数量，默认与default_fetch_size一致
+
+        Returns:
+            Dict: 包含cursor_id的结果字典
+        """
+        quota_error = self._check_quota(client_id)
+        if quota_error:
+            return self._error(quota_error)
+
+        try:
+            client = await self.client_pool.acquire(connection_string)
+        except Exception as e:
+            error_msg = f"连接失败: {str(e)}"
+            logger.error(error_msg)
+            return self._error(error_msg)
+
+        # 等待连接期间可能有其他请求打开了游标，再检查一次
+        quota_error = self._check_quota(client_id)
+        if quota_error:
+            self.client_pool.release(connection_string)
+            return self._error(quota_error)
+
+        try:
+            cursor = client[database_name][collection_name].find(query_filter or {}, projection or None)
+            if sort:
+                cursor = cursor.sort(sort)
+            if skip is not None:
+                cursor = cursor.skip(skip)
+            if limit is not None:
+                cursor = cursor.limit(limit)
+            cursor = cursor.batch_size(batch_size or self.default_fetch_size)
+        except Exception as e:
+            self.client_pool.release(connection_string)
+            error_msg = f"创建游标失败: {str(e)}"
+            logger.error(error_msg)
+            return self._error(error_msg)
+
+        cursor_id = secrets.token_urlsafe(16)
+        self._sessions[cursor_id] = CursorSession(cursor_id, client_id, connection_string, cursor)
+        self.stats["opened"] += 1
+        logger.info(f"游标已打开: {cursor_id}, 集合: {database_name}.{collection_name}")
+
+        return {
+            "status": "success",
+            "message": "游标已打开",
+            "data": {
+                "cursor_id": cursor_id,
+                "idle_timeout_seconds": self.idle_timeout_seconds
+            },
+            "timestamp": datetime.now().isoformat()
+        }
+
+    async def fetch(self, client_id: str, cursor_id: str, size: int = None) -> Dict[str, Any]:
+        """
+        获取下一批文档，没有更多文档时自动关闭游标
+
+        Args:
+            client_id: 客户端标识
+            cursor_id: open返回的游标ID
+            size: 本次获取的文档数量
+
+        Returns:
+            Dict: 包含documents、has_more和累计获取数量的结果字典
+        """
+        session = self._get_session(client_id, cursor_id)
+        if session is None:
+            return self._error("游标不存在或已过期")
+
+        size = min(size or self.default_fetch_size, self.max_fetch_size)
+        async with session.lock:
+            if cursor_id not in self._sessions:
+                # 等待期间被关闭或回收
+                return self._error("游标不存在或已过期")
+            try:
+                documents = await session.cursor.to_list(length=size)
+            except Exception as e:
+                await self._close(cursor_id)
+                error_msg = f"获取游标数据失败: {str(e)}"
+                logger.error(error_msg)
+                return self._error(error_msg)
+
+            session.last_used = time.monotonic()
+            session.fetched += len(documents)
+            has_more = session.cursor.alive
+            if not has_more:
+                await self._close(cursor_id)
+
+        # 转换ObjectId、Decimal128等MongoDB类型（包括嵌套字段）
+        documents = encode_documents(documents)
+
+        return {
+            "status": "success",
+            "message": f"获取成功，返回 {len(documents)} 个文档" + ("" if has_more else "，游标已读完并关闭"),
+            "data": {
+                "cursor_id": cursor_id,
+                "documents": documents,
+                "has_more": has_more,
+                "fetched": session.fetched
+            },
+            "count": len(documents),
+            "timestamp": datetime.now().isoformat()
+        }
+
+    async def close(self, client_id: str, cursor_id: str) -> Dict[str, Any]:
+        """
+        关闭游标
+
+        Args:
+            client_id: 客户端标识
+            cursor_id: open返回的游标ID
+
+        Returns:
+            Dict: 关闭结果
+        """
+        if self._get_session(client_id, cursor_id) is None:
+            return self._error("游标不存在或已过期")
+        await self._close(cursor_id)
+        return {
+            "status": "success",
+            "message": "游标已关闭",
+            "timestamp": datetime.now().isoformat()
+        }
+
+    async def _close(self, cursor_id: str):
+        session = self._sessions.pop(cursor_id, None)
+        if session is None:
+            return
+        try:
+            await session.cursor.close()
+        except Exception as e:
+            logger.error(f"关闭游标时出错: {e}")
+        finally:
+            # 归还客户端到连接池
+            self.client_pool.release(session.connection_string)
+            self.stats["closed"] += 1
+            logger.info(f"游标已关闭: {cursor_id}, 共获取 {session.fetched} 个文档")
+
+    async def reap_idle(self) -> int:
+        """
+        回收空闲超时的游标（正在获取数据的游标不回收）
+
+        Returns:
+            int: 回收的游标数量
+        """
+        deadline = time.monotonic() - self.idle_timeout_seconds
+        idle_ids = [cursor_id for cursor_id, session in self._sessions.items()
+                    if session.last_used < deadline and not session.lock.locked()]
+        for cursor_id in idle_ids:
+            await self._close(cursor_id)
+        if idle_ids:
+            self.stats["reaped"] += len(idle_ids)
+            logger.info(f"回收 {len(idle_ids)} 个空闲游标")
+        return len(idle_ids)
+
+    async def _reap_loop(self):
+        while True:
+            await asyncio.sleep(self.reap_interval_seconds)
+            try:
+                await self.reap_idle()
+            except Exception as e:
+                logger.error(f"回收空闲游标时出错: {e}")
+
+    def start(self):
+        """启动空闲游标回收任务（应用启动时调用）"""
+        if self._reaper_task is None:
+            self._reaper_task = asyncio.create_task(self._reap_loop())
+
+    async def stop(self):
+        """停止回收任务并关闭所有游标（应用关闭时调用）"""
+        if self._reaper_task is not None:
+            self._reaper_task.cancel()
+            try:
+                await self._reaper_task
+            except asyncio.CancelledError:
+                pass
+            self._reaper_task = None
+        for cursor_id in list(self._sessions):
+            await self._close(cursor_id)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        获取游标会话统计
+
+        Returns:
+            Dict: 当前打开的游标数、客户端数及累计打开/关闭/回收/拒绝次数
+        """
+        return {
+            **self.stats,
+            "active": len(self._sessions),
+            "clients": len({session.client_id for session in self._sessions.values()}),
+            "max_sessions": self.max_sessions,
+            "max_sessions_per_client": self.max_sessions_per_client
+        }
+
+
+# 创建一个全局的CursorSessionManager实例，方便在应用中复用
+cursor_session_manager = CursorSessionManager(async_mongo_client_pool)
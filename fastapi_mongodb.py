@@ -1,20 +1,44 @@
-from fastapi import FastAPI, HTTPException, Depends, Query, Path, Request
+from fastapi import FastAPI, HTTPException, Depends, Header, Query, Path, Request
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, Field, model_serializer
-from typing import Dict, List, Any, Optional
-from mongodb_api import MongoDBQueryAPI
-from redis_cache import redis_cache
+from typing import Annotated, AsyncIterator, Awaitable, Callable, Dict, List, Any, Literal, Optional, Tuple, Union
+from async_mongodb_api import AsyncMongoDBQueryAPI
+from redis_cache import async_redis_cache
+from tiered_cache import tiered_cache
+from singleflight import single_flight
+from change_stream_invalidator import change_stream_invalidator, pipeline_collections
+from cursor_sessions import cursor_session_manager
+from ndjson_ingest import ndjson_ingestor
+from mongo_client_pool import mongo_client_pool, async_mongo_client_pool
 import uvicorn
 from contextlib import asynccontextmanager
 from datetime import datetime
 from swagger_config import get_swagger_config
+from config import Config
+from middleware import ProcessTimeMiddleware, TracingMiddleware
+from json_encoding import FastJSONResponse, dumps, dumps_lines
+from columnar import BINARY_FORMATS, ColumnarFormatError, encode_binary, to_columns
+from arrow_decoding import ArrowStreamWriter, pyarrow
+from query_plans import index_advisor, pipeline_shape
+from query_metrics import query_metrics, timed
+from prometheus_metrics import observe_serialization, prometheus_config, render_metrics
+from tracing import setup_tracing, shutdown_tracing, tracing_config
+import asyncio
 import time
-import json
-from fastapi.responses import Response
+from fastapi.responses import Response, StreamingResponse
 
 # 获取Swagger配置
 swagger_config = get_swagger_config()
 
+# 缓存刷新配置（stale-while-revalidate / XFetch）
+cache_refresh_config = Config.get_cache_refresh_config()
+
+# 批量查询配置
+batch_config = Config.get_batch_config()
+
+# 批量写入配置
+bulk_write_config = Config.get_bulk_write_config()
+
 # 全局MongoDB API实例
 mongodb_api = None
 
@@ -22,10 +46,32 @@ mongodb_api = None
 async def lifespan(app: FastAPI):
     """应用生命周期管理"""
     global mongodb_api
-    mongodb_api = MongoDBQueryAPI()
+    mongodb_api = AsyncMongoDBQueryAPI()
+    # 启用追踪时初始化span导出（每个工作进程各自导出）
+    setup_tracing()
+    # 测试Redis连接，不可用时自动降级为不使用缓存
+    await async_redis_cache.initialize()
+    # 订阅跨工作进程的本地缓存失效通知
+    tiered_cache.start()
+    # 启动空闲游标回收
+    cursor_session_manager.start()
+    # 定期关闭空闲超时的MongoDB客户端
+    mongo_client_pool.start()
+    async_mongo_client_pool.start()
     yield
+    # 关闭所有游标、停止变更流监听（会归还占用的MongoDB客户端）
+    await cursor_session_manager.stop()
+    await change_stream_invalidator.stop()
     if mongodb_api:
         mongodb_api.close_connection()
+    # 关闭连接池中所有复用的MongoDB客户端
+    await async_mongo_client_pool.stop()
+    await mongo_client_pool.stop()
+    async_mongo_client_pool.close_all()
+    mongo_client_pool.close_all()
+    await tiered_cache.stop()
+    await async_redis_cache.close()
+    shutdown_tracing()
 
 # 创建FastAPI应用，使用优化的Swagger配置
 app = FastAPI(
@@ -94,41 +140,12 @@ app.add_middleware(
     allow_headers=["*"],  # 允许所有头
 )
 
-@app.middleware("http")
-async def add_process_time_header(request: Request, call_next):
-    """
-    添加性能统计中间件
-    - 计算请求处理时间
-    - 计算响应数据长度
-    - 添加到响应头和日志
-    """
-    start_time = time.time()
-    response = await call_next(request)
-    process_time = time.time() - start_time
-    
-    # 将处理时间添加到响应头
-    response.headers["X-Process-Time-Ms"] = str(round(process_time * 1000, 2))
-    
-    # 获取响应体并计算长度
-    response_body = b""
-    async for chunk in response.body_iterator:
-        response_body += chunk
-    
-    response_length = len(response_body)
-    response.headers["X-Response-Length"] = str(response_length)
-    
-    # 打印日志
-    print(f"INFO:     Request: {request.method} {request.url.path} - "
-          f"Process Time: {response.headers['X-Process-Time-Ms']}ms - "
-          f"Response Length: {response_length} bytes")
+# 性能统计中间件（最后添加，位于最外层，统计的是压缩后的实际发送字节数）
+app.add_middleware(ProcessTimeMiddleware)
 
-    # 从原始响应重新创建新的响应，因为body_iterator已被消耗
-    return Response(
-        content=response_body,
-        status_code=response.status_code,
-        headers=dict(response.headers),
-        media_type=response.media_type
-    )
+# 追踪中间件（可选，位于最外层，请求span包含其他中间件和响应体发送的耗时）
+if tracing_config["enabled"]:
+    app.add_middleware(TracingMiddleware)
 
 # 数据模型
 class ConnectionRequest(BaseModel):
@@ -211,6 +228,32 @@ class QueryRequest(BaseModel):
         ge=0,
         le=10000
     )
+    paginate: bool = Field(
+        default=False,
+        description="是否使用键集分页。为true时返回next_page_token，limit为每页文档数量，不能与skip同时使用；翻页耗时与页码无关（排序字段需要有索引）"
+    )
+    page_token: Optional[str] = Field(
+        default=None,
+        description="上一页响应中的next_page_token，传入时自动使用键集分页；查询条件、投影和排序必须与第一页一致"
+    )
+    stream_format: Optional[Literal["ndjson", "json"]] = Field(
+        default=None,
+        description="流式返回格式：ndjson（每行一个文档）或json（分块输出的JSON数组）。设置后按游标批次边查边写，不读取也不写入缓存"
+    )
+    batch_size: Optional[int] = Field(
+        default=None,
+        description="流式返回时每个游标批次的文档数量，默认使用配置中的stream_batch_size",
+        ge=1,
+        le=10000
+    )
+    format: Optional[Literal["rows", "columns", "arrow", "parquet"]] = Field(
+        default=None,
+        description="结果格式：rows（默认，每个文档一个JSON对象）、columns（按列返回字段列表和每列的值数组）、arrow（Apache Arrow IPC流）、parquet。各种格式共用同一份缓存；arrow和parquet需要安装pyarrow，不能与stream_format同时使用"
+    )
+    explain: bool = Field(
+        default=False,
+        description="是否只返回执行计划摘要（COLLSCAN/IXSCAN、使用的索引、扫描的键和文档数量、耗时），不返回文档。不读取也不写入缓存，不能与stream_format、format、键集分页同时使用"
+    )
     cache_ttl: Optional[int] = Field(
         default=300,
         description="缓存时间（秒）。传0则不使用缓存，传None则使用默认缓存时间。"
@@ -281,6 +324,10 @@ class QueryOneRequest(BaseModel):
         description="排序条件，格式：[['字段名', 1或-1]]，1为升序，-1为降序",
         example=[["age", -1], ["name", 1]]
     )
+    explain: bool = Field(
+        default=False,
+        description="是否只返回执行计划摘要（COLLSCAN/IXSCAN、使用的索引、扫描的键和文档数量、耗时），不返回文档。不读取也不写入缓存"
+    )
     cache_ttl: Optional[int] = Field(
         default=300,
         description="缓存时间（秒）。传0则不使用缓存，传None则使用默认缓存时间。"
@@ -339,6 +386,29 @@ class AggregateRequest(BaseModel):
         description="聚合管道，支持MongoDB聚合操作符",
         min_items=1
     )
+    stream_format: Optional[Literal["ndjson", "json", "arrow"]] = Field(
+        default=None,
+        description="流式返回格式：ndjson（每行一个文档）、json（分块输出的JSON数组）或arrow（Arrow IPC流，每个游标批次直接从原始BSON解码为一个RecordBatch，需要安装pyarrow，安装pymongoarrow时更快）。设置后按游标批次边查边写，不读取也不写入缓存"
+    )
+    arrow_schema: Optional[Dict[str, str]] = Field(
+        default=None,
+        description="stream_format=arrow时的列类型：字段名 -> int32/int64/double/string/bool/timestamp/objectid/decimal128，只输出声明的字段；不传时根据第一个批次推断，之后的批次出现新字段时报错（结果字段不固定时需要声明）",
+        example={"_id": "string", "count": "int64", "avg_age": "double"}
+    )
+    batch_size: Optional[int] = Field(
+        default=None,
+        description="流式返回时每个游标批次的文档数量，默认使用配置中的stream_batch_size",
+        ge=1,
+        le=10000
+    )
+    format: Optional[Literal["rows", "columns", "arrow", "parquet"]] = Field(
+        default=None,
+        description="结果格式：rows（默认，每个文档一个JSON对象）、columns（按列返回字段列表和每列的值数组）、arrow（Apache Arrow IPC流）、parquet。各种格式共用同一份缓存；arrow和parquet需要安装pyarrow，不能与stream_format同时使用"
+    )
+    explain: bool = Field(
+        default=False,
+        description="是否只返回执行计划摘要（COLLSCAN/IXSCAN、使用的索引、扫描的键和文档数量、耗时），不返回文档。不读取也不写入缓存，不能与stream_format、format、键集分页同时使用"
+    )
     cache_ttl: Optional[int] = Field(
         default=300,
         description="缓存时间（秒）。传0则不使用缓存，传None则使用默认缓存时间。"
@@ -416,12 +486,213 @@ class DistinctRequest(BaseModel):
             }
         }
 
+class CursorOpenRequest(BaseModel):
+    # 数据库连接信息
+    connection_string: str = Field(
+        ..., 
+        description="MongoDB连接字符串",
+        example="mongodb://localhost:27017/",
+        min_length=1
+    )
+    database_name: str = Field(
+        ..., 
+        description="数据库名称",
+        example="test_db",
+        min_length=1
+    )
+    collection_name: str = Field(
+        ..., 
+        description="集合名称",
+        example="users",
+        min_length=1
+    )
+    
+    # 查询参数
+    query_filter: Optional[Dict[str, Any]] = Field(
+        default=None, 
+        description="查询条件，支持MongoDB查询语法",
+        example={"age": {"$gte": 25}}
+    )
+    projection: Optional[Dict[str, Any]] = Field(
+        default=None, 
+        description="投影字段，1表示包含，0表示排除",
+        example={"name": 1, "age": 1}
+    )
+    sort: Optional[List[List[Any]]] = Field(
+        default=None, 
+        description="排序条件，格式：[['字段名', 1或-1]]",
+        example=[["age", -1]]
+    )
+    limit: Optional[int] = Field(
+        default=None, 
+        description="最多返回的文档总数，不传则读取全部匹配文档",
+        ge=1
+    )
+    skip: Optional[int] = Field(
+        default=None, 
+        description="跳过文档数量",
+        ge=0
+    )
+    batch_size: Optional[int] = Field(
+        default=None,
+        description="每次getMore从MongoDB取回的文档数量，默认使用配置中的default_fetch_size",
+        ge=1,
+        le=10000
+    )
+
+    class Config:
+        json_schema_extra = {
+            "example": {
+                "connection_string": "mongodb://localhost:27017/",
+                "database_name": "test_db",
+                "collection_name": "users",
+                "query_filter": {"age": {"$gte": 25}},
+                "sort": [["age", -1]],
+                "batch_size": 1000
+            }
+        }
+
+class IndexAdviceRequest(ConnectionRequest):
+    sample_size: Optional[int] = Field(
+        default=None,
+        description="估算选择性时抽样的文档数量，默认使用配置中的INDEX_ADVISOR_SAMPLE_SIZE",
+        ge=1,
+        le=100000
+    )
+
+# 批量查询的操作：在对应接口的请求模型上增加op字段区分类型
+class BatchQueryOperation(QueryRequest):
+    op: Literal["query"] = Field(..., description="操作类型，对应 /query")
+
+class BatchQueryOneOperation(QueryOneRequest):
+    op: Literal["query_one"] = Field(..., description="操作类型，对应 /query_one")
+
+class BatchAggregateOperation(AggregateRequest):
+    op: Literal["aggregate"] = Field(..., description="操作类型，对应 /aggregate")
+
+class BatchDistinctOperation(DistinctRequest):
+    op: Literal["distinct"] = Field(..., description="操作类型，对应 /distinct")
+
+BatchOperation = Annotated[
+    Union[BatchQueryOperation, BatchQueryOneOperation, BatchAggregateOperation, BatchDistinctOperation],
+    Field(discriminator="op")
+]
+
+class BatchRequest(BaseModel):
+    operations: List[BatchOperation] = Field(
+        ...,
+        description="要执行的操作列表，每个操作的参数与对应接口相同，另加op字段指明类型",
+        min_items=1,
+        max_items=batch_config["max_operations"]
+    )
+
+    class Config:
+        json_schema_extra = {
+            "example": {
+                "operations": [
+                    {
+                        "op": "query",
+                        "connection_string": "mongodb://localhost:27017/",
+                        "database_name": "test_db",
+                        "collection_name": "users",
+                        "query_filter": {"status": "active"},
+                        "limit": 10
+                    },
+                    {
+                        "op": "distinct",
+                        "connection_string": "mongodb://localhost:27017/",
+                        "database_name": "test_db",
+                        "collection_name": "users",
+                        "field": "department"
+                    },
+                    {
+                        "op": "aggregate",
+                        "connection_string": "mongodb://localhost:27017/",
+                        "database_name": "test_db",
+                        "collection_name": "users",
+                        "pipeline": [{"$group": {"_id": "$department", "count": {"$sum": 1}}}]
+                    }
+                ]
+            }
+        }
+
+class WriteConcernOptions(BaseModel):
+    w: Optional[Union[int, str]] = Field(
+        default=None,
+        description="写入确认的节点数，或 \"majority\"；/bulk_write不支持0（不等待确认）",
+        example="majority"
+    )
+    j: Optional[bool] = Field(
+        default=None,
+        description="是否等待写入日志（journal）后再确认"
+    )
+    wtimeout: Optional[int] = Field(
+        default=None,
+        description="等待写关注满足的超时时间（毫秒）",
+        ge=0
+    )
+
+class BulkWriteRequest(BaseModel):
+    # 数据库连接信息
+    connection_string: str = Field(
+        ..., 
+        description="MongoDB连接字符串",
+        example="mongodb://localhost:27017/",
+        min_length=1
+    )
+    database_name: str = Field(
+        ..., 
+        description="数据库名称",
+        example="test_db",
+        min_length=1
+    )
+    collection_name: str = Field(
+        ..., 
+        description="集合名称",
+        example="users",
+        min_length=1
+    )
+    
+    # 写入参数
+    operations: List[Dict[str, Any]] = Field(
+        ...,
+        description="写操作列表，每个操作形如 {\"insert_one\": {\"document\": {...}}}，支持insert_one、update_one、update_many、replace_one、delete_one、delete_many",
+        min_items=1,
+        max_items=bulk_write_config["max_operations"]
+    )
+    ordered: bool = Field(
+        default=True,
+        description="是否按顺序执行。true时遇到第一个错误即停止；false时所有操作都会执行，并返回所有错误"
+    )
+    write_concern: Optional[WriteConcernOptions] = Field(
+        default=None,
+        description="写关注，不传则使用连接字符串或服务器的默认值"
+    )
+
+    class Config:
+        json_schema_extra = {
+            "example": {
+                "connection_string": "mongodb://localhost:27017/",
+                "database_name": "test_db",
+                "collection_name": "users",
+                "operations": [
+                    {"insert_one": {"document": {"name": "赵六", "age": 27, "department": "技术部"}}},
+                    {"update_one": {"filter": {"name": "张三"}, "update": {"$set": {"age": 29}}}},
+                    {"update_one": {"filter": {"name": "钱七"}, "update": {"$set": {"age": 31}}, "upsert": True}},
+                    {"delete_many": {"filter": {"status": "inactive"}}}
+                ],
+                "ordered": True,
+                "write_concern": {"w": "majority", "wtimeout": 5000}
+            }
+        }
+
 class ApiResponse(BaseModel):
     status: str = Field(..., description="响应状态：success/error/info")
     message: str = Field(..., description="响应消息")
     data: Optional[Any] = Field(default=None, description="响应数据")
     count: Optional[int] = Field(default=None, description="数据条数")
     cache_ttl: Optional[int] = Field(default=None, description="缓存时间（秒）")
+    next_page_token: Optional[str] = Field(default=None, description="下一页的分页令牌（键集分页时返回，没有下一页时不返回）")
     timestamp: str = Field(..., description="响应时间戳")
 
     @model_serializer
@@ -437,6 +708,8 @@ class ApiResponse(BaseModel):
             response['count'] = self.count
         if self.cache_ttl is not None:
             response['cache_ttl'] = self.cache_ttl
+        if self.next_page_token is not None:
+            response['next_page_token'] = self.next_page_token
         return response
 
     class Config:
@@ -453,89 +726,567 @@ class ApiResponse(BaseModel):
             }
         }
 
-# 依赖函数
-def get_mongodb_api():
-    """获取MongoDB API实例"""
-    if mongodb_api is None:
-        raise HTTPException(status_code=500, detail="MongoDB API未初始化")
-    return mongodb_api
+def response_envelope(result: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    把结果字典整理为ApiResponse序列化后的格式（字段顺序、可选字段的取舍与ser_model一致）
+    
+    Args:
+        result: 查询结果字典，多余的键会被丢弃
+        
+    Returns:
+        Dict: 响应字典
+    """
+    response = {
+        "status": result["status"],
+        "message": result["message"],
+        "data": result.get("data"),
+        "timestamp": result["timestamp"],
+    }
+    for field in ("count", "cache_ttl", "next_page_token"):
+        if result.get(field) is not None:
+            response[field] = result[field]
+    return response
 
-# API路由
-@app.post(
-    "/connect", 
-    response_model=ApiResponse,
-    summary="连接MongoDB数据库",
-    description="""
-    连接到指定的MongoDB数据库和集合。
+def api_response(result: Dict[str, Any]) -> FastJSONResponse:
+    """
+    直接把结果字典编码为JSON响应
     
-    **参数说明：**
-    - `connection_string`: MongoDB连接字符串
-    - `database_name`: 要连接的数据库名称
-    - `collection_name`: 要操作的集合名称
+    返回Response对象时FastAPI不再按response_model校验，也不经过jsonable_encoder逐个遍历文档，
+    response_model=ApiResponse只用于生成接口文档
+    """
+    with observe_serialization("json"):
+        return FastJSONResponse(response_envelope(result))
+
+def columnar_result(result: Dict[str, Any]) -> Dict[str, Any]:
+    """把成功结果中的文档列表转换为按列的格式（返回新的字典，不修改可能来自缓存的原结果）"""
+    if result["status"] != "success" or not isinstance(result.get("data"), list):
+        return result
+    return {**result, "data": to_columns(result["data"])}
+
+def formatted_response(result: Dict[str, Any], result_format: Optional[str]) -> Response:
+    """
+    按请求的format返回结果
     
-    **返回结果：**
-    - 成功：返回连接成功信息
-    - 失败：返回错误详情
+    Args:
+        result: 查询结果字典
+        result_format: rows/columns/arrow/parquet，None等同于rows
+        
+    Returns:
+        Response: JSON响应；arrow和parquet为二进制响应，文档数量和分页令牌放在响应头中
+    """
+    if result_format == "columns":
+        return api_response(columnar_result(result))
+    if result_format not in BINARY_FORMATS or result["status"] != "success":
+        return api_response(result)
     
-    **使用示例：**
-    ```json
-    {
-        "connection_string": "mongodb://localhost:27017/",
-        "database_name": "test_db",
-        "collection_name": "users"
-    }
-    ```
-    """,
-    tags=["连接管理"],
-    responses={
-        200: {
-            "description": "连接成功",
-            "content": {
-                "application/json": {
-                    "example": {
-                        "status": "success",
-                        "message": "连接成功",
-                        "data": {
-                            "database": "test_db",
-                            "collection": "users"
-                        },
-                        "timestamp": "2024-01-01T12:00:00"
-                    }
-                }
-            }
-        },
-        400: {
-            "description": "连接失败",
-            "content": {
-                "application/json": {
-                    "example": {
-                        "status": "error",
-                        "message": "连接失败: 无法连接到MongoDB服务器",
-                        "timestamp": "2024-01-01T12:00:00"
-                    }
-                }
-            }
-        }
-    }
-)
-async def connect_to_mongodb(
-    request: ConnectionRequest,
-    api: MongoDBQueryAPI = Depends(get_mongodb_api)
-): 
-    result = api.connect_to_mongodb(
+    try:
+        with observe_serialization(result_format):
+            content = encode_binary(result["data"], result_format)
+    except ColumnarFormatError as e:
+        return api_response({
+            "status": "error",
+            "message": str(e),
+            "timestamp": datetime.now().isoformat()
+        })
+    headers = {"X-Result-Count": str(len(result["data"]))}
+    if result.get("next_page_token"):
+        headers["X-Next-Page-Token"] = result["next_page_token"]
+    return Response(content=content, media_type=BINARY_FORMATS[result_format], headers=headers)
+
+# 流式响应
+STREAM_MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "json": "application/json",
+    "arrow": BINARY_FORMATS["arrow"]
+}
+
+async def _encode_arrow_stream(first_batch: Any, batches: AsyncIterator[Any]) -> AsyncIterator[bytes]:
+    """把RecordBatch逐个写成Arrow IPC流；没有结果时只输出schema和结束标记"""
+    writer = None
+    batch = first_batch
+    while batch is not None:
+        if writer is None:
+            writer = ArrowStreamWriter(batch.schema)
+        yield writer.write(batch)
+        batch = await anext(batches, None)
+    if writer is None:
+        writer = ArrowStreamWriter(pyarrow.schema([]))
+    yield writer.close()
+
+async def _encode_stream(
+    api: AsyncMongoDBQueryAPI,
+    batches: AsyncIterator[List[Dict[str, Any]]],
+    first_batch: Optional[Any],
+    stream_format: str
+) -> AsyncIterator[bytes]:
+    """
+    把游标批次编码为NDJSON、JSON数组或Arrow IPC流分块写出，结束后归还连接
+    
+    每个游标批次编码为一个分块，内存占用只与batch_size有关
+    """
+    try:
+        if stream_format == "arrow":
+            async for chunk in _encode_arrow_stream(first_batch, batches):
+                yield chunk
+            return
+        
+        if stream_format == "json":
+            yield b"["
+        
+        first = True
+        batch = first_batch
+        while batch:
+            if stream_format == "ndjson":
+                yield dumps_lines(batch)
+            else:
+                chunk = b",".join(dumps(doc) for doc in batch)
+                yield chunk if first else b"," + chunk
+                first = False
+            batch = await anext(batches, None)
+        
+        if stream_format == "json":
+            yield b"]"
+    except Exception as e:
+        # 响应头已发送，无法再修改状态码
+        print(f"ERROR:    流式查询中断: {e}")
+        if stream_format == "ndjson":
+            # NDJSON最后追加一行错误信息
+            yield dumps_lines([{
+                "status": "error",
+                "message": f"流式查询中断: {str(e)}",
+                "timestamp": datetime.now().isoformat()
+            }])
+        else:
+            # JSON数组和Arrow流无法表达错误，直接中断连接让客户端感知结果不完整
+            raise
+    finally:
+        await batches.aclose()
+        api.close_connection()
+
+async def streaming_query_response(
+    request: Any,
+    open_batches: Callable[[AsyncMongoDBQueryAPI], AsyncIterator[List[Dict[str, Any]]]]
+):
+    """
+    以流式方式执行查询：连接数据库、预取第一批结果（以便返回查询错误），然后分块写出
+    
+    Args:
+        request: 包含连接信息、stream_format和batch_size的请求模型
+        open_batches: 根据已连接的API创建批次迭代器的函数
+    """
+    api = AsyncMongoDBQueryAPI()
+    connection_result = await api.connect_to_mongodb(
         request.connection_string,
         request.database_name,
-        request.collection_name
+        request.collection_name,
+        use_pool=True
     )
     
-    if result["status"] == "error":
-        raise HTTPException(status_code=400, detail=result["message"])
+    if connection_result["status"] == "error":
+        api.close_connection()
+        return ApiResponse(
+            status="error",
+            message=f"连接失败: {connection_result['message']}",
+            timestamp=datetime.now().isoformat()
+        )
     
-    return ApiResponse(**result)
+    batches = open_batches(api)
+    try:
+        # 预取第一批，查询语法等错误在发送响应头前就能返回
+        first_batch = await batches.__anext__()
+    except StopAsyncIteration:
+        first_batch = None
+    except Exception as e:
+        await batches.aclose()
+        api.close_connection()
+        return ApiResponse(
+            status="error",
+            message=f"查询过程中发生错误: {str(e)}",
+            timestamp=datetime.now().isoformat()
+        )
+    
+    return StreamingResponse(
+        _encode_stream(api, batches, first_batch, request.stream_format),
+        media_type=STREAM_MEDIA_TYPES[request.stream_format]
+    )
 
-@app.post(
-    "/query", 
-    response_model=ApiResponse,
+# 查询执行与缓存
+async def run_query(
+    request: Any,
+    execute: Callable[[AsyncMongoDBQueryAPI], Awaitable[Dict[str, Any]]]
+) -> Dict[str, Any]:
+    """
+    从连接池获取连接并执行查询，结束后归还连接
+    
+    Args:
+        request: 包含连接信息的请求模型
+        execute: 在已连接的API上执行查询的协程函数
+        
+    Returns:
+        Dict: 查询结果字典
+    """
+    api = AsyncMongoDBQueryAPI()
+    try:
+        # 连接数据库
+        with timed("connect"):
+            connection_result = await api.connect_to_mongodb(
+                request.connection_string,
+                request.database_name,
+                request.collection_name,
+                use_pool=True
+            )
+        
+        if connection_result["status"] == "error":
+            return {
+                "status": "error",
+                "message": f"连接失败: {connection_result['message']}",
+                "timestamp": datetime.now().isoformat()
+            }
+        
+        with timed("execute"):
+            return await execute(api)
+    finally:
+        # 归还连接到连接池
+        api.close_connection()
+
+# 后台刷新任务，保存引用避免任务被垃圾回收；同一个键同时只刷新一次
+background_refresh_tasks: Dict[str, asyncio.Task] = {}
+
+def schedule_background_refresh(
+    cache_key: str,
+    compute: Callable[[], Awaitable[Dict[str, Any]]],
+    fetch_fresh: Callable[[], Awaitable[Optional[Dict[str, Any]]]]
+):
+    """
+    在后台刷新缓存（stale-while-revalidate）
+    
+    通过single-flight获取跨进程锁，其他工作进程已刷新出新鲜数据时直接结束
+    """
+    if cache_key in background_refresh_tasks:
+        return
+    
+    async def refresh():
+        try:
+            await single_flight.do(cache_key, compute, fetch_fresh)
+        except Exception as e:
+            print(f"ERROR:    后台刷新缓存失败: {cache_key} - {e}")
+        finally:
+            background_refresh_tasks.pop(cache_key, None)
+    
+    background_refresh_tasks[cache_key] = asyncio.create_task(refresh())
+
+async def cached_query_result(
+    request: Any,
+    cache_prefix: str,
+    execute: Callable[[AsyncMongoDBQueryAPI], Awaitable[Dict[str, Any]]],
+    hit_message: Callable[[Dict[str, Any]], str],
+    error_message: str,
+    collections: Optional[List[str]] = None,
+    cache_key: Optional[str] = None,
+    prefetched_entries: Optional[Dict[str, Optional[Tuple[Any, str]]]] = None
+) -> Dict[str, Any]:
+    """
+    带缓存的查询流程：读缓存 -> 合并并发未命中 -> 查询数据库 -> 写缓存
+    
+    Args:
+        request: 包含连接信息、cache_ttl和force_refresh的请求模型
+        cache_prefix: 缓存键前缀
+        execute: 在已连接的API上执行查询的协程函数
+        hit_message: 根据缓存结果生成命中消息的函数
+        error_message: 发生异常时的错误消息前缀
+        collections: 查询读取的集合，用于变更流失效；默认为请求的集合
+        cache_key: 已生成的缓存键，默认根据请求参数生成
+        prefetched_entries: 已批量读取的缓存条目（缓存键 -> get_entry的结果），包含该键时不再单独读取缓存
+        
+    Returns:
+        Dict: 查询结果字典
+    """
+    use_cache = request.cache_ttl != 0
+    
+    try:
+        if not use_cache:
+            return await run_query(request, execute)
+        
+        # 使用规范化后的查询参数生成缓存键（不含cache_ttl、force_refresh等字段，语义相同的查询共用缓存）
+        if cache_key is None:
+            cache_key = tiered_cache.generate_cache_key(cache_prefix, request.dict())
+        
+        async def fetch_cached() -> Optional[Dict[str, Any]]:
+            return await tiered_cache.get(cache_key)
+        
+        async def fetch_fresh() -> Optional[Dict[str, Any]]:
+            entry = await tiered_cache.get_entry(cache_key)
+            return entry[0] if entry is not None and entry[1] == "fresh" else None
+        
+        async def compute() -> Dict[str, Any]:
+            start_time = time.perf_counter()
+            # 查询前读取集合标签的版本号，查询期间集合被写入（标签已失效）时不缓存可能过时的结果
+            source_collections = collections or [request.collection_name]
+            generations = await tiered_cache.tag_generations([
+                change_stream_invalidator.namespace_tag(
+                    request.connection_string, request.database_name, collection_name
+                )
+                for collection_name in source_collections
+            ])
+            result = await run_query(request, execute)
+            # 设置缓存 (如果查询成功)，记录计算耗时用于XFetch提前刷新
+            if result["status"] == "success":
+                # 按读取的集合打标签，集合通过/bulk_write写入或变更流监听到写入时失效
+                tags = change_stream_invalidator.track(
+                    request.connection_string,
+                    request.database_name,
+                    source_collections
+                )
+                await tiered_cache.set(
+                    cache_key,
+                    result,
+                    ttl=request.cache_ttl,
+                    broadcast=request.force_refresh,
+                    compute_seconds=time.perf_counter() - start_time,
+                    tags=tags,
+                    generations=generations
+                )
+            return result
+        
+        if request.force_refresh:
+            # 强制刷新：直接查询数据库并更新缓存
+            result = await compute()
+        else:
+            # 1. 检查缓存，命中时直接返回结果，不创建MongoDB连接
+            xfetch = cache_prefix in cache_refresh_config["xfetch_prefixes"]
+            if prefetched_entries is not None and cache_key in prefetched_entries:
+                entry = prefetched_entries[cache_key]
+            else:
+                with timed("cache_lookup"):
+                    entry = await tiered_cache.get_entry(cache_key, xfetch=xfetch)
+            if entry is not None:
+                cached_result, freshness = entry
+                message = hit_message(cached_result)
+                if freshness != "fresh":
+                    # 陈旧或即将过期：先返回缓存数据，再在后台刷新
+                    schedule_background_refresh(cache_key, compute, fetch_fresh)
+                    if freshness == "stale":
+                        message += "，数据已过期，正在后台刷新"
+                cached_result["message"] = message
+                # 添加缓存时间信息
+                cached_result["cache_ttl"] = request.cache_ttl
+                return cached_result
+            
+            # 2. 缓存未命中，相同缓存键的并发请求只查询一次数据库
+            result = await single_flight.do(cache_key, compute, fetch_cached)
+        
+        if result["status"] == "success":
+            # 添加缓存时间信息到响应
+            result["cache_ttl"] = request.cache_ttl
+        return result
+        
+    except Exception as e:
+        return {
+            "status": "error",
+            "message": f"{error_message}: {str(e)}",
+            "timestamp": datetime.now().isoformat()
+        }
+
+async def observed_query(
+    op: str,
+    request: Any,
+    spec: Dict[str, Any],
+    result_format: Optional[str] = None
+) -> Response:
+    """
+    执行带缓存的查询并按format编码响应，按查询形状统计耗时（超过阈值时写入慢查询日志）
+    
+    Args:
+        op: 操作类型（query、query_one、aggregate、distinct）
+        request: 请求模型
+        spec: cached_query_result的参数
+        result_format: 结果格式，None等同于rows
+    """
+    with query_metrics.observe(op, request) as trace:
+        result = await cached_query_result(request, **spec)
+        if trace is not None:
+            trace.set_result(result)
+        with timed("serialize"):
+            return formatted_response(result, result_format)
+
+# 各接口的缓存查询参数（单独调用和/batch共用，保证两者生成相同的缓存键和结果）
+def sort_tuples(sort: Optional[List[List[Any]]]) -> Optional[List[tuple]]:
+    """转换排序格式：[['字段名', 1]] -> [('字段名', 1)]"""
+    if not sort:
+        return None
+    return [(item[0], item[1]) for item in sort]
+
+def query_error(request: QueryRequest) -> Optional[str]:
+    """检查/query参数组合，返回错误消息"""
+    if (request.paginate or request.page_token) and (request.skip or request.stream_format):
+        return "键集分页不能与skip或stream_format同时使用"
+    if request.explain and (request.paginate or request.page_token):
+        return "explain不能与键集分页同时使用"
+    return format_error(request)
+
+def format_error(request: Union[QueryRequest, AggregateRequest]) -> Optional[str]:
+    """检查format参数组合，返回错误消息"""
+    if request.format not in (None, "rows") and request.stream_format:
+        return "format不能与stream_format同时使用"
+    if request.explain and (request.stream_format or request.format not in (None, "rows")):
+        return "explain不能与stream_format或format同时使用"
+    return None
+
+def query_spec(request: QueryRequest) -> Dict[str, Any]:
+    """/query的缓存查询参数（键集分页或普通查询）"""
+    sort_list = sort_tuples(request.sort)
+    if request.paginate or request.page_token:
+        # 键集分页：按上一页最后一个文档的排序键定位，不使用skip
+        execute = lambda api: api.query_page(
+            query_filter=request.query_filter,
+            projection=request.projection,
+            sort=sort_list,
+            limit=request.limit,
+            page_token=request.page_token
+        )
+    else:
+        execute = lambda api: api.query_documents(
+            query_filter=request.query_filter,
+            projection=request.projection,
+            sort=sort_list,
+            limit=request.limit,
+            skip=request.skip,
+            explain=request.explain
+        )
+    return {
+        "cache_prefix": "query",
+        "execute": execute,
+        "hit_message": lambda cached: f"查询成功 (来自缓存)，返回 {cached.get('count', 0)} 个文档",
+        "error_message": "查询过程中发生错误"
+    }
+
+def query_one_spec(request: QueryOneRequest) -> Dict[str, Any]:
+    """/query_one的缓存查询参数"""
+    sort_list = sort_tuples(request.sort)
+    return {
+        "cache_prefix": "query_one",
+        "execute": lambda api: api.query_one_document(
+            query_filter=request.query_filter,
+            projection=request.projection,
+            sort=sort_list,
+            explain=request.explain
+        ),
+        "hit_message": lambda cached: "查询单个文档成功 (来自缓存)",
+        "error_message": "查询过程中发生错误"
+    }
+
+def aggregate_spec(request: AggregateRequest) -> Dict[str, Any]:
+    """/aggregate的缓存查询参数（$lookup等引用的集合也参与变更流失效）"""
+    return {
+        "cache_prefix": "aggregate",
+        "execute": lambda api: api.aggregate_pipeline(request.pipeline, explain=request.explain),
+        "hit_message": lambda cached: f"聚合查询成功 (来自缓存)，返回 {cached.get('count', 0)} 个文档",
+        "error_message": "聚合查询过程中发生错误",
+        "collections": [request.collection_name, *pipeline_collections(request.pipeline)]
+    }
+
+def distinct_spec(request: DistinctRequest) -> Dict[str, Any]:
+    """/distinct的缓存查询参数"""
+    return {
+        "cache_prefix": "distinct",
+        "execute": lambda api: api.distinct_values(request.field, request.query_filter),
+        "hit_message": lambda cached: f"distinct查询成功 (来自缓存)，字段 '{request.field}' 返回 {cached.get('data', {}).get('count', 0)} 个唯一值",
+        "error_message": "distinct查询过程中发生错误"
+    }
+
+def record_query_shape(request: Union[QueryRequest, QueryOneRequest, AggregateRequest, DistinctRequest]):
+    """记录查询形状，供/index_advice推荐索引（explain请求不记录）"""
+    if getattr(request, "explain", False):
+        return
+    if isinstance(request, AggregateRequest):
+        query_filter, sort = pipeline_shape(request.pipeline)
+    else:
+        query_filter, sort = request.query_filter, getattr(request, "sort", None)
+    index_advisor.record(request.connection_string, request.database_name, request.collection_name, query_filter, sort)
+
+# 依赖函数
+def get_mongodb_api():
+    """获取MongoDB API实例"""
+    if mongodb_api is None:
+        raise HTTPException(status_code=500, detail="MongoDB API未初始化")
+    return mongodb_api
+
+# API路由
+@app.post(
+    "/connect", 
+    response_model=ApiResponse,
+    summary="连接MongoDB数据库",
+    description="""
+    连接到指定的MongoDB数据库和集合。
+    
+    **参数说明：**
+    - `connection_string`: MongoDB连接字符串
+    - `database_name`: 要连接的数据库名称
+    - `collection_name`: 要操作的集合名称
+    
+    **返回结果：**
+    - 成功：返回连接成功信息
+    - 失败：返回错误详情
+    
+    **使用示例：**
+    ```json
+    {
+        "connection_string": "mongodb://localhost:27017/",
+        "database_name": "test_db",
+        "collection_name": "users"
+    }
+    ```
+    """,
+    tags=["连接管理"],
+    responses={
+        200: {
+            "description": "连接成功",
+            "content": {
+                "application/json": {
+                    "example": {
+                        "status": "success",
+                        "message": "连接成功",
+                        "data": {
+                            "database": "test_db",
+                            "collection": "users"
+                        },
+                        "timestamp": "2024-01-01T12:00:00"
+                    }
+                }
+            }
+        },
+        400: {
+            "description": "连接失败",
+            "content": {
+                "application/json": {
+                    "example": {
+                        "status": "error",
+                        "message": "连接失败: 无法连接到MongoDB服务器",
+                        "timestamp": "2024-01-01T12:00:00"
+                    }
+                }
+            }
+        }
+    }
+)
+async def connect_to_mongodb(
+    request: ConnectionRequest,
+    api: AsyncMongoDBQueryAPI = Depends(get_mongodb_api)
+): 
+    result = await api.connect_to_mongodb(
+        request.connection_string,
+        request.database_name,
+        request.collection_name
+    )
+    
+    if result["status"] == "error":
+        raise HTTPException(status_code=400, detail=result["message"])
+    
+    return ApiResponse(**result)
+
+@app.post(
+    "/query", 
+    response_model=ApiResponse,
     summary="查询MongoDB文档（自动连接和断开）",
     description="""
     根据指定条件查询MongoDB文档，自动处理连接和断开。
@@ -561,6 +1312,21 @@ async def connect_to_mongodb(
     - `[["field", 1]]` - 按字段升序
     - `[["field", -1]]` - 按字段降序
     - `[["field1", 1], ["field2", -1]]` - 多字段排序
+    
+    **键集分页：**
+    - 第一页传 `"paginate": true`，`limit` 为每页数量，响应中的 `next_page_token` 用于获取下一页
+    - 下一页传 `"page_token": "<next_page_token>"`，其余查询参数保持不变；没有下一页时不返回 `next_page_token`
+    - 按排序字段（自动追加 `_id`）的范围条件定位，任意页的耗时与第一页相同，建议为排序字段建立复合索引
+    - 排序字段必须是标量且类型一致（允许null或缺失），数组字段或同一页中出现混合类型时返回错误
+    
+    **结果格式（format）：**
+    - `rows`（默认）：每个文档一个JSON对象
+    - `columns`：`data` 为 `{"fields": [...], "columns": [[...], ...]}`，字段名只出现一次，文档缺少的字段为null
+    - `arrow` / `parquet`：返回Arrow IPC流或Parquet文件，可用pandas/polars直接读取，文档数量和分页令牌在响应头 `X-Result-Count`、`X-Next-Page-Token` 中（需要安装pyarrow）
+    
+    **执行计划（explain）：**
+    - 传 `"explain": true` 时不返回文档，`data` 为胜出计划的摘要：`plan`（`COLLSCAN`/`IXSCAN`）、使用的索引、`keys_examined`、`docs_examined`、`returned`、`execution_time_ms`、是否在内存中排序
+    - 查询形状会被记录下来，`/index_advice` 根据记录推荐复合索引
     """,
     tags=["数据查询"],
     responses={
@@ -602,72 +1368,34 @@ async def query_documents(
     """
     查询MongoDB文档，自动处理连接和断开
     """
-    cache_key = None
-    use_cache = request.cache_ttl != 0
-
-    # 1. 检查缓存 (如果不强制刷新)
-    if use_cache and not request.force_refresh:
-        # 使用请求的所有参数来生成缓存键，确保唯一性
-        cache_key = redis_cache.generate_cache_key("query", request.dict())
-        cached_result = redis_cache.get(cache_key)
-        if cached_result:
-            # 如果命中缓存，直接返回结果，不创建MongoDB连接
-            cached_result["message"] = f"查询成功 (来自缓存)，返回 {cached_result.get('count', 0)} 个文档"
-            # 添加缓存时间信息
-            cached_result["cache_ttl"] = request.cache_ttl
-            return ApiResponse(**cached_result)
-
-    # 2. 只有缓存未命中时才创建MongoDB连接和查询
-    api = MongoDBQueryAPI()
-    
-    try:
-        # 连接数据库
-        connection_result = api.connect_to_mongodb(
-            request.connection_string,
-            request.database_name,
-            request.collection_name
-        )
-        
-        if connection_result["status"] == "error":
-            return ApiResponse(
-                status="error",
-                message=f"连接失败: {connection_result['message']}",
-                timestamp=datetime.now().isoformat()
-            )
-        
-        # 转换排序格式
-        sort_list = None
-        if request.sort:
-            sort_list = [(item[0], item[1]) for item in request.sort]
-        
-        # 执行查询
-        result = api.query_documents(
-            query_filter=request.query_filter,
-            projection=request.projection,
-            sort=sort_list,
-            limit=request.limit,
-            skip=request.skip
-        )
-        
-        # 3. 设置缓存 (如果查询成功且启用了缓存)
-        if use_cache and result["status"] == "success":
-            if cache_key is None: # 如果是强制刷新，之前没生成key
-                cache_key = redis_cache.generate_cache_key("query", request.dict())
-            redis_cache.set(cache_key, result, ttl=request.cache_ttl)
-            # 添加缓存时间信息到响应
-            result["cache_ttl"] = request.cache_ttl
-
-        return ApiResponse(**result)
-        
-    except Exception as e:
+    error = query_error(request)
+    if error:
         return ApiResponse(
             status="error",
-            message=f"查询过程中发生错误: {str(e)}",
+            message=error,
             timestamp=datetime.now().isoformat()
         )
-    finally:
-        # 确保连接被关闭
-        api.close_connection()
+    
+    # explain模式：直接获取执行计划，不经过缓存
+    if request.explain:
+        return api_response(await run_query(request, query_spec(request)["execute"]))
+    record_query_shape(request)
+    
+    # 流式模式：边查边写，不经过缓存
+    if request.stream_format:
+        return await streaming_query_response(
+            request,
+            lambda api: api.iter_document_batches(
+                query_filter=request.query_filter,
+                projection=request.projection,
+                sort=sort_tuples(request.sort),
+                limit=request.limit,
+                skip=request.skip,
+                batch_size=request.batch_size
+            )
+        )
+    
+    return await observed_query("query", request, query_spec(request), request.format)
 
 @app.post(
     "/query_one", 
@@ -703,6 +1431,8 @@ async def query_documents(
     - `[["field", 1]]` - 按字段升序
     - `[["field", -1]]` - 按字段降序
     - `[["field1", 1], ["field2", -1]]` - 多字段排序
+    
+    **执行计划：** 传 `"explain": true` 时只返回执行计划摘要，格式与 `/query` 相同
     """,
     tags=["数据查询"],
     responses={
@@ -757,69 +1487,11 @@ async def query_one_document(
     """
     执行单个文档查询，自动处理连接和断开
     """
-    cache_key = None
-    use_cache = request.cache_ttl != 0
-
-    # 1. 检查缓存 (如果不强制刷新)
-    if use_cache and not request.force_refresh:
-        cache_key = redis_cache.generate_cache_key("query_one", request.dict())
-        cached_result = redis_cache.get(cache_key)
-        if cached_result:
-            # 如果命中缓存，直接返回结果，不创建MongoDB连接
-            cached_result["message"] = f"查询单个文档成功 (来自缓存)"
-            # 添加缓存时间信息
-            cached_result["cache_ttl"] = request.cache_ttl
-            return ApiResponse(**cached_result)
-
-    # 2. 只有缓存未命中时才创建MongoDB连接和查询
-    api = MongoDBQueryAPI()
-    
-    try:
-        # 连接数据库
-        connection_result = api.connect_to_mongodb(
-            request.connection_string,
-            request.database_name,
-            request.collection_name
-        )
-        
-        if connection_result["status"] == "error":
-            return ApiResponse(
-                status="error",
-                message=f"连接失败: {connection_result['message']}",
-                timestamp=datetime.now().isoformat()
-            )
-        
-        # 转换排序格式
-        sort_list = None
-        if request.sort:
-            sort_list = [(item[0], item[1]) for item in request.sort]
-        
-        # 执行查询
-        result = api.query_one_document(
-            query_filter=request.query_filter,
-            projection=request.projection,
-            sort=sort_list
-        )
-        
-        # 3. 设置缓存 (如果查询成功且启用了缓存)
-        if use_cache and result["status"] == "success":
-            if cache_key is None: # 如果是强制刷新，之前没生成key
-                cache_key = redis_cache.generate_cache_key("query_one", request.dict())
-            redis_cache.set(cache_key, result, ttl=request.cache_ttl)
-            # 添加缓存时间信息到响应
-            result["cache_ttl"] = request.cache_ttl
-
-        return ApiResponse(**result)
-        
-    except Exception as e:
-        return ApiResponse(
-            status="error",
-            message=f"查询过程中发生错误: {str(e)}",
-            timestamp=datetime.now().isoformat()
-        )
-    finally:
-        # 确保连接被关闭
-        api.close_connection()
+    # explain模式：直接获取执行计划，不经过缓存
+    if request.explain:
+        return api_response(await run_query(request, query_one_spec(request)["execute"]))
+    record_query_shape(request)
+    return await observed_query("query_one", request, query_one_spec(request))
 
 @app.post(
     "/aggregate", 
@@ -843,27 +1515,444 @@ async def query_one_document(
     - `$project`: 字段投影
     - `$lookup`: 关联查询
     
-    **聚合函数：**
-    - `$sum`: 求和
-    - `$avg`: 平均值
-    - `$max`: 最大值
-    - `$min`: 最小值
-    - `$count`: 计数
+    **聚合函数：**
+    - `$sum`: 求和
+    - `$avg`: 平均值
+    - `$max`: 最大值
+    - `$min`: 最小值
+    - `$count`: 计数
+    
+    **结果格式（format）：**
+    - `rows`（默认）、`columns`、`arrow`、`parquet`，与 `/query` 相同；`$group` 等输出扁平行的管道适合按列返回
+    
+    **Arrow流（stream_format=arrow）：**
+    - 结果行数很多时使用：按游标批次读取原始BSON，每批直接解码为一个Arrow RecordBatch并写出，不经过缓存和JSON
+    - `arrow_schema` 声明列类型（如 `{"_id": "string", "count": "int64"}`），不传时根据第一个批次推断；之后的批次出现第一个批次没有的字段时报错，结果字段不固定时需要声明
+    - 安装pymongoarrow时由其C扩展直接解码BSON，否则使用bson解码
+    
+    **执行计划：** 传 `"explain": true` 时以executionStats模式获取执行计划摘要（管道会实际执行一次），格式与 `/query` 相同；开头的 `$match`、`$sort` 会作为查询形状记录，供 `/index_advice` 推荐索引
+    """,
+    tags=["聚合查询"],
+    responses={
+        200: {
+            "description": "聚合查询成功",
+            "content": {
+                "application/json": {
+                    "example": {
+                        "status": "success",
+                        "message": "聚合查询成功，返回 2 个文档",
+                        "data": [
+                            {"_id": "技术部", "count": 5, "avg_age": 30.2, "avg_salary": 18000},
+                            {"_id": "销售部", "count": 3, "avg_age": 28.5, "avg_salary": 15000}
+                        ],
+                        "count": 2,
+                        "timestamp": "2024-01-01T12:00:00"
+                    }
+                }
+            }
+        }
+    }
+)
+async def aggregate_documents(
+    request: AggregateRequest
+):
+    """
+    执行聚合查询，自动处理连接和断开
+    """
+    error = format_error(request)
+    if error:
+        return ApiResponse(
+            status="error",
+            message=error,
+            timestamp=datetime.now().isoformat()
+        )
+    
+    # explain模式：直接获取执行计划，不经过缓存
+    if request.explain:
+        return api_response(await run_query(request, aggregate_spec(request)["execute"]))
+    record_query_shape(request)
+    
+    # 流式模式：边查边写，不经过缓存
+    if request.stream_format == "arrow":
+        return await streaming_query_response(
+            request,
+            lambda api: api.iter_aggregate_arrow_batches(
+                request.pipeline, schema=request.arrow_schema, batch_size=request.batch_size
+            )
+        )
+    if request.stream_format:
+        return await streaming_query_response(
+            request,
+            lambda api: api.iter_aggregate_batches(request.pipeline, batch_size=request.batch_size)
+        )
+
+    return await observed_query("aggregate", request, aggregate_spec(request), request.format)
+
+@app.post(
+    "/distinct", 
+    response_model=ApiResponse,
+    summary="查询字段唯一值（自动连接和断开）",
+    description="""
+    查询指定字段的唯一值，自动处理连接和断开。
+    
+    **功能特点：**
+    - 自动连接指定的MongoDB数据库
+    - 执行distinct查询操作
+    - 自动断开连接，释放资源
+    - 支持可选的查询条件过滤
+    
+    **使用场景：**
+    - 获取所有部门列表
+    - 获取所有城市列表
+    - 获取所有状态值
+    - 获取满足条件的唯一值
+    
+    **查询条件示例：**
+    - 无过滤：查询所有文档的字段唯一值
+    - 条件过滤：`{"age": {"$gte": 25}}` - 只查询年龄大于25的文档的字段唯一值
+    - 状态过滤：`{"status": "active"}` - 只查询活跃状态的文档的字段唯一值
+    """,
+    tags=["数据查询"],
+    responses={
+        200: {
+            "description": "distinct查询成功",
+            "content": {
+                "application/json": {
+                    "example": {
+                        "status": "success",
+                        "message": "distinct查询成功，字段 'department' 返回 3 个唯一值",
+                        "data": {
+                            "field": "department",
+                            "values": ["技术部", "销售部", "人事部"],
+                            "count": 3
+                        },
+                        "count": 3,
+                        "timestamp": "2024-01-01T12:00:00"
+                    }
+                }
+            }
+        },
+        400: {
+            "description": "distinct查询失败",
+            "content": {
+                "application/json": {
+                    "example": {
+                        "status": "error",
+                        "message": "distinct查询失败: 无法连接到MongoDB服务器",
+                        "timestamp": "2024-01-01T12:00:00"
+                    }
+                }
+            }
+        }
+    }
+)
+async def distinct_documents(
+    request: DistinctRequest
+):
+    """
+    执行distinct查询，自动处理连接和断开
+    """
+    record_query_shape(request)
+    return await observed_query("distinct", request, distinct_spec(request))
+
+# 批量查询
+BATCH_OPERATION_SPECS = {
+    "query": query_spec,
+    "query_one": query_one_spec,
+    "aggregate": aggregate_spec,
+    "distinct": distinct_spec
+}
+
+def batch_operation_error(operation: BatchOperation) -> Optional[str]:
+    """检查单个批量操作的参数，返回错误消息"""
+    if getattr(operation, "stream_format", None):
+        return "批量查询不支持stream_format，请单独调用对应接口"
+    if getattr(operation, "format", None) in BINARY_FORMATS:
+        return f"批量查询不支持format={operation.format}，请单独调用对应接口"
+    if getattr(operation, "explain", False):
+        return "批量查询不支持explain，请单独调用对应接口"
+    if operation.op == "query":
+        return query_error(operation)
+    return None
+
+@app.post(
+    "/batch", 
+    response_model=ApiResponse,
+    summary="批量执行查询",
+    description="""
+    在一次请求中执行多个查询（query、query_one、aggregate、distinct），按请求顺序返回每个操作的结果。
+    
+    **执行方式：**
+    - 所有操作的缓存一次批量读取（本地缓存未命中的键合并为一次Redis往返）
+    - 缓存未命中的操作并发查询数据库，最大并发数由 `BATCH_MAX_CONCURRENCY` 配置（默认8）
+    - 相同连接字符串的操作共用连接池中的同一个MongoDB客户端
+    - 每个操作的缓存键、结果和错误与单独调用对应接口时相同，一个操作失败不影响其他操作
+    
+    **操作格式：**
+    - 每个操作的参数与对应接口的请求体相同，另加 `op` 字段：`query`、`query_one`、`aggregate`、`distinct`
+    - 不支持 `stream_format`，`format` 只支持 `rows` 和 `columns`
+    - 单次请求最多包含的操作数由 `BATCH_MAX_OPERATIONS` 配置（默认100）
+    """,
+    tags=["数据查询"],
+    responses={
+        200: {
+            "description": "批量查询完成",
+            "content": {
+                "application/json": {
+                    "example": {
+                        "status": "success",
+                        "message": "批量查询完成，共 2 个操作，成功 2 个，失败 0 个，缓存命中 1 个",
+                        "data": [
+                            {
+                                "status": "success",
+                                "message": "查询成功 (来自缓存)，返回 1 个文档",
+                                "data": [{"name": "张三", "age": 28}],
+                                "count": 1,
+                                "cache_ttl": 300,
+                                "timestamp": "2024-01-01T12:00:00"
+                            },
+                            {
+                                "status": "success",
+                                "message": "distinct查询成功，字段 'department' 返回 3 个唯一值",
+                                "data": {"field": "department", "values": ["技术部", "销售部", "人事部"], "count": 3},
+                                "count": 3,
+                                "cache_ttl": 300,
+                                "timestamp": "2024-01-01T12:00:00"
+                            }
+                        ],
+                        "count": 2,
+                        "timestamp": "2024-01-01T12:00:00"
+                    }
+                }
+            }
+        }
+    }
+)
+async def batch_query(
+    request: BatchRequest
+):
+    """
+    批量执行查询：批量读取缓存，未命中的操作有限并发地查询数据库
+    """
+    operations = request.operations
+    results: List[Optional[Dict[str, Any]]] = [None] * len(operations)
+    specs: Dict[int, Dict[str, Any]] = {}
+    cache_keys: Dict[int, str] = {}
+    
+    for index, operation in enumerate(operations):
+        error = batch_operation_error(operation)
+        if error:
+            results[index] = {
+                "status": "error",
+                "message": error,
+                "timestamp": datetime.now().isoformat()
+            }
+            continue
+        record_query_shape(operation)
+        specs[index] = BATCH_OPERATION_SPECS[operation.op](operation)
+        if operation.cache_ttl != 0:
+            # op字段不参与缓存键，与单独调用对应接口共用缓存
+            cache_keys[index] = tiered_cache.generate_cache_key(
+                specs[index]["cache_prefix"], operation.dict(exclude={"op"})
+            )
+    
+    # 1. 一次读取所有操作的缓存（强制刷新的操作不读缓存）
+    lookup = [index for index in cache_keys if not operations[index].force_refresh]
+    entries = await tiered_cache.get_entries(
+        [cache_keys[index] for index in lookup],
+        xfetch=[specs[index]["cache_prefix"] in cache_refresh_config["xfetch_prefixes"] for index in lookup]
+    )
+    prefetched = {index: entry for index, entry in zip(lookup, entries)}
+    
+    # 2. 缓存命中的操作直接返回，未命中的操作有限并发地查询数据库
+    semaphore = asyncio.Semaphore(batch_config["max_concurrency"])
+    
+    async def execute(index: int) -> Dict[str, Any]:
+        operation = operations[index]
+        cache_key = cache_keys.get(index)
+        kwargs = {**specs[index], "cache_key": cache_key}
+        if prefetched.get(index) is not None:
+            return await cached_query_result(
+                operation, **kwargs, prefetched_entries={cache_key: prefetched[index]}
+            )
+        async with semaphore:
+            return await cached_query_result(
+                operation, **kwargs, prefetched_entries={cache_key: None} if index in prefetched else None
+            )
+    
+    async def run(index: int):
+        # 每个操作分别按查询形状统计（批量读取缓存和编码响应的耗时不计入单个操作）
+        with query_metrics.observe(operations[index].op, operations[index]) as trace:
+            results[index] = await execute(index)
+            if trace is not None:
+                trace.set_result(results[index])
+    
+    await asyncio.gather(*(run(index) for index in specs))
+    
+    succeeded = sum(1 for result in results if result["status"] != "error")
+    cache_hits = sum(1 for entry in prefetched.values() if entry is not None)
+    print(f"INFO:     批量查询: {len(operations)} 个操作，缓存命中 {cache_hits} 个")
+    return api_response({
+        "status": "success",
+        "message": f"批量查询完成，共 {len(operations)} 个操作，成功 {succeeded} 个，失败 {len(operations) - succeeded} 个，缓存命中 {cache_hits} 个",
+        "data": [
+            response_envelope(columnar_result(result) if getattr(operation, "format", None) == "columns" else result)
+            for operation, result in zip(operations, results)
+        ],
+        "count": len(operations),
+        "timestamp": datetime.now().isoformat()
+    })
+
+# 批量写入
+@app.post(
+    "/bulk_write", 
+    response_model=ApiResponse,
+    summary="批量写入文档（插入、更新、upsert、删除）",
+    description="""
+    使用MongoDB bulk_write批量写入文档，自动处理连接和断开，并失效受影响的缓存。
+    
+    **支持的操作：**
+    - `{"insert_one": {"document": {...}}}`
+    - `{"update_one": {"filter": {...}, "update": {"$set": {...}}, "upsert": false, "array_filters": [...]}}`
+    - `{"update_many": {"filter": {...}, "update": {"$set": {...}}, "upsert": false}}`
+    - `{"replace_one": {"filter": {...}, "replacement": {...}, "upsert": false}}`
+    - `{"delete_one": {"filter": {...}}}`
+    - `{"delete_many": {"filter": {...}}}`
+    
+    **执行方式：**
+    - 所有操作先校验格式，任何一个不合法时整批拒绝，不写入任何数据
+    - 超过 `BULK_WRITE_CHUNK_SIZE`（默认1000）个操作时分块执行，每块一次bulk_write
+    - `ordered=true`：按顺序执行，遇到第一个错误即停止（包括后续的块）
+    - `ordered=false`：所有操作都会执行，返回全部错误
+    - `write_concern`：`w`、`j`、`wtimeout`，不传则使用默认写关注；不支持 `w: 0`（不等待确认时无法保证失效缓存晚于写入生效）
+    
+    **缓存：**
+    - 写入后立即失效读取了该集合的所有缓存（包括通过$lookup等引用该集合的聚合查询），并通知其他工作进程
+    - 失效会递增集合的版本号，写入前开始、写入后才完成的查询不会把写入前的数据写回缓存
+    - 写入过程中出错（可能已部分写入）时同样失效缓存
+    
+    **返回结果：**
+    - `data` 中包含插入、匹配、修改、删除、upsert数量，upsert生成的_id（按操作下标），以及写入错误（操作下标、错误码、原因）
+    - 有写入错误时 `status` 为 `error`，已执行的操作不会回滚
+    """,
+    tags=["数据写入"],
+    responses={
+        200: {
+            "description": "批量写入完成",
+            "content": {
+                "application/json": {
+                    "example": {
+                        "status": "success",
+                        "message": "批量写入成功，插入 1 个，匹配 1 个，修改 1 个，删除 2 个，upsert 1 个",
+                        "data": {
+                            "operations": 4,
+                            "ordered": True,
+                            "acknowledged": True,
+                            "chunks": 1,
+                            "inserted_count": 1,
+                            "matched_count": 1,
+                            "modified_count": 1,
+                            "deleted_count": 2,
+                            "upserted_count": 1,
+                            "upserted_ids": {"2": "65a1b2c3d4e5f6a7b8c9d0e1"},
+                            "write_errors": [],
+                            "write_concern_errors": []
+                        },
+                        "count": 4,
+                        "timestamp": "2024-01-01T12:00:00"
+                    }
+                }
+            }
+        }
+    }
+)
+async def bulk_write_documents(
+    request: BulkWriteRequest
+):
+    """
+    批量写入文档，写入后失效受影响的缓存
+    """
+    write_concern = request.write_concern.dict() if request.write_concern else None
+    if write_concern and write_concern["w"] == 0:
+        # 不等待确认时bulk_write在服务器执行写入前就返回，此时失效缓存（递增版本号）后开始的读请求
+        # 仍可能读到写入前的数据，并把它写入缓存保留整个TTL
+        return ApiResponse(
+            status="error",
+            message="批量写入不支持w=0（不等待确认）的写关注，无法保证缓存在写入生效后失效",
+            timestamp=datetime.now().isoformat()
+        )
+    try:
+        result = await run_query(
+            request,
+            lambda api: api.bulk_write(request.operations, ordered=request.ordered, write_concern=write_concern)
+        )
+    except Exception as e:
+        result = {
+            "status": "error",
+            "message": f"批量写入过程中发生错误: {str(e)}",
+            "timestamp": datetime.now().isoformat()
+        }
+        # 异常时无法确定是否已部分写入，按已写入处理
+        written = True
+    else:
+        # 返回了写入统计说明已开始写入（即使部分失败）；校验失败或连接失败时没有写入
+        written = result.get("data") is not None
+    
+    if written:
+        # 失效读取了该集合的缓存，并递增集合的版本号：写入期间仍在执行的查询完成后不会写回旧数据
+        await change_stream_invalidator.invalidate_collection(
+            request.connection_string,
+            request.database_name,
+            request.collection_name
+        )
+    return ApiResponse(**result)
+
+# NDJSON流式导入
+@app.post(
+    "/ingest/{database_name}/{collection_name}", 
+    response_model=ApiResponse,
+    summary="流式导入NDJSON文档",
+    description="""
+    以NDJSON（每行一个JSON对象）格式上传文档，边接收边解析，按批次调用insert_many写入，适合GB级别的导入。
+    
+    **请求格式：**
+    - 请求体为NDJSON，`Content-Type: application/x-ndjson`，支持分块传输
+    - 连接字符串通过 `X-Connection-String` 请求头传入
+    
+    **执行方式：**
+    - 每 `batch_size` 行（默认1000）提交一次insert_many
+    - 同时写入中的批次达到 `INGEST_MAX_IN_FLIGHT`（默认4）时暂停读取请求体，上传速度自动跟随数据库写入速度
+    - 导入完成后失效读取了该集合的缓存
+    
+    **进度与续传：**
+    - 进度保存在Redis中，可通过 `GET /ingest/{ingest_id}` 查询（建议客户端自行指定 `ingest_id`）
+    - `committed_offset` 之前的数据已确认写入；中断后从原始文件的该偏移处继续上传，并传入 `resume_offset` 和相同的 `ingest_id`
+    - 检查点之后的批次可能已部分写入，文档带有 `_id` 时重复部分会报错而不会重复写入
     """,
-    tags=["聚合查询"],
+    tags=["数据写入"],
     responses={
         200: {
-            "description": "聚合查询成功",
+            "description": "导入完成",
             "content": {
                 "application/json": {
                     "example": {
                         "status": "success",
-                        "message": "聚合查询成功，返回 2 个文档",
-                        "data": [
-                            {"_id": "技术部", "count": 5, "avg_age": 30.2, "avg_salary": 18000},
-                            {"_id": "销售部", "count": 3, "avg_age": 28.5, "avg_salary": 15000}
-                        ],
-                        "count": 2,
+                        "message": "导入完成，写入 250000 个文档",
+                        "data": {
+                            "ingest_id": "users-20240101",
+                            "status": "completed",
+                            "database": "test_db",
+                            "collection": "users",
+                            "resume_offset": 0,
+                            "committed_offset": 52428800,
+                            "lines": 250000,
+                            "batches": 250,
+                            "inserted_count": 250000,
+                            "invalid_lines": 0,
+                            "errors": [],
+                            "updated_at": "2024-01-01T12:00:00"
+                        },
+                        "count": 250000,
                         "timestamp": "2024-01-01T12:00:00"
                     }
                 }
@@ -871,37 +1960,28 @@ async def query_one_document(
         }
     }
 )
-async def aggregate_documents(
-    request: AggregateRequest
+async def ingest_ndjson(
+    request: Request,
+    database_name: str = Path(..., description="数据库名称", min_length=1),
+    collection_name: str = Path(..., description="集合名称", min_length=1),
+    connection_string: str = Header(..., alias="X-Connection-String", description="MongoDB连接字符串"),
+    ingest_id: Optional[str] = Query(default=None, description="导入任务标识，续传时使用同一个标识；不传则自动生成", max_length=128),
+    resume_offset: int = Query(default=0, description="本次上传内容在原始文件中的起始字节偏移（续传时使用检查点的committed_offset）", ge=0),
+    batch_size: Optional[int] = Query(default=None, description="每次insert_many的文档数量，默认使用配置中的batch_size", ge=1, le=10000),
+    ordered: bool = Query(default=True, description="insert_many是否按顺序插入"),
+    skip_invalid: bool = Query(default=False, description="是否跳过无法解析的行；默认遇到无法解析的行即停止")
 ):
     """
-    执行聚合查询，自动处理连接和断开
+    流式导入NDJSON文档，写入后失效受影响的缓存
     """
-    cache_key = None
-    use_cache = request.cache_ttl != 0
-
-    # 1. 检查缓存 (如果不强制刷新)
-    if use_cache and not request.force_refresh:
-        cache_key = redis_cache.generate_cache_key("aggregate", request.dict())
-        cached_result = redis_cache.get(cache_key)
-        if cached_result:
-            # 如果命中缓存，直接返回结果，不创建MongoDB连接
-            cached_result["message"] = f"聚合查询成功 (来自缓存)，返回 {cached_result.get('count', 0)} 个文档"
-            # 添加缓存时间信息
-            cached_result["cache_ttl"] = request.cache_ttl
-            return ApiResponse(**cached_result)
-
-    # 2. 只有缓存未命中时才创建MongoDB连接和查询
-    api = MongoDBQueryAPI()
-    
+    api = AsyncMongoDBQueryAPI()
     try:
-        # 连接数据库
-        connection_result = api.connect_to_mongodb(
-            request.connection_string,
-            request.database_name,
-            request.collection_name
+        connection_result = await api.connect_to_mongodb(
+            connection_string,
+            database_name,
+            collection_name,
+            use_pool=True
         )
-        
         if connection_result["status"] == "error":
             return ApiResponse(
                 status="error",
@@ -909,80 +1989,148 @@ async def aggregate_documents(
                 timestamp=datetime.now().isoformat()
             )
         
-        # 执行聚合查询
-        result = api.aggregate_pipeline(request.pipeline)
-        
-        # 3. 设置缓存 (如果查询成功且启用了缓存)
-        if use_cache and result["status"] == "success":
-            if cache_key is None: # 如果是强制刷新，之前没生成key
-                cache_key = redis_cache.generate_cache_key("aggregate", request.dict())
-            redis_cache.set(cache_key, result, ttl=request.cache_ttl)
-            # 添加缓存时间信息到响应
-            result["cache_ttl"] = request.cache_ttl
-
-        return ApiResponse(**result)
-        
+        result = await ndjson_ingestor.ingest(
+            api,
+            request.stream(),
+            ingest_id=ingest_id,
+            resume_offset=resume_offset,
+            batch_size=batch_size,
+            ordered=ordered,
+            skip_invalid=skip_invalid
+        )
     except Exception as e:
+        # 出错前的批次可能已写入，同样失效缓存
+        await change_stream_invalidator.invalidate_collection(connection_string, database_name, collection_name)
         return ApiResponse(
             status="error",
-            message=f"聚合查询过程中发生错误: {str(e)}",
+            message=f"导入过程中发生错误: {str(e)}",
             timestamp=datetime.now().isoformat()
         )
     finally:
-        # 确保连接被关闭
         api.close_connection()
+    
+    if (result.get("data") or {}).get("inserted_count"):
+        await change_stream_invalidator.invalidate_collection(connection_string, database_name, collection_name)
+    return ApiResponse(**result)
+
+@app.get(
+    "/ingest/{ingest_id}", 
+    response_model=ApiResponse,
+    summary="查询导入进度",
+    description="获取NDJSON导入任务的进度和检查点（committed_offset），导入过程中和中断后都可以查询。",
+    tags=["数据写入"]
+)
+async def get_ingest_progress(
+    ingest_id: str = Path(..., description="导入任务标识")
+):
+    progress = await ndjson_ingestor.get_progress(ingest_id)
+    if progress is None:
+        return ApiResponse(
+            status="error",
+            message=f"导入任务不存在或检查点已过期: {ingest_id}",
+            timestamp=datetime.now().isoformat()
+        )
+    return ApiResponse(
+        status="success",
+        message=f"导入任务状态: {progress['status']}，已确认写入到偏移 {progress['committed_offset']}",
+        data=progress,
+        timestamp=datetime.now().isoformat()
+    )
+
+# 游标会话
+def get_client_id(request: Request) -> str:
+    """客户端标识：优先使用X-Client-Id请求头，否则使用客户端IP"""
+    client_id = request.headers.get("X-Client-Id")
+    if client_id:
+        return client_id
+    return request.client.host if request.client else "unknown"
 
 @app.post(
-    "/distinct", 
+    "/cursors", 
     response_model=ApiResponse,
-    summary="查询字段唯一值（自动连接和断开）",
+    summary="打开服务端游标",
     description="""
-    查询指定字段的唯一值，自动处理连接和断开。
-    
-    **功能特点：**
-    - 自动连接指定的MongoDB数据库
-    - 执行distinct查询操作
-    - 自动断开连接，释放资源
-    - 支持可选的查询条件过滤
+    打开一个服务端游标，用于分批读取大结果集（如导出）。
     
-    **使用场景：**
-    - 获取所有部门列表
-    - 获取所有城市列表
-    - 获取所有状态值
-    - 获取满足条件的唯一值
+    **使用流程：**
+    1. `POST /cursors` 打开游标，返回 `cursor_id`（此时不执行查询）
+    2. 反复调用 `POST /cursors/{cursor_id}/next?size=N` 获取下一批文档，直到 `has_more` 为 false（游标自动关闭）
+    3. 提前结束时调用 `DELETE /cursors/{cursor_id}` 关闭游标
     
-    **查询条件示例：**
-    - 无过滤：查询所有文档的字段唯一值
-    - 条件过滤：`{"age": {"$gte": 25}}` - 只查询年龄大于25的文档的字段唯一值
-    - 状态过滤：`{"status": "active"}` - 只查询活跃状态的文档的字段唯一值
+    **说明：**
+    - 整个读取过程只执行一次查询，之后每批只是增量的getMore，不需要skip
+    - 游标保存在处理请求的工作进程中，后续请求请复用同一个HTTP连接（keep-alive）
+    - 空闲超过 `idle_timeout_seconds` 的游标会被自动回收
+    - 按 `X-Client-Id` 请求头（没有时按客户端IP）限制同时打开的游标数量，只有打开游标的客户端才能访问
     """,
-    tags=["数据查询"],
+    tags=["游标会话"],
     responses={
         200: {
-            "description": "distinct查询成功",
+            "description": "游标已打开",
             "content": {
                 "application/json": {
                     "example": {
                         "status": "success",
-                        "message": "distinct查询成功，字段 'department' 返回 3 个唯一值",
-                        "data": {
-                            "field": "department",
-                            "values": ["技术部", "销售部", "人事部"],
-                            "count": 3
-                        },
-                        "count": 3,
+                        "message": "游标已打开",
+                        "data": {"cursor_id": "Yk3n8c0Qk2l1Zq9xW5v7Tg", "idle_timeout_seconds": 300},
                         "timestamp": "2024-01-01T12:00:00"
                     }
                 }
             }
-        },
-        400: {
-            "description": "distinct查询失败",
+        }
+    }
+)
+async def open_cursor(
+    request: CursorOpenRequest,
+    client_id: str = Depends(get_client_id)
+):
+    """
+    打开服务端游标
+    """
+    sort_list = None
+    if request.sort:
+        sort_list = [(item[0], item[1]) for item in request.sort]
+    
+    result = await cursor_session_manager.open(
+        client_id,
+        request.connection_string,
+        request.database_name,
+        request.collection_name,
+        query_filter=request.query_filter,
+        projection=request.projection,
+        sort=sort_list,
+        limit=request.limit,
+        skip=request.skip,
+        batch_size=request.batch_size
+    )
+    return ApiResponse(**result)
+
+@app.post(
+    "/cursors/{cursor_id}/next", 
+    response_model=ApiResponse,
+    summary="获取游标的下一批文档",
+    description="""
+    从已打开的游标获取下一批文档。没有更多文档时 `has_more` 为 false，游标自动关闭。
+    """,
+    tags=["游标会话"],
+    responses={
+        200: {
+            "description": "获取成功",
             "content": {
                 "application/json": {
                     "example": {
-                        "status": "error",
-                        "message": "distinct查询失败: 无法连接到MongoDB服务器",
+                        "status": "success",
+                        "message": "获取成功，返回 2 个文档",
+                        "data": {
+                            "cursor_id": "Yk3n8c0Qk2l1Zq9xW5v7Tg",
+                            "documents": [
+                                {"_id": "507f1f77bcf86cd799439011", "name": "张三", "age": 28},
+                                {"_id": "507f1f77bcf86cd799439012", "name": "李四", "age": 32}
+                            ],
+                            "has_more": True,
+                            "fetched": 2
+                        },
+                        "count": 2,
                         "timestamp": "2024-01-01T12:00:00"
                     }
                 }
@@ -990,66 +2138,46 @@ async def aggregate_documents(
         }
     }
 )
-async def distinct_documents(
-    request: DistinctRequest
+async def fetch_cursor(
+    cursor_id: str = Path(..., description="打开游标时返回的cursor_id"),
+    size: Optional[int] = Query(default=None, description="本次获取的文档数量，默认使用配置中的default_fetch_size", ge=1, le=10000),
+    client_id: str = Depends(get_client_id)
 ):
     """
-    执行distinct查询，自动处理连接和断开
+    获取游标的下一批文档
     """
-    cache_key = None
-    use_cache = request.cache_ttl != 0
+    return api_response(await cursor_session_manager.fetch(client_id, cursor_id, size))
 
-    # 1. 检查缓存 (如果不强制刷新)
-    if use_cache and not request.force_refresh:
-        cache_key = redis_cache.generate_cache_key("distinct", request.dict())
-        cached_result = redis_cache.get(cache_key)
-        if cached_result:
-            # 如果命中缓存，直接返回结果，不创建MongoDB连接
-            cached_result["message"] = f"distinct查询成功 (来自缓存)，字段 '{request.field}' 返回 {cached_result.get('data', {}).get('count', 0)} 个唯一值"
-            # 添加缓存时间信息
-            cached_result["cache_ttl"] = request.cache_ttl
-            return ApiResponse(**cached_result)
-
-    # 2. 只有缓存未命中时才创建MongoDB连接和查询
-    api = MongoDBQueryAPI()
-    
-    try:
-        # 连接数据库
-        connection_result = api.connect_to_mongodb(
-            request.connection_string,
-            request.database_name,
-            request.collection_name
-        )
-        
-        if connection_result["status"] == "error":
-            return ApiResponse(
-                status="error",
-                message=f"连接失败: {connection_result['message']}",
-                timestamp=datetime.now().isoformat()
-            )
-        
-        # 执行distinct查询
-        result = api.distinct_values(request.field, request.query_filter)
-        
-        # 3. 设置缓存 (如果查询成功且启用了缓存)
-        if use_cache and result["status"] == "success":
-            if cache_key is None: # 如果是强制刷新，之前没生成key
-                cache_key = redis_cache.generate_cache_key("distinct", request.dict())
-            redis_cache.set(cache_key, result, ttl=request.cache_ttl)
-            # 添加缓存时间信息到响应
-            result["cache_ttl"] = request.cache_ttl
+@app.delete(
+    "/cursors/{cursor_id}", 
+    response_model=ApiResponse,
+    summary="关闭游标",
+    description="关闭游标并释放MongoDB服务端资源。",
+    tags=["游标会话"]
+)
+async def close_cursor(
+    cursor_id: str = Path(..., description="打开游标时返回的cursor_id"),
+    client_id: str = Depends(get_client_id)
+):
+    """
+    关闭游标
+    """
+    return ApiResponse(**await cursor_session_manager.close(client_id, cursor_id))
 
-        return ApiResponse(**result)
-        
-    except Exception as e:
-        return ApiResponse(
-            status="error",
-            message=f"distinct查询过程中发生错误: {str(e)}",
-            timestamp=datetime.now().isoformat()
-        )
-    finally:
-        # 确保连接被关闭
-        api.close_connection()
+@app.get(
+    "/cursors/stats", 
+    response_model=ApiResponse,
+    summary="游标会话统计",
+    description="获取当前工作进程打开的游标数量，以及累计打开、关闭、回收和因配额被拒绝的次数。",
+    tags=["游标会话"]
+)
+async def get_cursor_stats():
+    return ApiResponse(
+        status="success",
+        message="获取游标会话统计成功",
+        data=cursor_session_manager.get_stats(),
+        timestamp=datetime.now().isoformat()
+    )
 
 @app.get(
     "/stats", 
@@ -1091,15 +2219,82 @@ async def distinct_documents(
     }
 )
 async def get_collection_stats(
-    api: MongoDBQueryAPI = Depends(get_mongodb_api)
+    api: AsyncMongoDBQueryAPI = Depends(get_mongodb_api)
 ):
-    result = api.get_collection_stats()
+    result = await api.get_collection_stats()
     
     if result["status"] == "error":
         raise HTTPException(status_code=400, detail=result["message"])
     
     return ApiResponse(**result)
 
+@app.post(
+    "/index_advice", 
+    response_model=ApiResponse,
+    summary="索引建议",
+    description="""
+    根据当前工作进程记录的查询形状，为集合推荐复合索引。
+    
+    **分析方式：**
+    - `/query`、`/query_one`、`/aggregate`（开头的 `$match`、`$sort`）、`/distinct`、`/batch` 的每个请求都会记录查询形状：等值匹配的字段、排序、范围匹配的字段（`$or`、`$expr`、`$text` 中的条件不参与分析）
+    - 按查询次数从多到少分析，每种形状按ESR规则（等值 -> 排序 -> 范围）生成索引键，等值字段中抽样不同值多的在前
+    - 对集合 `$sample` 抽样，估算索引条件的选择性（`selectivity`，匹配的文档比例，越小索引越有效）和匹配的文档数量
+    - 同时给出当前的执行计划（`current_plan`），以及已经可以服务该形状的索引（`existing_index`）；前缀与另一条推荐索引相同时在 `served_by_recommendation` 中给出那条索引，两者都为null时建议创建
+    
+    **说明：**
+    - 查询形状保存在工作进程内存中，多进程部署时每个进程分别统计
+    - 形状数量上限由 `INDEX_ADVISOR_MAX_SHAPES` 配置（默认每个集合200种）
+    """,
+    tags=["统计信息"],
+    responses={
+        200: {
+            "description": "获取索引建议成功",
+            "content": {
+                "application/json": {
+                    "example": {
+                        "status": "success",
+                        "message": "分析了 2 种查询形状，建议创建 1 个索引",
+                        "data": {
+                            "namespace": "test_db.users",
+                            "estimated_documents": 100000,
+                            "sampled": 1000,
+                            "shapes_observed": 2,
+                            "recommendations": [
+                                {
+                                    "index": [["status", 1], ["age", -1], ["department", 1]],
+                                    "shapes": [{"equality": ["status"], "sort": [["age", -1]], "range": ["department"]}],
+                                    "queries": 120,
+                                    "last_seen": "2024-01-01T12:00:00",
+                                    "selectivity": 0.012,
+                                    "estimated_matches": 1200,
+                                    "current_plan": "COLLSCAN",
+                                    "current_indexes": [],
+                                    "existing_index": None,
+                                    "served_by_recommendation": None
+                                }
+                            ]
+                        },
+                        "timestamp": "2024-01-01T12:00:00"
+                    }
+                }
+            }
+        }
+    }
+)
+async def get_index_advice(
+    request: IndexAdviceRequest
+):
+    return api_response(await run_query(
+        request,
+        lambda api: index_advisor.advise(
+            api.collection,
+            request.connection_string,
+            request.database_name,
+            request.collection_name,
+            sample_size=request.sample_size
+        )
+    ))
+
 @app.post(
     "/disconnect", 
     response_model=ApiResponse,
@@ -1122,7 +2317,7 @@ async def get_collection_stats(
     }
 )
 async def disconnect_mongodb(
-    api: MongoDBQueryAPI = Depends(get_mongodb_api)
+    api: AsyncMongoDBQueryAPI = Depends(get_mongodb_api)
 ):
     result = api.close_connection()
     return ApiResponse(**result)
@@ -1155,6 +2350,184 @@ async def health_check():
         timestamp=datetime.now().isoformat()
     )
 
+@app.get(
+    "/metrics", 
+    summary="Prometheus指标",
+    description="""
+    以Prometheus文本格式导出指标（请求头 `Accept: application/openmetrics-text` 时返回OpenMetrics格式）。
+    
+    **指标（前缀 `mongodb_api_`）：**
+    - `http_requests_total`、`http_request_duration_seconds`、`http_response_size_bytes`: 按路由（路径模板）统计的请求数、耗时和响应字节数
+    - `http_requests_in_progress`: 正在处理的请求数
+    - `mongo_clients`: 连接池中缓存的MongoClient数量（`state="cached"`）和使用中的数量（`state="in_use"`）
+    - `mongo_connections`: pymongo连接池中已建立（`state="open"`）和正在使用（`state="checked_out"`）的连接数
+    - `mongo_connection_checkout_failures_total`: 获取连接失败的次数
+    - `cache_requests_total`: 进程内缓存（`tier="l1_local"`）和Redis（`tier="l2_redis"`）的命中/未命中/错误次数
+    - `serialization_duration_seconds`: 响应编码耗时（json/arrow/parquet）
+    
+    **多进程：** 设置 `PROMETHEUS_MULTIPROC_DIR` 并使用 `gunicorn -c gunicorn.conf.py` 启动时，返回所有工作进程汇总后的指标
+    """,
+    tags=["系统状态"],
+    responses={
+        200: {
+            "description": "Prometheus文本格式的指标",
+            "content": {"text/plain": {}}
+        },
+        404: {"description": "未启用Prometheus指标（PROMETHEUS_ENABLED=false）"}
+    }
+)
+async def metrics(request: Request):
+    if not prometheus_config["enabled"]:
+        raise HTTPException(status_code=404, detail="Prometheus指标未启用")
+    content, content_type = render_metrics(request.headers.get("accept", ""))
+    return Response(content=content, headers={"Content-Type": content_type})
+
+@app.get(
+    "/cache/stats", 
+    response_model=ApiResponse,
+    summary="缓存统计信息",
+    description="""
+    获取当前工作进程的两级缓存统计。
+    
+    **返回信息包括：**
+    - `l1_local`: 进程内LRU缓存的命中/未命中/淘汰次数、条目数和估算内存
+    - `l2_redis`: Redis缓存的命中/未命中/错误次数
+    - `single_flight`: 请求合并统计（实际查询次数、进程内/跨进程合并次数、等待超时次数）
+    - `change_streams`: 变更流失效统计（监听中的集合数、收到的写入事件、失效的缓存数量）
+    """,
+    tags=["系统状态"],
+    responses={
+        200: {
+            "description": "获取缓存统计成功",
+            "content": {
+                "application/json": {
+                    "example": {
+                        "status": "success",
+                        "message": "获取缓存统计成功",
+                        "data": {
+                            "l1_local": {"hits": 120, "misses": 30, "evictions": 0, "expirations": 5, "hit_ratio": 0.8,
+                                         "enabled": True, "entries": 25, "bytes": 204800,
+                                         "max_entries": 10000, "max_bytes": 67108864},
+                            "l2_redis": {"hits": 20, "misses": 10, "errors": 0, "hit_ratio": 0.6667, "available": True},
+                            "single_flight": {"leaders": 10, "coalesced_local": 42, "coalesced_remote": 3, "lock_timeouts": 0,
+                                              "leader_cancelled": 0},
+                            "change_streams": {"events": 8, "invalidations": 10, "keys_invalidated": 15, "errors": 0,
+                                               "enabled": True, "watched_namespaces": 2, "unsupported_clusters": 0}
+                        },
+                        "timestamp": "2024-01-01T12:00:00"
+                    }
+                }
+            }
+        }
+    }
+)
+async def get_cache_stats():
+    return ApiResponse(
+        status="success",
+        message="获取缓存统计成功",
+        data={
+            **tiered_cache.get_stats(),
+            "single_flight": dict(single_flight.stats),
+            "change_streams": change_stream_invalidator.get_stats()
+        },
+        timestamp=datetime.now().isoformat()
+    )
+
+@app.get(
+    "/query_stats", 
+    response_model=ApiResponse,
+    summary="查询形状耗时统计",
+    description="""
+    获取当前工作进程按查询形状统计的耗时，按累计耗时从高到低排列。
+    
+    **查询形状：**
+    - `/query`、`/query_one`、`/aggregate`、`/distinct` 和 `/batch` 中的每个操作按形状分别统计（流式返回和explain请求不统计）
+    - 形状去掉了 `query_filter`、`pipeline` 中的字面量值（替换为 `"?"`），如 `{"age": {"$gte": 25}}` 和 `{"age": {"$gte": 30}}` 是同一种形状
+    
+    **每种形状的统计：**
+    - `latency`: 耗时分布（HDR直方图，相对误差小于1%），包括 `p50_ms`、`p90_ms`、`p99_ms`、`max_ms`
+    - `cache_hit_ratio`: 不需要查询数据库的请求比例（缓存命中或合并到其他请求的查询）
+    - `documents_returned` / `avg_documents` / `max_documents`: 返回的文档数量
+    - `avg_phase_ms`: 各阶段平均耗时：`cache_lookup`（读缓存）、`connect`（获取连接）、`execute`（执行查询）、`serialize`（编码响应）
+    - `slow`: 超过慢查询阈值（`SLOW_QUERY_MS`，默认500毫秒）的次数，详细记录见 `/query_stats/slow`
+    """,
+    tags=["统计信息"],
+    responses={
+        200: {
+            "description": "获取查询形状统计成功",
+            "content": {
+                "application/json": {
+                    "example": {
+                        "status": "success",
+                        "message": "获取查询形状统计成功，共 1 种查询形状",
+                        "data": {
+                            "enabled": True,
+                            "slow_query_ms": 500,
+                            "shapes_tracked": 1,
+                            "shapes": [
+                                {
+                                    "shape_id": "3f7a1c9e5b2d4a60",
+                                    "op": "query",
+                                    "namespace": "test_db.users",
+                                    "filter": {"age": {"$gte": "?"}, "department": "?"},
+                                    "sort": [["age", -1]],
+                                    "count": 120,
+                                    "errors": 0,
+                                    "slow": 2,
+                                    "cache_hit_ratio": 0.85,
+                                    "documents_returned": 1200,
+                                    "avg_documents": 10.0,
+                                    "max_documents": 10,
+                                    "latency": {"mean_ms": 12.4, "min_ms": 0.8, "p50_ms": 1.2, "p90_ms": 45.1, "p99_ms": 610.0, "max_ms": 720.3},
+                                    "avg_phase_ms": {"cache_lookup": 0.4, "connect": 0.2, "execute": 10.9, "serialize": 0.3},
+                                    "total_time_ms": 1488.0,
+                                    "last_seen": "2024-01-01T12:00:00"
+                                }
+                            ]
+                        },
+                        "timestamp": "2024-01-01T12:00:00"
+                    }
+                }
+            }
+        }
+    }
+)
+async def get_query_stats(
+    limit: int = Query(default=50, description="最多返回的查询形状数量", ge=1, le=1000)
+):
+    stats = query_metrics.get_stats(limit)
+    return api_response({
+        "status": "success",
+        "message": f"获取查询形状统计成功，共 {stats['shapes_tracked']} 种查询形状",
+        "data": stats,
+        "timestamp": datetime.now().isoformat()
+    })
+
+@app.get(
+    "/query_stats/slow", 
+    response_model=ApiResponse,
+    summary="慢查询日志",
+    description="""
+    获取当前工作进程最近的慢查询（耗时超过 `SLOW_QUERY_MS`），最新的在前。
+    
+    每条记录包括完整的请求参数（连接字符串替换为不含用户名和密码的集群标识）、查询形状标识、总耗时和各阶段耗时
+    （`cache_lookup`、`connect`、`execute`、`serialize`），保留的条数由 `SLOW_QUERY_LOG_SIZE` 配置；
+    慢查询同时以WARNING级别写入日志。
+    """,
+    tags=["统计信息"]
+)
+async def get_slow_queries(
+    limit: int = Query(default=50, description="最多返回的慢查询条数", ge=1, le=1000)
+):
+    slow_queries = query_metrics.get_slow_queries(limit)
+    return api_response({
+        "status": "success",
+        "message": f"获取慢查询日志成功，返回 {len(slow_queries)} 条",
+        "data": slow_queries,
+        "count": len(slow_queries),
+        "timestamp": datetime.now().isoformat()
+    })
+
 @app.get(
     "/", 
     summary="API信息",
@@ -1178,13 +2551,30 @@ async def health_check():
                                 "query": "POST /query - 查询文档（自动连接断开）",
                                 "query_one": "POST /query_one - 查询单个文档（自动连接断开）",
                                 "aggregate": "POST /aggregate - 聚合查询（自动连接断开）",
-                                "distinct": "POST /distinct - 查询字段唯一值（自动连接断开）"
+                                "distinct": "POST /distinct - 查询字段唯一值（自动连接断开）",
+                                "batch": "POST /batch - 批量执行查询"
+                            },
+                            "数据写入": {
+                                "bulk_write": "POST /bulk_write - 批量写入文档（插入、更新、upsert、删除）",
+                                "ingest": "POST /ingest/{database_name}/{collection_name} - 流式导入NDJSON文档",
+                                "ingest_progress": "GET /ingest/{ingest_id} - 查询导入进度"
+                            },
+                            "游标会话": {
+                                "open_cursor": "POST /cursors - 打开服务端游标",
+                                "fetch_cursor": "POST /cursors/{cursor_id}/next - 获取下一批文档",
+                                "close_cursor": "DELETE /cursors/{cursor_id} - 关闭游标",
+                                "cursor_stats": "GET /cursors/stats - 游标会话统计"
                             },
                             "统计信息": {
-                                "stats": "GET /stats - 获取统计信息"
+                                "stats": "GET /stats - 获取统计信息",
+                                "index_advice": "POST /index_advice - 索引建议",
+                                "query_stats": "GET /query_stats - 查询形状耗时统计",
+                                "slow_queries": "GET /query_stats/slow - 慢查询日志"
                             },
                             "系统状态": {
                                 "health": "GET /health - 健康检查",
+                                "metrics": "GET /metrics - Prometheus指标",
+                                "cache_stats": "GET /cache/stats - 缓存统计",
                                 "docs": "GET /docs - Swagger API文档",
                                 "redoc": "GET /redoc - ReDoc API文档"
                             }
@@ -1212,13 +2602,30 @@ async def root():
                 "query": "POST /query - 查询文档（自动连接断开）",
                 "query_one": "POST /query_one - 查询单个文档（自动连接断开）",
                 "aggregate": "POST /aggregate - 聚合查询（自动连接断开）",
-                "distinct": "POST /distinct - 查询字段唯一值（自动连接断开）"
+                "distinct": "POST /distinct - 查询字段唯一值（自动连接断开）",
+                "batch": "POST /batch - 批量执行查询"
+            },
+            "数据写入": {
+                "bulk_write": "POST /bulk_write - 批量写入文档（插入、更新、upsert、删除）",
+                "ingest": "POST /ingest/{database_name}/{collection_name} - 流式导入NDJSON文档",
+                "ingest_progress": "GET /ingest/{ingest_id} - 查询导入进度"
+            },
+            "游标会话": {
+                "open_cursor": "POST /cursors - 打开服务端游标",
+                "fetch_cursor": "POST /cursors/{cursor_id}/next - 获取下一批文档",
+                "close_cursor": "DELETE /cursors/{cursor_id} - 关闭游标",
+                "cursor_stats": "GET /cursors/stats - 游标会话统计"
             },
             "统计信息": {
-                "stats": "GET /stats - 获取统计信息"
+                "stats": "GET /stats - 获取统计信息",
+                "index_advice": "POST /index_advice - 索引建议",
+                "query_stats": "GET /query_stats - 查询形状耗时统计",
+                "slow_queries": "GET /query_stats/slow - 慢查询日志"
             },
             "系统状态": {
                 "health": "GET /health - 健康检查",
+                "metrics": "GET /metrics - Prometheus指标",
+                "cache_stats": "GET /cache/stats - 缓存统计",
                 "docs": "GET /docs - Swagger API文档",
                 "redoc": "GET /redoc - ReDoc API文档"
             }
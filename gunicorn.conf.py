@@ -0,0 +1,27 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+gunicorn配置
+多个工作进程共用Prometheus指标目录（PROMETHEUS_MULTIPROC_DIR）：启动时清空上次运行遗留的指标文件，
+工作进程退出（包括被重启）时标记该进程，其仪表盘类指标不再计入汇总
+"""
+
+import os
+import shutil
+
+# 设置PROMETHEUS_MULTIPROC_DIR时才需要处理
+multiproc_dir = os.getenv("PROMETHEUS_MULTIPROC_DIR", "")
+
+
+def on_starting(server):
+    """主进程启动时（工作进程创建之前）清空指标目录"""
+    if multiproc_dir:
+        shutil.rmtree(multiproc_dir, ignore_errors=True)
+        os.makedirs(multiproc_dir, exist_ok=True)
+
+
+def child_exit(server, worker):
+    """工作进程退出后，在主进程中标记该进程"""
+    if multiproc_dir:
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
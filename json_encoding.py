@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+JSON响应编码
+查询结果直接编码为JSON字节：安装了orjson时使用orjson，否则退回标准库json，
+不经过Pydantic校验和FastAPI的jsonable_encoder
+"""
+
+import json
+from datetime import datetime
+from typing import Any
+
+from starlette.responses import Response
+from bson_encoder import encode_value
+
+try:
+    import orjson
+except ImportError:  # 可选依赖
+    orjson = None
+
+
+def _default(value: Any) -> Any:
+    """JSON无法直接表示的类型：datetime转ISO格式，其余类型按encode_value转换（ObjectId等转字符串）"""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return encode_value(value)
+
+
+def dumps(value: Any) -> bytes:
+    """
+    把值编码为紧凑的UTF-8 JSON字节
+
+    Args:
+        value: 要编码的值（dict、list等）
+
+    Returns:
+        bytes: JSON字节
+    """
+    if orjson is not None:
+        return orjson.dumps(value, default=_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"), default=_default).encode("utf-8")
+
+
+def dumps_lines(values: list) -> bytes:
+    """把多个值编码为NDJSON（每行一个JSON）"""
+    return b"".join(dumps(value) + b"\n" for value in values)
+
+
+class FastJSONResponse(Response):
+    """使用dumps编码的JSON响应，内容不做任何校验或转换"""
+
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
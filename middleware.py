@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ASGI中间件
+纯ASGI实现，不缓冲响应体，兼容GZipMiddleware和流式响应
+"""
+
+import time
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from prometheus_metrics import HTTP_REQUESTS_IN_PROGRESS, prometheus_config, record_http_request, route_label
+from tracing import finish_server_span, server_span, tracing_enabled
+
+
+class ProcessTimeMiddleware:
+    """
+    性能统计中间件
+    - 计算请求处理时间（到响应头发出为止），写入 X-Process-Time-Ms 响应头
+    - 响应带有Content-Length时，同时写入 X-Response-Length 响应头
+    - 包装send统计实际发送的字节数，响应结束后打印日志
+    - 响应结束（或处理出错）后按路由记录Prometheus的请求数、耗时和响应字节数
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start_time = time.perf_counter()
+        process_time_ms = None
+        response_length = 0
+        status_code = 500
+        record_metrics = prometheus_config["enabled"]
+
+        async def send_wrapper(message: Message):
+            nonlocal process_time_ms, response_length, status_code
+
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                process_time_ms = round((time.perf_counter() - start_time) * 1000, 2)
+                headers = MutableHeaders(scope=message)
+                headers["X-Process-Time-Ms"] = str(process_time_ms)
+                # 只有已知长度时才写入响应头，流式响应的长度在结束时记录到日志
+                content_length = headers.get("content-length")
+                if content_length is not None:
+                    headers["X-Response-Length"] = content_length
+
+            elif message["type"] == "http.response.body":
+                response_length += len(message.get("body", b""))
+                if not message.get("more_body", False):
+                    total_time_ms = round((time.perf_counter() - start_time) * 1000, 2)
+                    print(f"INFO:     Request: {scope['method']} {scope['path']} - "
+                          f"Process Time: {process_time_ms}ms - "
+                          f"Total Time: {total_time_ms}ms - "
+                          f"Response Length: {response_length} bytes")
+
+            await send(message)
+
+        if not record_metrics:
+            await self.app(scope, receive, send_wrapper)
+            return
+
+        in_progress = HTTP_REQUESTS_IN_PROGRESS.labels(method=scope["method"])
+        in_progress.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            in_progress.dec()
+            # 路由匹配后scope中带有路由，出错时状态码按500记录
+            record_http_request(scope, status_code, time.perf_counter() - start_time, response_length)
+
+
+class TracingMiddleware:
+    """
+    OpenTelemetry追踪中间件
+    - 从请求头提取W3C trace context，为每个请求创建服务端span，接口中的各阶段都是它的子span
+    - span在响应体发送完毕后结束（包括流式响应），按路由的路径模板命名
+    - 未启用追踪时直接调用下层应用
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or not tracing_enabled():
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_wrapper(message: Message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        with server_span(scope) as current_span:
+            try:
+                await self.app(scope, receive, send_wrapper)
+            finally:
+                finish_server_span(current_span, scope["method"], route_label(scope), status_code)
@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+MongoDB客户端连接池
+按连接字符串在进程内复用MongoClient实例，避免每个请求都重新握手、认证和ping
+"""
+
+import asyncio
+import threading
+import time
+import logging
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+from pymongo import MongoClient
+from motor.motor_asyncio import AsyncIOMotorClient
+from config import Config
+from prometheus_metrics import connection_pool_metrics, prometheus_config, set_client_gauges
+from tracing import span
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class _PooledClient:
+    """连接池中的单个客户端条目"""
+
+    __slots__ = ("client", "last_used", "in_use")
+
+    def __init__(self, client: Any):
+        self.client = client
+        self.last_used = time.monotonic()
+        self.in_use = 0
+
+
+class MongoClientPool:
+    """
+    进程级MongoClient注册表
+
+    - 以连接字符串为键复用客户端，每个客户端自带pymongo的socket连接池
+    - 只在首次创建客户端时执行ping，后续请求直接复用
+    - 超过max_clients时按LRU淘汰，空闲超过idle_timeout_seconds的客户端会被关闭
+      （获取/归还客户端时检查，另外由start()启动的后台任务每隔evict_interval_seconds检查一次，
+      没有请求的客户端也会被及时关闭）
+    - 正在被请求使用的客户端（in_use > 0）不会被淘汰
+    """
+
+    # Prometheus指标中的pool标签
+    metrics_label = "sync"
+
+    def __init__(self, max_clients: int = None, idle_timeout_seconds: int = None, environment: str = None,
+                 evict_interval_seconds: int = None):
+        pool_config = Config.get_client_pool_config()
+        self.max_clients = max_clients if max_clients is not None else pool_config["max_clients"]
+        self.idle_timeout_seconds = (
+            idle_timeout_seconds if idle_timeout_seconds is not None else pool_config["idle_timeout_seconds"]
+        )
+        self.evict_interval_seconds = (
+            evict_interval_seconds if evict_interval_seconds is not None else pool_config["evict_interval_seconds"]
+        )
+        self.mongodb_config = Config.get_mongodb_config(environment or Config.get_environment())
+        self._clients: "OrderedDict[str, _PooledClient]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._evict_task: Optional[asyncio.Task] = None
+
+    def _client_options(self) -> Dict[str, Any]:
+        """根据MONGODB_CONFIG生成客户端参数"""
+        options = {
+            "serverSelectionTimeoutMS": self.mongodb_config["server_selection_timeout_ms"],
+            "connectTimeoutMS": self.mongodb_config["connect_timeout_ms"],
+            "socketTimeoutMS": self.mongodb_config["socket_timeout_ms"],
+            "maxPoolSize": self.mongodb_config["max_pool_size"],
+            "minPoolSize": self.mongodb_config["min_pool_size"],
+        }
+        if prometheus_config["enabled"]:
+            # 连接的建立、关闭、借出、归还计入Prometheus指标
+            options["event_listeners"] = [connection_pool_metrics]
+        return options
+
+    def _create_client(self, connection_string: str) -> Any:
+        """创建新的客户端并测试连接，失败时抛出pymongo异常"""
+        client = MongoClient(connection_string, **self._client_options())
+        try:
+            with span("mongodb.ping"):
+                client.admin.command('ping')
+        except Exception:
+            client.close()
+            raise
+        return client
+
+    def _close_clients(self, clients: List[Any]):
+        """关闭被淘汰的客户端（在锁外执行）"""
+        for client in clients:
+            try:
+                client.close()
+            except Exception as e:
+                logger.error(f"关闭MongoDB客户端时出错: {e}")
+
+    def _collect_evictable(self) -> List[Any]:
+        """收集需要淘汰的客户端，调用方必须持有锁"""
+        evicted = []
+        now = time.monotonic()
+
+        # 1. 淘汰空闲超时的客户端
+        for key in list(self._clients.keys()):
+            entry = self._clients[key]
+            if entry.in_use == 0 and now - entry.last_used > self.idle_timeout_seconds:
+                evicted.append(self._clients.pop(key).client)
+
+        # 2. 超过数量上限时，从最久未使用的开始淘汰
+        if len(self._clients) > self.max_clients:
+            for key in list(self._clients.keys()):
+                if len(self._clients) <= self.max_clients:
+                    break
+                if self._clients[key].in_use == 0:
+                    evicted.append(self._clients.pop(key).client)
+
+        if evicted:
+            logger.info(f"淘汰 {len(evicted)} 个空闲MongoDB客户端")
+        self._update_gauges()
+        return evicted
+
+    def _update_gauges(self):
+        """更新客户端数量指标，调用方必须持有锁"""
+        if prometheus_config["enabled"]:
+            set_client_gauges(
+                self.metrics_label, len(self._clients), sum(entry.in_use for entry in self._clients.values())
+            )
+
+    def _checkout(self, connection_string: str) -> Optional[Any]:
+        """已缓存时标记为使用中并返回客户端，否则返回None"""
+        with self._lock:
+            entry = self._clients.get(connection_string)
+            if entry is None:
+                return None
+            entry.in_use += 1
+            entry.last_used = time.monotonic()
+            self._clients.move_to_end(connection_string)
+            self._update_gauges()
+            return entry.client
+
+    def _register(self, connection_string: str, client: Any) -> Any:
+        """登记新创建的客户端并标记为使用中，返回最终使用的客户端"""
+        with self._lock:
+            entry = self._clients.get(connection_string)
+            if entry is None:
+                entry = _PooledClient(client)
+                self._clients[connection_string] = entry
+                duplicate = None
+                logger.info(f"创建新的MongoDB客户端，当前缓存客户端数量: {len(self._clients)}")
+            else:
+                # 并发请求已经创建了同一个客户端，丢弃自己创建的
+                duplicate = client
+            entry.in_use += 1
+            entry.last_used = time.monotonic()
+            self._clients.move_to_end(connection_string)
+            evicted = self._collect_evictable()
+
+        if duplicate is not None:
+            evicted.append(duplicate)
+        self._close_clients(evicted)
+        return entry.client
+
+    def acquire(self, connection_string: str) -> Any:
+        """
+        获取（必要时创建）连接字符串对应的客户端，并标记为使用中
+
+        Args:
+            connection_string: MongoDB连接字符串
+
+        Returns:
+            客户端实例，使用完毕后必须调用release归还
+        """
+        client = self._checkout(connection_string)
+        if client is not None:
+            return client
+
+        # 在锁外创建客户端，避免慢速握手阻塞其他连接字符串的请求
+        return self._register(connection_string, self._create_client(connection_string))
+
+    def release(self, connection_string: str):
+        """
+        归还客户端（不关闭连接）
+
+        Args:
+            connection_string: MongoDB连接字符串
+        """
+        with self._lock:
+            entry = self._clients.get(connection_string)
+            if entry is not None and entry.in_use > 0:
+                entry.in_use -= 1
+                entry.last_used = time.monotonic()
+            evicted = self._collect_evictable()
+        self._close_clients(evicted)
+
+    def evict_idle(self):
+        """主动淘汰空闲超时的客户端"""
+        with self._lock:
+            evicted = self._collect_evictable()
+        self._close_clients(evicted)
+
+    async def _evict_loop(self):
+        while True:
+            await asyncio.sleep(self.evict_interval_seconds)
+            try:
+                self.evict_idle()
+            except Exception as e:
+                logger.error(f"淘汰空闲MongoDB客户端时出错: {e}")
+
+    def start(self):
+        """启动空闲客户端淘汰任务（应用启动时调用）"""
+        if self._evict_task is None:
+            self._evict_task = asyncio.create_task(self._evict_loop())
+
+    async def stop(self):
+        """停止淘汰任务（应用关闭时调用，之后再调用close_all关闭客户端）"""
+        if self._evict_task is not None:
+            self._evict_task.cancel()
+            try:
+                await self._evict_task
+            except asyncio.CancelledError:
+                pass
+            self._evict_task = None
+
+    def close_all(self):
+        """关闭所有缓存的客户端（应用退出时调用）"""
+        with self._lock:
+            clients = [entry.client for entry in self._clients.values()]
+            self._clients.clear()
+            self._update_gauges()
+        self._close_clients(clients)
+        if clients:
+            logger.info(f"已关闭 {len(clients)} 个MongoDB客户端")
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        获取连接池状态
+
+        Returns:
+            Dict: 客户端数量、使用中数量和配置
+        """
+        with self._lock:
+            return {
+                "clients": len(self._clients),
+                "in_use": sum(entry.in_use for entry in self._clients.values()),
+                "max_clients": self.max_clients,
+                "idle_timeout_seconds": self.idle_timeout_seconds,
+                "evict_interval_seconds": self.evict_interval_seconds,
+                "max_pool_size": self.mongodb_config["max_pool_size"],
+                "min_pool_size": self.mongodb_config["min_pool_size"],
+            }
+
+
+class AsyncMongoClientPool(MongoClientPool):
+    """
+    进程级AsyncIOMotorClient注册表
+
+    复用MongoClientPool的LRU/空闲淘汰逻辑，客户端创建和ping改为异步执行，
+    供FastAPI异步接口使用，避免阻塞事件循环
+    """
+
+    metrics_label = "async"
+
+    async def _create_client_async(self, connection_string: str) -> Any:
+        """创建新的Motor客户端并异步测试连接，失败时抛出pymongo异常"""
+        client = AsyncIOMotorClient(connection_string, **self._client_options())
+        try:
+            with span("mongodb.ping"):
+                await client.admin.command('ping')
+        except Exception:
+            client.close()
+            raise
+        return client
+
+    async def acquire(self, connection_string: str) -> Any:
+        """
+        获取（必要时创建）连接字符串对应的Motor客户端，并标记为使用中
+
+        Args:
+            connection_string: MongoDB连接字符串
+
+        Returns:
+            AsyncIOMotorClient实例，使用完毕后必须调用release归还
+        """
+        client = self._checkout(connection_string)
+        if client is not None:
+            return client
+
+        return self._register(connection_string, await self._create_client_async(connection_string))
+
+
+# 创建全局的连接池实例，方便在应用中复用
+mongo_client_pool = MongoClientPool()
+async_mongo_client_pool = AsyncMongoClientPool()
@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+NDJSON流式导入
+边接收请求体边按行解析，攒够batch_size个文档就提交一次insert_many；
+同时写入中的批次达到上限时暂停读取请求体，由TCP流控让客户端放慢上传（背压）
+
+进度（已确认写入的字节偏移）保存在Redis检查点中，导入中断后客户端从该偏移处继续上传剩余部分即可；
+检查点之后的批次可能已部分写入，文档带有_id时重复部分会被拒绝，否则可能产生重复文档
+"""
+
+import asyncio
+import json
+import uuid
+import logging
+from collections import deque
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+from config import Config
+from async_mongodb_api import AsyncMongoDBQueryAPI
+from redis_cache import AsyncRedisCache, async_redis_cache
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 进度中最多保留的错误条数
+MAX_REPORTED_ERRORS = 20
+
+
+async def iter_ndjson_lines(chunks: AsyncIterator[bytes],
+                            start_offset: int = 0,
+                            max_line_bytes: int = None) -> AsyncIterator[Tuple[bytes, int]]:
+    """
+    把请求体分块切分为行
+
+    Args:
+        chunks: 请求体分块
+        start_offset: 第一个分块在原始文件中的字节偏移（续传时为resume_offset）
+        max_line_bytes: 单行最大字节数，超出时抛出ValueError
+
+    Returns:
+        AsyncIterator: (行内容（不含换行符）, 该行结束后在原始文件中的字节偏移)
+    """
+    buffer = bytearray()
+    # buffer第一个字节在原始文件中的偏移
+    offset = start_offset
+    async for chunk in chunks:
+        buffer += chunk
+        start = 0
+        while True:
+            newline = buffer.find(b"\n", start)
+            if newline == -1:
+                break
+            line = bytes(buffer[start:newline])
+            start = newline + 1
+            yield line, offset + start
+        del buffer[:start]
+        offset += start
+        if max_line_bytes and len(buffer) > max_line_bytes:
+            raise ValueError(f"偏移 {offset} 处的行超过 {max_line_bytes} 字节")
+    if buffer:
+        # 最后一行可以没有换行符
+        yield bytes(buffer), offset + len(buffer)
+
+
+class IngestJob:
+    """一次导入请求：提交批次、按顺序确认完成的批次、推进检查点"""
+
+    def __init__(self,
+                 ingestor: "NDJSONIngestor",
+                 api: AsyncMongoDBQueryAPI,
+                 progress: Dict[str, Any],
+                 ordered: bool,
+                 lease_token: str):
+        self.ingestor = ingestor
+        self.api = api
+        self.progress = progress
+        self.ordered = ordered
+        self.lease_token = lease_token
+        self.semaphore = asyncio.Semaphore(ingestor.max_in_flight)
+        # 按提交顺序排列的 (写入任务, 批次结束偏移)
+        self.pending: deque = deque()
+        # 写入失败的原因
+        self.failure: Optional[str] = None
+
+    async def _insert(self, documents: List[Dict[str, Any]]) -> Dict[str, Any]:
+        try:
+            return await self.api.insert_documents(documents, ordered=self.ordered)
+        finally:
+            self.semaphore.release()
+
+    async def submit(self, documents: List[Dict[str, Any]], end_offset: int):
+        """提交一个批次；写入中的批次已达上限时等待，期间不再读取请求体"""
+        await self.semaphore.acquire()
+        task = asyncio.create_task(self._insert(documents))
+        self.pending.append((task, end_offset))
+        await self.commit()
+
+    async def commit(self):
+        """
+        按提交顺序确认已完成的批次，推进检查点
+
+        批次可能乱序完成，检查点只推进到连续完成的最后一个批次，保证偏移之前的数据都已写入
+        """
+        advanced = False
+        while self.pending and self.pending[0][0].done() and self.failure is None:
+            task, end_offset = self.pending.popleft()
+            result = task.result()
+            self.progress["inserted_count"] += (result.get("data") or {}).get("inserted_count", 0)
+            if result["status"] != "success":
+                self.failure = result["message"]
+                self.add_error(self.progress["committed_offset"], result["message"])
+                break
+            self.progress["committed_offset"] = end_offset
+            self.progress["batches"] += 1
+            advanced = True
+        if advanced:
+            await self.ingestor.save_progress(self.progress, self.lease_token)
+
+    async def drain(self):
+        """等待所有写入中的批次完成并确认"""
+        if self.pending:
+            await asyncio.gather(*(task for task, _ in self.pending), return_exceptions=True)
+        await self.commit()
+        # 失败批次之后已完成的批次不推进检查点（续传时会重新写入），只计入插入数量
+        while self.pending:
+            task, _ = self.pending.popleft()
+            if not task.cancelled() and task.exception() is None:
+                self.progress["inserted_count"] += (task.result().get("data") or {}).get("inserted_count", 0)
+
+    def add_error(self, offset: int, message: str):
+        if len(self.progress["errors"]) < MAX_REPORTED_ERRORS:
+            self.progress["errors"].append({"offset": offset, "message": message})
+
+
+class NDJSONIngestor:
+    """
+    NDJSON流式导入
+
+    - ingest读取请求体并分批写入，返回最终进度
+    - 进度同时保存在Redis中（按ingest_id），导入过程中或中断后可通过get_progress查询
+    - 同一个ingest_id同时只能有一个导入请求
+    """
+
+    def __init__(self, remote: AsyncRedisCache, ingest_config: Dict[str, Any] = None):
+        ingest_config = ingest_config or Config.get_ingest_config()
+        self.remote = remote
+        self.batch_size = ingest_config["batch_size"]
+        self.max_in_flight = ingest_config["max_in_flight"]
+        self.max_line_bytes = ingest_config["max_line_bytes"]
+        self.checkpoint_ttl_seconds = ingest_config["checkpoint_ttl_seconds"]
+        self.lease_ttl_ms = ingest_config["lease_ttl_ms"]
+
+    @staticmethod
+    def checkpoint_key(ingest_id: str) -> str:
+        return f"mongodb_api:ingest:{ingest_id}"
+
+    async def get_progress(self, ingest_id: str) -> Optional[Dict[str, Any]]:
+        """
+        获取导入进度（检查点）
+
+        Args:
+            ingest_id: 导入任务标识
+
+        Returns:
+            Dict: 进度，不存在或已过期时返回None
+        """
+        return await self.remote.get(self.checkpoint_key(ingest_id))
+
+    async def save_progress(self, progress: Dict[str, Any], lease_token: str):
+        key = self.checkpoint_key(progress["ingest_id"])
+        progress["updated_at"] = datetime.now().isoformat()
+        await self.remote.set(key, progress, ttl=self.checkpoint_ttl_seconds)
+        # 每次推进检查点时续约，长时间导入不会丢失租约
+        await self.remote.extend_lock(f"{key}:lock", lease_token, self.lease_ttl_ms)
+
+    async def ingest(self,
+                     api: AsyncMongoDBQueryAPI,
+                     chunks: AsyncIterator[bytes],
+                     ingest_id: Optional[str] = None,
+                     resume_offset: int = 0,
+                     batch_size: int = None,
+                     ordered: bool = True,
+                     skip_invalid: bool = False) -> Dict[str, Any]:
+        """
+        流式导入NDJSON
+
+        Args:
+            api: 已连接到目标集合的API
+            chunks: 请求体分块
+            ingest_id: 导入任务标识，续传时使用同一个标识；不传则自动生成
+            resume_offset: 本次上传内容在原始文件中的起始字节偏移（续传时传入检查点的committed_offset）
+            batch_size: 每次insert_many的文档数量
+            ordered: insert_many是否按顺序插入
+            skip_invalid: 是否跳过无法解析的行；为False时遇到无法解析的行即停止
+
+        Returns:
+            Dict: 结果字典，data为导入进度（committed_offset为续传时的起始偏移）
+        """
+        ingest_id = ingest_id or uuid.uuid4().hex
+        batch_size = batch_size or self.batch_size
+        key = self.checkpoint_key(ingest_id)
+
+        previous = await self.get_progress(ingest_id)
+        if previous is not None and resume_offset > previous["committed_offset"]:
+            return {
+                "status": "error",
+                "message": f"resume_offset {resume_offset} 超过检查点 {previous['committed_offset']}，中间的数据尚未写入",
+                "data": previous,
+                "timestamp": datetime.now().isoformat()
+            }
+
+        lease_token = uuid.uuid4().hex
+        if not await self.remote.acquire_lock(f"{key}:lock", lease_token, self.lease_ttl_ms):
+            return {
+                "status": "error",
+                "message": f"导入任务 {ingest_id} 正在进行中",
+                "data": previous,
+                "timestamp": datetime.now().isoformat()
+            }
+
+        progress = {
+            "ingest_id": ingest_id,
+            "status": "running",
+            "database": api.db.name,
+            "collection": api.collection.name,
+            "resume_offset": resume_offset,
+            "committed_offset": resume_offset,
+            "lines": 0,
+            "batches": 0,
+            "inserted_count": 0,
+            "invalid_lines": 0,
+            "errors": []
+        }
+        job = IngestJob(self, api, progress, ordered, lease_token)
+        batch: List[Dict[str, Any]] = []
+        batch_end = resume_offset
+        # 停止读取的原因（无法解析的行、读取请求体出错）
+        stop_reason: Optional[str] = None
+
+        try:
+            await self.save_progress(progress, lease_token)
+            async for line, end_offset in iter_ndjson_lines(chunks, resume_offset, self.max_line_bytes):
+                if not line.strip():
+                    # 空行只推进偏移
+                    batch_end = end_offset
+                    continue
+                progress["lines"] += 1
+                try:
+                    document = json.loads(line)
+                    if not isinstance(document, dict):
+                        raise ValueError("不是JSON对象")
+                except ValueError as e:
+                    line_offset = end_offset - len(line) - 1
+                    if not skip_invalid:
+                        stop_reason = f"偏移 {line_offset} 处的行无法解析: {e}"
+                        job.add_error(line_offset, stop_reason)
+                        break
+                    progress["invalid_lines"] += 1
+                    job.add_error(line_offset, f"已跳过无法解析的行: {e}")
+                    batch_end = end_offset
+                    continue
+
+                batch.append(document)
+                batch_end = end_offset
+                if len(batch) >= batch_size:
+                    await job.submit(batch, batch_end)
+                    batch = []
+                    if job.failure:
+                        break
+        except Exception as e:
+            # 客户端断开、行过长等：已读完的完整行仍然写入
+            stop_reason = f"读取请求体时出错: {str(e)}"
+            job.add_error(batch_end, stop_reason)
+        finally:
+            try:
+                if batch and job.failure is None:
+                    # 停止读取前已解析的文档也写入，让检查点尽量靠近出错位置
+                    await job.submit(batch, batch_end)
+                await job.drain()
+                progress["status"] = "failed" if job.failure or stop_reason else "completed"
+                await self.save_progress(progress, lease_token)
+            finally:
+                await self.remote.release_lock(f"{key}:lock", lease_token)
+
+        failure = job.failure or stop_reason
+        if failure:
+            message = f"导入中断: {failure}；已写入 {progress['inserted_count']} 个文档，可从偏移 {progress['committed_offset']} 处续传"
+            logger.error(message)
+            return {
+                "status": "error",
+                "message": message,
+                "data": progress,
+                "timestamp": datetime.now().isoformat()
+            }
+
+        message = f"导入完成，写入 {progress['inserted_count']} 个文档"
+        if progress["invalid_lines"]:
+            message += f"，跳过 {progress['invalid_lines']} 行无法解析的数据"
+        logger.info(message)
+        return {
+            "status": "success",
+            "message": message,
+            "data": progress,
+            "count": progress["inserted_count"],
+            "timestamp": datetime.now().isoformat()
+        }
+
+
+# 创建一个全局的NDJSONIngestor实例，方便在应用中复用
+ndjson_ingestor = NDJSONIngestor(async_redis_cache)
@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+键集（keyset）分页
+用上一页最后一个文档的排序键和_id生成分页令牌，下一页转换为排序字段上的范围条件，
+代替skip逐条跳过文档，任意深度的翻页耗时都与第一页相同（需要与排序一致的索引）
+
+限制：排序字段必须是标量且类型一致（允许null或缺失）。$gt/$lt只比较同一类BSON类型，
+混合类型（如数字和字符串）的字段会漏掉其他类型的文档；数组字段在MongoDB中按最小/最大元素排序，
+无法转换为范围条件。遇到数组值或同一页中出现混合类型时返回错误，跨页才出现的其他类型无法检测
+"""
+
+import base64
+import binascii
+import json
+from decimal import Decimal
+from typing import Any, Dict, List, Optional, Tuple
+import bson
+from bson.decimal128 import Decimal128
+from bson.int64 import Int64
+from cache_keys import hash_payload, normalize_filter, normalize_projection
+
+
+class PageTokenError(ValueError):
+    """分页令牌无效或与当前查询不匹配"""
+
+
+def keyset_sort(sort: Optional[List[Tuple[str, Any]]]) -> List[Tuple[str, int]]:
+    """
+    生成键集分页使用的排序：校验方向，并在末尾追加_id保证排序唯一
+
+    Args:
+        sort: 排序条件列表，如 [("age", -1)]
+
+    Returns:
+        List: 以_id结尾的排序条件
+    """
+    sort_spec = []
+    for field, direction in sort or []:
+        if direction not in (1, -1):
+            raise PageTokenError(f"分页查询的排序方向只能是1或-1: {field}")
+        sort_spec.append((field, int(direction)))
+    if "_id" not in [field for field, _ in sort_spec]:
+        sort_spec.append(("_id", 1))
+    return sort_spec
+
+
+def page_fingerprint(namespace: str,
+                     query_filter: Optional[Dict[str, Any]],
+                     projection: Optional[Dict[str, Any]],
+                     sort_spec: List[Tuple[str, int]]) -> str:
+    """查询的指纹，写入令牌中，防止令牌被用于其他查询"""
+    payload = [namespace, normalize_filter(query_filter), normalize_projection(projection), sort_spec]
+    return hash_payload(json.dumps(payload, separators=(",", ":"), default=str))[:16]
+
+
+def encode_page_token(fingerprint: str, values: List[Any]) -> str:
+    """把排序键编码为不透明的令牌（BSON + base64url，保留ObjectId、datetime等类型）"""
+    raw = bson.encode({"f": fingerprint, "v": values})
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_page_token(token: str, fingerprint: str) -> List[Any]:
+    """
+    解码分页令牌
+
+    Args:
+        token: encode_page_token生成的令牌
+        fingerprint: 当前查询的指纹
+
+    Returns:
+        List: 上一页最后一个文档的排序键
+
+    Raises:
+        PageTokenError: 令牌无法解析或不属于当前查询
+    """
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        payload = bson.decode(raw)
+    except (binascii.Error, ValueError, bson.errors.InvalidBSON) as e:
+        raise PageTokenError(f"无效的分页令牌: {e}")
+    if payload.get("f") != fingerprint:
+        raise PageTokenError("分页令牌与当前查询条件、投影或排序不匹配")
+    return payload["v"]
+
+
+def _get_path(document: Dict[str, Any], path: str) -> Any:
+    """按点号路径取值，字段不存在时返回None（与MongoDB排序时缺失字段视为null一致）"""
+    value: Any = document
+    for part in path.split("."):
+        if isinstance(value, list):
+            raise PageTokenError(f"键集分页不支持数组类型的排序字段: {path}")
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    if isinstance(value, list):
+        raise PageTokenError(f"键集分页不支持数组类型的排序字段: {path}")
+    return value
+
+
+def _type_bracket(value: Any) -> str:
+    """范围比较时可以互相比较的类型类别（各种数字类型是同一类）"""
+    if isinstance(value, bool):
+        return "bool"
+    if isinstance(value, (int, float, Int64, Decimal128, Decimal)):
+        return "number"
+    return type(value).__name__
+
+
+def _pop_path(document: Dict[str, Any], path: str):
+    parts = path.split(".")
+    for part in parts[:-1]:
+        document = document.get(part)
+        if not isinstance(document, dict):
+            return
+    document.pop(parts[-1], None)
+
+
+def sort_values(document: Dict[str, Any], sort_spec: List[Tuple[str, int]]) -> List[Any]:
+    """取出文档在各排序字段上的值"""
+    return [_get_path(document, field) for field, _ in sort_spec]
+
+
+def check_sort_types(documents: List[Dict[str, Any]], sort_spec: List[Tuple[str, int]]):
+    """
+    检查本页文档的排序字段：不能是数组，同一字段的非null值必须是同一类类型
+
+    Raises:
+        PageTokenError: 排序字段不能用于键集分页
+    """
+    brackets: Dict[str, str] = {}
+    for document in documents:
+        for (field, _), value in zip(sort_spec, sort_values(document, sort_spec)):
+            if value is None:
+                continue
+            bracket = _type_bracket(value)
+            if brackets.setdefault(field, bracket) != bracket:
+                raise PageTokenError(
+                    f"键集分页要求排序字段的类型一致，字段 {field} 同时包含 {brackets[field]} 和 {bracket} 类型"
+                )
+
+
+def _beyond(field: str, direction: int, value: Any) -> Optional[Dict[str, Any]]:
+    """
+    排在value之后的条件；null（或缺失）在升序中最小、在降序中最大
+
+    Returns:
+        Dict: 查询条件，没有任何值能排在value之后时返回None
+    """
+    if direction == 1:
+        if value is None:
+            return {field: {"$ne": None}}
+        return {field: {"$gt": value}}
+    if value is None:
+        return None
+    return {"$or": [{field: {"$lt": value}}, {field: None}]}
+
+
+def keyset_filter(sort_spec: List[Tuple[str, int]], values: List[Any]) -> Optional[Dict[str, Any]]:
+    """
+    生成“排在上一页最后一个文档之后”的范围条件
+
+    排序 [(a, 1), (b, -1), (_id, 1)] 对应：
+    a > va 或 (a = va 且 b < vb) 或 (a = va 且 b = vb 且 _id > vid)
+
+    Args:
+        sort_spec: keyset_sort生成的排序
+        values: 上一页最后一个文档的排序键
+
+    Returns:
+        Dict: 范围条件，已没有后续文档时返回None
+    """
+    if len(values) != len(sort_spec):
+        raise PageTokenError("分页令牌与排序字段数量不一致")
+
+    clauses = []
+    for index, (field, direction) in enumerate(sort_spec):
+        beyond = _beyond(field, direction, values[index])
+        if beyond is None:
+            continue
+        equal = {sort_spec[i][0]: values[i] for i in range(index)}
+        clauses.append({**equal, **beyond})
+    if not clauses:
+        return None
+    return clauses[0] if len(clauses) == 1 else {"$or": clauses}
+
+
+def keyset_projection(projection: Optional[Dict[str, Any]],
+                      sort_fields: List[str]) -> Tuple[Optional[Dict[str, Any]], List[str]]:
+    """
+    确保投影结果中包含生成令牌所需的排序字段
+
+    Args:
+        projection: 用户的投影
+        sort_fields: 排序字段（含_id）
+
+    Returns:
+        Tuple: (实际查询使用的投影, 返回前需要删除的字段)
+    """
+    if not projection:
+        return None, []
+
+    query_projection = dict(projection)
+    inclusion = any(value not in (0, False) for key, value in projection.items() if key != "_id")
+    hidden = []
+    for field in sort_fields:
+        if field == "_id":
+            if query_projection.get("_id", 1) in (0, False):
+                query_projection.pop("_id")
+                hidden.append(field)
+        elif inclusion and not any(field == key or field.startswith(f"{key}.") for key in query_projection):
+            query_projection[field] = 1
+            hidden.append(field)
+        elif not inclusion and field in query_projection:
+            query_projection.pop(field)
+            hidden.append(field)
+    if not query_projection:
+        query_projection = None
+    return query_projection, hidden
+
+
+def page_query(namespace: str,
+               query_filter: Optional[Dict[str, Any]],
+               projection: Optional[Dict[str, Any]],
+               sort: Optional[List[Tuple[str, Any]]],
+               page_token: Optional[str]) -> Dict[str, Any]:
+    """
+    构造一页查询的参数
+
+    Returns:
+        Dict: filter、projection、sort、hidden_fields、fingerprint；filter为None表示已没有后续文档
+    """
+    sort_spec = keyset_sort(sort)
+    fingerprint = page_fingerprint(namespace, query_filter, projection, sort_spec)
+    effective_filter = query_filter or {}
+    if page_token:
+        predicate = keyset_filter(sort_spec, decode_page_token(page_token, fingerprint))
+        if predicate is None:
+            effective_filter = None
+        elif effective_filter:
+            effective_filter = {"$and": [effective_filter, predicate]}
+        else:
+            effective_filter = predicate
+    query_projection, hidden_fields = keyset_projection(projection, [field for field, _ in sort_spec])
+    return {
+        "filter": effective_filter,
+        "projection": query_projection,
+        "sort": sort_spec,
+        "hidden_fields": hidden_fields,
+        "fingerprint": fingerprint
+    }
+
+
+def finish_page(documents: List[Dict[str, Any]], limit: int, query: Dict[str, Any]) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """
+    处理多取一条的查询结果：生成下一页令牌，删除为生成令牌而额外投影的字段
+
+    Args:
+        documents: 按limit + 1查询到的文档
+        limit: 每页文档数量
+        query: page_query的返回值
+
+    Returns:
+        Tuple: (本页文档, 下一页令牌)，没有下一页时令牌为None
+    """
+    check_sort_types(documents, query["sort"])
+    next_page_token = None
+    if len(documents) > limit:
+        documents = documents[:limit]
+        next_page_token = encode_page_token(query["fingerprint"], sort_values(documents[-1], query["sort"]))
+    for document in documents:
+        for field in query["hidden_fields"]:
+            _pop_path(document, field)
+    return documents, next_page_token
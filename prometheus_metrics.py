@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Prometheus指标（/metrics）
+
+- HTTP：按路由（路径模板，如 /cursor/{cursor_id}）统计请求数、延迟和响应字节数
+- MongoDB：连接池中缓存的客户端数量、使用中的客户端数量，以及pymongo连接池的连接数和获取连接失败次数
+- 缓存：进程内缓存（l1_local）和Redis（l2_redis）的命中/未命中/错误次数
+- 序列化：响应编码耗时（json/arrow/parquet）
+
+多进程：gunicorn启动多个工作进程时设置 PROMETHEUS_MULTIPROC_DIR，每个进程把指标写入该目录下的mmap文件，
+任意一个进程响应/metrics时汇总所有进程的指标；gunicorn.conf.py在启动时清空目录，在工作进程退出时标记该进程，
+其仪表盘类指标（连接数等）不再计入。目录必须在导入本模块之前通过环境变量设置
+"""
+
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Tuple
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+)
+from prometheus_client.openmetrics.exposition import (
+    CONTENT_TYPE_LATEST as OPENMETRICS_CONTENT_TYPE, generate_latest as generate_openmetrics
+)
+from pymongo import monitoring
+from config import Config
+
+prometheus_config = Config.get_prometheus_config()
+
+NAMESPACE = "mongodb_api"
+
+# 路由不匹配（404）的请求统一使用的标签，避免任意路径产生大量时间序列
+UNMATCHED_ROUTE = "unmatched"
+
+HTTP_REQUESTS = Counter(
+    "http_requests", "HTTP请求数", ["method", "route", "status"], namespace=NAMESPACE
+)
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "HTTP请求耗时（到响应体发送完毕）", ["method", "route"], namespace=NAMESPACE,
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+)
+HTTP_RESPONSE_SIZE = Histogram(
+    "http_response_size_bytes", "HTTP响应体字节数（压缩后）", ["route"], namespace=NAMESPACE,
+    buckets=(256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216, 67108864)
+)
+HTTP_REQUESTS_IN_PROGRESS = Gauge(
+    "http_requests_in_progress", "正在处理的HTTP请求数", ["method"], namespace=NAMESPACE,
+    multiprocess_mode="livesum"
+)
+SERIALIZATION_DURATION = Histogram(
+    "serialization_duration_seconds", "响应编码耗时", ["format"], namespace=NAMESPACE,
+    buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1)
+)
+CACHE_REQUESTS = Counter(
+    "cache_requests", "缓存读取次数", ["tier", "result"], namespace=NAMESPACE
+)
+MONGO_CLIENTS = Gauge(
+    "mongo_clients", "连接池中缓存的MongoClient数量", ["pool", "state"], namespace=NAMESPACE,
+    multiprocess_mode="livesum"
+)
+MONGO_CONNECTIONS = Gauge(
+    "mongo_connections", "pymongo连接池中的连接数（open为已建立，checked_out为正在使用）", ["state"],
+    namespace=NAMESPACE, multiprocess_mode="livesum"
+)
+MONGO_CHECKOUT_FAILURES = Counter(
+    "mongo_connection_checkout_failures", "从pymongo连接池获取连接失败的次数", ["reason"], namespace=NAMESPACE
+)
+
+
+def cache_counters(tier: str, results: Tuple[str, ...] = ("hits", "misses", "errors")) -> Dict[str, Any]:
+    """
+    某一级缓存的计数器
+
+    Args:
+        tier: l1_local或l2_redis
+        results: 需要统计的结果类型
+
+    Returns:
+        Dict: 结果类型 -> 已绑定标签的计数器（避免每次计数都查找标签）
+    """
+    return {result: CACHE_REQUESTS.labels(tier=tier, result=result) for result in results}
+
+
+def set_client_gauges(pool: str, clients: int, in_use: int):
+    """更新MongoClient连接池的客户端数量"""
+    MONGO_CLIENTS.labels(pool=pool, state="cached").set(clients)
+    MONGO_CLIENTS.labels(pool=pool, state="in_use").set(in_use)
+
+
+@contextmanager
+def observe_serialization(result_format: str) -> Iterator[None]:
+    """统计代码块的编码耗时"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        SERIALIZATION_DURATION.labels(format=result_format).observe(time.perf_counter() - start)
+
+
+def route_label(scope: Dict[str, Any]) -> str:
+    """请求匹配到的路由的路径模板（FastAPI在路由匹配时把路由写入scope）"""
+    route = scope.get("route")
+    if route is not None:
+        return route.path_format
+    # /docs、/openapi.json等Starlette路由没有路径参数，直接使用请求路径
+    return scope["path"] if "endpoint" in scope else UNMATCHED_ROUTE
+
+
+def record_http_request(scope: Dict[str, Any], status: int, seconds: float, response_length: int):
+    """记录一个已完成的HTTP请求"""
+    route = route_label(scope)
+    method = scope["method"]
+    HTTP_REQUESTS.labels(method=method, route=route, status=str(status)).inc()
+    HTTP_REQUEST_DURATION.labels(method=method, route=route).observe(seconds)
+    HTTP_RESPONSE_SIZE.labels(route=route).observe(response_length)
+
+
+class ConnectionPoolMetrics(monitoring.ConnectionPoolListener):
+    """pymongo连接池事件 -> 连接数指标（注册到MongoClient的event_listeners）"""
+
+    def __init__(self):
+        self.open = MONGO_CONNECTIONS.labels(state="open")
+        self.checked_out = MONGO_CONNECTIONS.labels(state="checked_out")
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self.open.inc()
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self.open.dec()
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        MONGO_CHECKOUT_FAILURES.labels(reason=str(event.reason)).inc()
+
+    def connection_checked_out(self, event):
+        self.checked_out.inc()
+
+    def connection_checked_in(self, event):
+        self.checked_out.dec()
+
+
+def render_metrics(accept: str = "") -> Tuple[bytes, str]:
+    """
+    生成/metrics的内容
+
+    Args:
+        accept: 请求的Accept头，包含application/openmetrics-text时使用OpenMetrics格式
+
+    Returns:
+        Tuple: (内容, Content-Type)
+    """
+    if prometheus_config["multiproc_dir"]:
+        # 每次抓取时汇总所有进程写入的指标文件
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    if "application/openmetrics-text" in accept:
+        return generate_openmetrics(registry), OPENMETRICS_CONTENT_TYPE
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+# 全局实例，所有MongoClient共用
+connection_pool_metrics = ConnectionPoolMetrics()
@@ -0,0 +1,367 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+按查询形状的耗时统计与慢查询日志
+
+- 查询形状：去掉query_filter、pipeline中的字面量值（替换为"?"），只保留字段、操作符和管道结构，
+  值不同但结构相同的查询归为同一种形状
+- 每种形状统计：HDR风格的延迟直方图（p50/p90/p99）、返回文档数量、缓存命中率、各阶段平均耗时
+- 耗时超过阈值的请求写入慢查询日志：完整请求（连接字符串替换为不含密码的集群标识）和分阶段耗时
+  （cache_lookup读缓存、connect获取连接、execute执行查询、serialize编码响应）
+
+当前请求的统计对象通过ContextVar传递，run_query、cached_query_result等只需用timed()包住各个阶段；
+启用追踪时各阶段同时是请求span的子span
+"""
+
+import json
+import logging
+import math
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional
+from config import Config
+from cache_keys import cluster_id, hash_payload, normalize_filter
+from tracing import span
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 分阶段耗时的阶段名
+PHASES = ("cache_lookup", "connect", "execute", "serialize")
+
+
+def _dumps(value: Any) -> str:
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False, default=str)
+
+
+def _strip_literals(value: Any, in_pipeline: bool) -> Any:
+    """
+    把字面量替换为"?"
+
+    数组只保留不同形状的元素（$in传3个值还是30个值是同一种形状）；查询条件中的数组顺序不影响形状，
+    管道中的数组保持顺序。管道中以$开头的字符串是字段路径，保留
+    """
+    if isinstance(value, dict):
+        return {key: _strip_literals(item, in_pipeline) for key, item in value.items()}
+    if isinstance(value, list):
+        items: Dict[str, Any] = {}
+        for item in value:
+            stripped = _strip_literals(item, in_pipeline)
+            items.setdefault(_dumps(stripped), stripped)
+        return list(items.values()) if in_pipeline else [items[key] for key in sorted(items)]
+    if in_pipeline and isinstance(value, str) and value.startswith("$"):
+        return value
+    return "?"
+
+
+def filter_shape(query_filter: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """查询条件的形状，如 {"age": {"$gte": 25}, "status": "active"} -> {"age": {"$gte": "?"}, "status": "?"}"""
+    return _strip_literals(normalize_filter(query_filter), False)
+
+
+def pipeline_shape(pipeline: Optional[List[Dict[str, Any]]]) -> List[Any]:
+    """聚合管道的形状：$match按查询条件处理，其余阶段保留结构和字段路径"""
+    shape = []
+    for stage in pipeline or []:
+        if isinstance(stage, dict) and len(stage) == 1 and "$match" in stage:
+            shape.append({"$match": filter_shape(stage["$match"])})
+        else:
+            shape.append(_strip_literals(stage, True))
+    return shape
+
+
+def request_shape(op: str, request: Any) -> Dict[str, Any]:
+    """
+    请求的查询形状
+
+    Args:
+        op: 操作类型（query、query_one、aggregate、distinct）
+        request: 请求模型
+
+    Returns:
+        Dict: 操作类型、集合和去掉字面量后的查询结构
+    """
+    shape = {"op": op, "namespace": f"{request.database_name}.{request.collection_name}"}
+    if op == "aggregate":
+        shape["pipeline"] = pipeline_shape(request.pipeline)
+        return shape
+    shape["filter"] = filter_shape(request.query_filter)
+    if op == "distinct":
+        shape["field"] = request.field
+    elif request.sort:
+        shape["sort"] = [list(item) for item in request.sort]
+    if getattr(request, "paginate", False) or getattr(request, "page_token", None):
+        shape["paginate"] = True
+    return shape
+
+
+class LatencyHistogram:
+    """
+    HDR风格的延迟直方图（按微秒记录）
+
+    每个2的幂区间分为128个线性子桶，任意取值的相对误差小于1%；桶按需创建，只占用出现过的区间
+    """
+
+    SUB_BUCKET_HALF_MAGNITUDE = 7
+    SUB_BUCKET_MASK = (1 << (SUB_BUCKET_HALF_MAGNITUDE + 1)) - 1
+
+    def __init__(self):
+        self.counts: Dict[int, int] = {}
+        self.count = 0
+        self.total_us = 0
+        self.min_us: Optional[int] = None
+        self.max_us = 0
+
+    @classmethod
+    def _index(cls, value: int) -> int:
+        bucket = max(0, (value | cls.SUB_BUCKET_MASK).bit_length() - cls.SUB_BUCKET_HALF_MAGNITUDE - 1)
+        return (bucket << cls.SUB_BUCKET_HALF_MAGNITUDE) + (value >> bucket)
+
+    @classmethod
+    def _highest_value(cls, index: int) -> int:
+        """桶内的最大值"""
+        bucket = max(0, (index >> cls.SUB_BUCKET_HALF_MAGNITUDE) - 1)
+        sub_bucket = index - (bucket << cls.SUB_BUCKET_HALF_MAGNITUDE)
+        return ((sub_bucket + 1) << bucket) - 1
+
+    def record(self, seconds: float):
+        value = max(0, int(seconds * 1_000_000))
+        index = self._index(value)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        self.total_us += value
+        self.min_us = value if self.min_us is None else min(self.min_us, value)
+        self.max_us = max(self.max_us, value)
+
+    def percentile(self, percent: float) -> float:
+        """
+        百分位耗时（毫秒）
+
+        Args:
+            percent: 百分位，如99表示p99
+        """
+        if not self.count:
+            return 0.0
+        target = max(1, math.ceil(percent / 100 * self.count))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= target:
+                return round(min(self._highest_value(index), self.max_us) / 1000, 3)
+        return round(self.max_us / 1000, 3)
+
+    def summary(self) -> Dict[str, float]:
+        return {
+            "mean_ms": round(self.total_us / self.count / 1000, 3) if self.count else 0.0,
+            "min_ms": round((self.min_us or 0) / 1000, 3),
+            "p50_ms": self.percentile(50),
+            "p90_ms": self.percentile(90),
+            "p99_ms": self.percentile(99),
+            "max_ms": round(self.max_us / 1000, 3)
+        }
+
+
+class QueryTrace:
+    """一次查询请求的统计：开始时间、各阶段耗时和结果"""
+
+    def __init__(self, op: str, request: Any):
+        self.op = op
+        self.request = request
+        self.start = time.perf_counter()
+        self.phases: Dict[str, float] = {}
+        self.status = None
+        self.documents = 0
+        self.finished = False
+
+    def add(self, phase: str, seconds: float):
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    def set_result(self, result: Dict[str, Any]):
+        """记录结果状态和返回的文档数量"""
+        self.status = result.get("status")
+        data = result.get("data")
+        if "count" in result:
+            self.documents = result["count"] or 0
+        elif isinstance(data, dict) and "values" in data:
+            # distinct返回唯一值的数量
+            self.documents = data.get("count") or 0
+        else:
+            self.documents = 0 if data is None else 1
+
+    @property
+    def cache_hit(self) -> bool:
+        """没有连接数据库且没有出错即视为命中（包括合并到其他请求的查询）"""
+        return "connect" not in self.phases and self.status != "error"
+
+
+class ShapeStats:
+    """一种查询形状的累计统计"""
+
+    def __init__(self, shape_id: str, shape: Dict[str, Any]):
+        self.shape_id = shape_id
+        self.shape = shape
+        self.latency = LatencyHistogram()
+        self.errors = 0
+        self.cache_hits = 0
+        self.documents = 0
+        self.max_documents = 0
+        self.phase_seconds = {phase: 0.0 for phase in PHASES}
+        self.slow = 0
+        self.last_seen = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        count = self.latency.count
+        return {
+            "shape_id": self.shape_id,
+            **self.shape,
+            "count": count,
+            "errors": self.errors,
+            "slow": self.slow,
+            "cache_hit_ratio": round(self.cache_hits / count, 4) if count else 0.0,
+            "documents_returned": self.documents,
+            "avg_documents": round(self.documents / count, 2) if count else 0.0,
+            "max_documents": self.max_documents,
+            "latency": self.latency.summary(),
+            "avg_phase_ms": {
+                phase: round(seconds / count * 1000, 3) if count else 0.0 for phase, seconds in self.phase_seconds.items()
+            },
+            "total_time_ms": round(self.latency.total_us / 1000, 3),
+            "last_seen": self.last_seen
+        }
+
+
+# 当前请求的统计对象，不在统计中的请求为None
+_current_trace: ContextVar[Optional[QueryTrace]] = ContextVar("query_trace", default=None)
+
+
+@contextmanager
+def timed(phase: str) -> Iterator[None]:
+    """
+    把代码块的耗时计入当前请求的某个阶段（没有正在统计的请求时不计时）
+
+    启用追踪时同时创建以阶段命名的子span
+    """
+    trace = _current_trace.get()
+    with span(phase):
+        if trace is None or trace.finished:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            trace.add(phase, time.perf_counter() - start)
+
+
+class QueryMetrics:
+    """
+    查询形状统计
+
+    - observe包住一次请求，结束时计入对应形状的统计，超过阈值时写入慢查询日志
+    - 形状数量有上限，超出时淘汰最久未出现的形状；统计保存在工作进程内存中
+    """
+
+    def __init__(self, metrics_config: Dict[str, Any] = None):
+        metrics_config = metrics_config or Config.get_query_metrics_config()
+        self.enabled = metrics_config["enabled"]
+        self.max_shapes = metrics_config["max_shapes"]
+        self.slow_query_ms = metrics_config["slow_query_ms"]
+        self._shapes: "OrderedDict[str, ShapeStats]" = OrderedDict()
+        self._slow_queries: deque = deque(maxlen=metrics_config["slow_log_size"])
+
+    @contextmanager
+    def observe(self, op: str, request: Any) -> Iterator[Optional[QueryTrace]]:
+        """
+        统计一次查询请求，代码块中调用trace.set_result记录结果
+
+        Args:
+            op: 操作类型（query、query_one、aggregate、distinct）
+            request: 请求模型
+        """
+        if not self.enabled:
+            yield None
+            return
+        trace = QueryTrace(op, request)
+        token = _current_trace.set(trace)
+        try:
+            yield trace
+        finally:
+            _current_trace.reset(token)
+            trace.finished = True
+            try:
+                self._record(trace, time.perf_counter() - trace.start)
+            except Exception as e:
+                # 统计失败不影响请求
+                logger.error(f"记录查询统计失败: {e}")
+
+    def _record(self, trace: QueryTrace, seconds: float):
+        shape = request_shape(trace.op, trace.request)
+        shape_id = hash_payload(_dumps(shape))[:16]
+        stats = self._shapes.get(shape_id)
+        if stats is None:
+            stats = self._shapes[shape_id] = ShapeStats(shape_id, shape)
+            if len(self._shapes) > self.max_shapes:
+                self._shapes.popitem(last=False)
+        else:
+            self._shapes.move_to_end(shape_id)
+
+        stats.latency.record(seconds)
+        stats.last_seen = datetime.now().isoformat()
+        if trace.status == "error":
+            stats.errors += 1
+        if trace.cache_hit:
+            stats.cache_hits += 1
+        stats.documents += trace.documents
+        stats.max_documents = max(stats.max_documents, trace.documents)
+        for phase, phase_seconds in trace.phases.items():
+            stats.phase_seconds[phase] = stats.phase_seconds.get(phase, 0.0) + phase_seconds
+
+        total_ms = seconds * 1000
+        if self.slow_query_ms and total_ms >= self.slow_query_ms:
+            stats.slow += 1
+            self._log_slow_query(trace, shape_id, total_ms)
+
+    def _log_slow_query(self, trace: QueryTrace, shape_id: str, total_ms: float):
+        request = trace.request.dict()
+        # 不保存明文凭据
+        request["connection_string"] = cluster_id(request["connection_string"])
+        entry = {
+            "timestamp": datetime.now().isoformat(),
+            "op": trace.op,
+            "shape_id": shape_id,
+            "total_ms": round(total_ms, 3),
+            "phases_ms": {phase: round(seconds * 1000, 3) for phase, seconds in trace.phases.items()},
+            "status": trace.status,
+            "documents": trace.documents,
+            "cache_hit": trace.cache_hit,
+            "request": request
+        }
+        self._slow_queries.append(entry)
+        logger.warning(f"慢查询 ({entry['total_ms']}ms): {_dumps(entry)}")
+
+    def get_stats(self, limit: int = None) -> Dict[str, Any]:
+        """
+        各查询形状的统计，按累计耗时从高到低排列
+
+        Args:
+            limit: 最多返回的形状数量
+        """
+        shapes = sorted(self._shapes.values(), key=lambda stats: stats.latency.total_us, reverse=True)
+        return {
+            "enabled": self.enabled,
+            "slow_query_ms": self.slow_query_ms,
+            "shapes_tracked": len(self._shapes),
+            "shapes": [stats.to_dict() for stats in shapes[:limit]]
+        }
+
+    def get_slow_queries(self, limit: int = None) -> List[Dict[str, Any]]:
+        """最近的慢查询，最新的在前"""
+        return list(reversed(self._slow_queries))[:limit]
+
+
+# 全局实例
+query_metrics = QueryMetrics()
@@ -0,0 +1,466 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+执行计划分析与索引建议
+
+- summarize_plan: 从explain输出中提取胜出计划的摘要（COLLSCAN还是IXSCAN、使用的索引、扫描的键和文档数量）
+- IndexAdvisor: 按集合统计/query、/query_one、/aggregate、/distinct的查询形状（哪些字段做等值匹配、排序、范围匹配），
+  按ESR规则（等值 -> 排序 -> 范围）推荐复合索引，并对集合抽样估算每个索引条件的选择性
+
+查询形状保存在工作进程内存中，只记录字段和操作符类别；每种形状另外保存最近一次的条件值，用于估算选择性
+"""
+
+import logging
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+from pymongo.errors import OperationFailure
+from config import Config
+from cache_keys import cluster_id
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 使用索引的扫描阶段
+INDEX_SCAN_STAGES = {"IXSCAN", "EXPRESS_IXSCAN", "IDHACK", "EXPRESS_IDHACK", "COUNT_SCAN", "DISTINCT_SCAN"}
+
+# 视为等值匹配的操作符，其余操作符（$gt、$ne、$regex、$exists等）视为范围匹配
+EQUALITY_OPERATORS = {"$eq", "$in"}
+
+
+def _walk_plan(plan: Any, stages: List[str], indexes: List[Dict[str, Any]]):
+    """深度优先遍历计划树，按从上到下的顺序收集阶段名和使用的索引"""
+    if not isinstance(plan, dict):
+        return
+    if "queryPlan" in plan:
+        # 基于槽的执行引擎（SBE）把计划树放在queryPlan中
+        _walk_plan(plan["queryPlan"], stages, indexes)
+        return
+    stage = plan.get("stage")
+    if stage:
+        stages.append(stage)
+        if stage in INDEX_SCAN_STAGES:
+            indexes.append({
+                "name": plan.get("indexName", "_id_" if "IDHACK" in stage else None),
+                "key_pattern": plan.get("keyPattern")
+            })
+    _walk_plan(plan.get("inputStage"), stages, indexes)
+    for child in plan.get("inputStages", []):
+        _walk_plan(child, stages, indexes)
+    # 分片集群：每个分片各有一个胜出计划
+    for shard in plan.get("shards", []):
+        _walk_plan(shard.get("winningPlan"), stages, indexes)
+
+
+def _plan_sections(explain: Dict[str, Any]) -> List[Tuple[Dict[str, Any], Dict[str, Any]]]:
+    """
+    找出explain输出中的 (queryPlanner, executionStats)
+
+    find和下推到查询层的聚合在顶层；其余聚合在第一个阶段的$cursor中；分片集群上的聚合按分片分别给出
+    """
+    if "queryPlanner" in explain:
+        return [(explain["queryPlanner"], explain.get("executionStats") or {})]
+    for stage in explain.get("stages", []):
+        if "$cursor" in stage:
+            return _plan_sections(stage["$cursor"])
+    sections = []
+    for shard in explain.get("shards", {}).values():
+        sections.extend(_plan_sections(shard))
+    return sections
+
+
+def _total(sections: List[Tuple[Dict[str, Any], Dict[str, Any]]], field: str) -> Optional[int]:
+    values = [stats[field] for _, stats in sections if field in stats]
+    return sum(values) if values else None
+
+
+def summarize_plan(explain: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    提取胜出计划的摘要
+
+    Args:
+        explain: find游标explain()或explain命令的输出
+
+    Returns:
+        Dict: plan（COLLSCAN、IXSCAN或没有扫描阶段时的顶层阶段）、collection_scan、stages（从上到下的阶段名）、
+              indexes（使用的索引）、in_memory_sort、rejected_plans；包含执行统计时另有keys_examined、
+              docs_examined、returned、execution_time_ms、docs_examined_per_returned
+    """
+    sections = _plan_sections(explain)
+    stages: List[str] = []
+    indexes: List[Dict[str, Any]] = []
+    for planner, _ in sections:
+        _walk_plan(planner.get("winningPlan"), stages, indexes)
+
+    collection_scan = "COLLSCAN" in stages
+    if collection_scan:
+        plan = "COLLSCAN"
+    elif indexes:
+        plan = "IXSCAN"
+    else:
+        plan = stages[0] if stages else None
+
+    summary = {
+        "plan": plan,
+        "collection_scan": collection_scan,
+        "stages": stages,
+        "indexes": indexes,
+        "in_memory_sort": "SORT" in stages,
+        "rejected_plans": sum(len(planner.get("rejectedPlans", [])) for planner, _ in sections)
+    }
+    returned = _total(sections, "nReturned")
+    if returned is not None:
+        docs_examined = _total(sections, "totalDocsExamined")
+        summary.update({
+            "keys_examined": _total(sections, "totalKeysExamined"),
+            "docs_examined": docs_examined,
+            "returned": returned,
+            # 分片并行执行，耗时取最慢的分片
+            "execution_time_ms": max(stats.get("executionTimeMillis", 0) for _, stats in sections),
+            "docs_examined_per_returned": round((docs_examined or 0) / max(returned, 1), 2)
+        })
+    return summary
+
+
+def _is_operator_document(value: Any) -> bool:
+    return isinstance(value, dict) and bool(value) and all(str(key).startswith("$") for key in value)
+
+
+def _collect_predicates(query_filter: Dict[str, Any], predicates: List[Tuple[str, Any]]):
+    """收集可以用索引的字段条件：顶层字段和$and中的字段（$or、$expr、$text等不参与索引建议）"""
+    for field, condition in query_filter.items():
+        if field == "$and":
+            for clause in condition:
+                if isinstance(clause, dict):
+                    _collect_predicates(clause, predicates)
+        elif not field.startswith("$"):
+            predicates.append((field, condition))
+
+
+def pipeline_shape(pipeline: List[Dict[str, Any]]) -> Tuple[Dict[str, Any], Optional[List[List[Any]]]]:
+    """
+    聚合管道开头可以用索引的部分：连续的$match合并为查询条件，紧随其后的$sort作为排序
+
+    Returns:
+        Tuple: (查询条件, 排序条件)，格式与/query的query_filter、sort相同
+    """
+    matches = []
+    sort = None
+    for stage in pipeline:
+        if "$match" in stage:
+            matches.append(stage["$match"])
+            continue
+        if "$sort" in stage:
+            sort = [[field, direction] for field, direction in stage["$sort"].items()]
+        break
+    query_filter = matches[0] if len(matches) == 1 else {"$and": matches} if matches else {}
+    return query_filter, sort
+
+
+class QueryShape:
+    """一种查询形状：等值字段、排序和范围字段相同的查询"""
+
+    def __init__(self, equality: Tuple[str, ...], sort: Tuple[Tuple[str, int], ...], ranges: Tuple[str, ...]):
+        self.equality = equality
+        self.sort = sort
+        self.ranges = ranges
+        self.count = 0
+        self.last_seen = None
+        # 最近一次查询中可以用索引的条件，用于估算选择性和查看当前的执行计划
+        self.sample_filter: Dict[str, Any] = {}
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "equality": list(self.equality),
+            "sort": [[field, direction] for field, direction in self.sort],
+            "range": list(self.ranges)
+        }
+
+    def recommended_index(self, cardinality: Dict[str, int]) -> List[Tuple[str, int]]:
+        """
+        按ESR规则生成索引键：等值字段（抽样中不同值多的在前） -> 排序字段 -> 范围字段
+
+        Args:
+            cardinality: 字段 -> 抽样中不同值的数量
+        """
+        keys = [(field, 1) for field in sorted(self.equality, key=lambda field: -cardinality.get(field, 0))]
+        used = set(self.equality)
+        for field, direction in self.sort:
+            if field not in used:
+                keys.append((field, direction))
+                used.add(field)
+        keys.extend((field, 1) for field in self.ranges if field not in used)
+        return keys
+
+
+def query_shape(query_filter: Optional[Dict[str, Any]],
+                sort: Optional[List[List[Any]]] = None) -> Optional[Tuple[QueryShape, Dict[str, Any]]]:
+    """
+    提取查询形状
+
+    Args:
+        query_filter: 查询条件
+        sort: 排序条件，格式：[['字段名', 1或-1]]
+
+    Returns:
+        Tuple: (形状, 可以用索引的条件)，没有可以用索引的字段和排序时返回None
+    """
+    predicates: List[Tuple[str, Any]] = []
+    _collect_predicates(query_filter or {}, predicates)
+    equality, ranges = set(), set()
+    for field, condition in predicates:
+        if _is_operator_document(condition) and not set(condition) <= EQUALITY_OPERATORS:
+            ranges.add(field)
+        else:
+            equality.add(field)
+    # 文本索引、地理索引等特殊排序不参与建议
+    sort_keys = tuple(
+        (str(item[0]), item[1]) for item in (sort or []) if len(item) == 2 and item[1] in (1, -1)
+    )
+    if not equality and not ranges and not sort_keys:
+        return None
+    shape = QueryShape(tuple(sorted(equality)), sort_keys, tuple(sorted(ranges - equality)))
+    sample_filter = {"$and": [{field: condition} for field, condition in predicates]} if predicates else {}
+    return shape, sample_filter
+
+
+def _serves(index_key: List[Tuple[str, Any]], shape: QueryShape) -> bool:
+    """已有索引是否可以按ESR规则服务该形状（等值字段、范围字段内部的顺序不限，排序方向一致或全部相反）"""
+    position = len(shape.equality)
+    if {field for field, _ in index_key[:position]} != set(shape.equality):
+        return False
+
+    sort = [(field, direction) for field, direction in shape.sort if field not in shape.equality]
+    segment = index_key[position:position + len(sort)]
+    if [field for field, _ in segment] != [field for field, _ in sort]:
+        return False
+    directions = [direction * expected for (_, direction), (_, expected) in zip(segment, sort)]
+    if len(set(directions)) > 1:
+        return False
+    position += len(sort)
+
+    ranges = {field for field in shape.ranges} - {field for field, _ in sort}
+    return {field for field, _ in index_key[position:position + len(ranges)]} == ranges
+
+
+class IndexAdvisor:
+    """
+    索引建议
+
+    - record记录每个查询的形状（每个工作进程按集合分别统计，形状和集合数量有上限，超出时淘汰最久未出现的）
+    - advise对集合抽样，给出查询次数最多的形状的推荐索引、估算选择性、当前执行计划和已有的可用索引
+    """
+
+    def __init__(self, advisor_config: Dict[str, Any] = None):
+        advisor_config = advisor_config or Config.get_index_advisor_config()
+        self.max_namespaces = advisor_config["max_namespaces"]
+        self.max_shapes = advisor_config["max_shapes"]
+        self.sample_size = advisor_config["sample_size"]
+        self.max_recommendations = advisor_config["max_recommendations"]
+        # 集合 -> {形状键: QueryShape}，按最近出现的顺序排列
+        self._namespaces: "OrderedDict[str, OrderedDict[tuple, QueryShape]]" = OrderedDict()
+
+    @staticmethod
+    def namespace(connection_string: str, database_name: str, collection_name: str) -> str:
+        """集合标识（不含用户名和密码）"""
+        return f"{cluster_id(connection_string)}/{database_name}.{collection_name}"
+
+    def record(self,
+               connection_string: str,
+               database_name: str,
+               collection_name: str,
+               query_filter: Optional[Dict[str, Any]],
+               sort: Optional[List[List[Any]]] = None):
+        """
+        记录一次查询的形状
+
+        Args:
+            connection_string: MongoDB连接字符串
+            database_name: 数据库名称
+            collection_name: 集合名称
+            query_filter: 查询条件
+            sort: 排序条件，格式：[['字段名', 1或-1]]
+        """
+        extracted = query_shape(query_filter, sort)
+        if extracted is None:
+            return
+        shape, sample_filter = extracted
+        key = (shape.equality, shape.sort, shape.ranges)
+
+        namespace = self.namespace(connection_string, database_name, collection_name)
+        shapes = self._namespaces.get(namespace)
+        if shapes is None:
+            shapes = self._namespaces[namespace] = OrderedDict()
+            if len(self._namespaces) > self.max_namespaces:
+                self._namespaces.popitem(last=False)
+        else:
+            self._namespaces.move_to_end(namespace)
+
+        existing = shapes.get(key)
+        if existing is None:
+            existing = shapes[key] = shape
+            if len(shapes) > self.max_shapes:
+                shapes.popitem(last=False)
+        else:
+            shapes.move_to_end(key)
+        existing.count += 1
+        existing.last_seen = datetime.now().isoformat()
+        existing.sample_filter = sample_filter
+
+    def shapes(self, connection_string: str, database_name: str, collection_name: str) -> List[QueryShape]:
+        """集合的查询形状，按查询次数从多到少排列"""
+        shapes = self._namespaces.get(self.namespace(connection_string, database_name, collection_name), {})
+        return sorted(shapes.values(), key=lambda shape: shape.count, reverse=True)
+
+    @staticmethod
+    async def _sample_statistics(collection: Any,
+                                 shapes: List[QueryShape],
+                                 sample_size: int) -> Tuple[int, List[Optional[int]], Dict[str, int]]:
+        """
+        一次抽样统计：抽样文档数、每种形状的条件匹配的文档数、等值字段不同值的数量
+
+        条件为空的形状（只有排序）匹配所有文档，不单独统计
+        """
+        fields = sorted({field for shape in shapes for field in shape.equality})
+        facets: Dict[str, List[Dict[str, Any]]] = {"sampled": [{"$count": "n"}]}
+        for index, shape in enumerate(shapes):
+            if shape.sample_filter:
+                facets[f"s{index}"] = [{"$match": shape.sample_filter}, {"$count": "n"}]
+        for index, field in enumerate(fields):
+            facets[f"f{index}"] = [{"$group": {"_id": f"${field}"}}, {"$count": "n"}]
+
+        documents = await collection.aggregate([{"$sample": {"size": sample_size}}, {"$facet": facets}]).to_list(length=1)
+        counts = documents[0] if documents else {}
+
+        def count(name: str) -> int:
+            return counts[name][0]["n"] if counts.get(name) else 0
+
+        sampled = count("sampled")
+        matched = [count(f"s{index}") if shape.sample_filter else sampled for index, shape in enumerate(shapes)]
+        return sampled, matched, {field: count(f"f{index}") for index, field in enumerate(fields)}
+
+    @staticmethod
+    async def _current_plan(collection: Any, shape: QueryShape) -> Optional[Dict[str, Any]]:
+        """当前的执行计划（queryPlanner模式，只选择计划，不执行查询）"""
+        command = {"find": collection.name, "filter": shape.sample_filter}
+        if shape.sort:
+            command["sort"] = dict(shape.sort)
+        try:
+            return summarize_plan(await collection.database.command("explain", command, verbosity="queryPlanner"))
+        except OperationFailure as e:
+            logger.warning(f"获取执行计划失败: {e}")
+            return None
+
+    async def advise(self,
+                     collection: Any,
+                     connection_string: str,
+                     database_name: str,
+                     collection_name: str,
+                     sample_size: int = None) -> Dict[str, Any]:
+        """
+        生成索引建议
+
+        Args:
+            collection: Motor集合
+            connection_string: MongoDB连接字符串
+            database_name: 数据库名称
+            collection_name: 集合名称
+            sample_size: 估算选择性时抽样的文档数量，默认使用配置中的sample_size
+
+        Returns:
+            Dict: 包含推荐索引列表的结果字典，按查询次数从多到少排列
+        """
+        shapes = self.shapes(connection_string, database_name, collection_name)
+        if not shapes:
+            return {
+                "status": "info",
+                "message": "当前工作进程还没有记录该集合的查询，无法给出索引建议",
+                "data": {"namespace": f"{database_name}.{collection_name}", "shapes_observed": 0, "recommendations": []},
+                "timestamp": datetime.now().isoformat()
+            }
+
+        try:
+            top = shapes[:self.max_recommendations]
+            existing = {
+                name: [(field, direction) for field, direction in info["key"]]
+                for name, info in (await collection.index_information()).items()
+            }
+            estimated_documents = await collection.estimated_document_count()
+            sampled, matched, cardinality = await self._sample_statistics(
+                collection, top, sample_size or self.sample_size
+            )
+
+            # 推荐相同索引的形状合并为一条
+            recommendations: Dict[tuple, Dict[str, Any]] = {}
+            first_shapes: Dict[tuple, QueryShape] = {}
+            for shape, matched_count in zip(top, matched):
+                index_key = shape.recommended_index(cardinality)
+                key = tuple(index_key)
+                if key in recommendations:
+                    recommendations[key]["queries"] += shape.count
+                    recommendations[key]["shapes"].append(shape.describe())
+                    continue
+                selectivity = round(matched_count / sampled, 4) if sampled else None
+                plan = await self._current_plan(collection, shape)
+                first_shapes[key] = shape
+                recommendations[key] = {
+                    "index": [[field, direction] for field, direction in index_key],
+                    "shapes": [shape.describe()],
+                    "queries": shape.count,
+                    "last_seen": shape.last_seen,
+                    "selectivity": selectivity,
+                    "estimated_matches": round(selectivity * estimated_documents) if selectivity is not None else None,
+                    "current_plan": plan["plan"] if plan else None,
+                    "current_indexes": [index["name"] for index in plan["indexes"]] if plan else [],
+                    "existing_index": next((name for name, index in existing.items() if _serves(index, shape)), None),
+                    "served_by_recommendation": None
+                }
+
+            # 已有索引不能服务、但另一条更长的推荐索引可以服务的形状，不需要单独建索引
+            missing = [key for key, item in recommendations.items() if item["existing_index"] is None]
+            for key in missing:
+                recommendations[key]["served_by_recommendation"] = next((
+                    recommendations[other]["index"] for other in missing
+                    if len(other) > len(key) and _serves(list(other), first_shapes[key])
+                ), None)
+
+            needed = sum(
+                1 for item in recommendations.values()
+                if item["existing_index"] is None and item["served_by_recommendation"] is None
+            )
+            logger.info(f"索引建议: {database_name}.{collection_name} 共 {len(shapes)} 种查询形状，建议创建 {needed} 个索引")
+
+            return {
+                "status": "success",
+                "message": f"分析了 {len(top)} 种查询形状，建议创建 {needed} 个索引",
+                "data": {
+                    "namespace": f"{database_name}.{collection_name}",
+                    "estimated_documents": estimated_documents,
+                    "sampled": sampled,
+                    "shapes_observed": len(shapes),
+                    "recommendations": list(recommendations.values())
+                },
+                "timestamp": datetime.now().isoformat()
+            }
+
+        except OperationFailure as e:
+            error_msg = f"生成索引建议失败: {str(e)}"
+            logger.error(error_msg)
+            return {
+                "status": "error",
+                "message": error_msg,
+                "timestamp": datetime.now().isoformat()
+            }
+        except Exception as e:
+            error_msg = f"生成索引建议时发生未知错误: {str(e)}"
+            logger.error(error_msg)
+            return {
+                "status": "error",
+                "message": error_msg,
+                "timestamp": datetime.now().isoformat()
+            }
+
+
+# 全局实例
+index_advisor = IndexAdvisor()
@@ -1,14 +1,33 @@
 import redis
-import json
-import hashlib
-from typing import Any, Dict
+import redis.asyncio as aioredis
+from typing import Any, Dict, List, Optional, Tuple
 from config import Config
+from cache_codec import create_cache_codec
+from cache_keys import build_cache_key
+from prometheus_metrics import cache_counters
+from tracing import redis_attributes, traced
 import logging
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# 只有锁的持有者才能删除锁，避免误删其他进程重新获取的锁
+RELEASE_LOCK_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+# 只有锁的持有者才能延长锁的过期时间
+EXTEND_LOCK_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("pexpire", KEYS[1], ARGV[2])
+end
+return 0
+"""
+
 class RedisCache:
     """Redis缓存操作类"""
     
@@ -16,13 +35,15 @@ class RedisCache:
         """初始化Redis连接"""
         redis_config = Config.get_redis_config()
         self.default_ttl = redis_config["default_ttl_seconds"]
+        # 缓存编解码器（BSON/msgpack/JSON，可选压缩）
+        self.codec = create_cache_codec()
         try:
             self.client = redis.Redis(
                 host=redis_config["host"],
                 port=redis_config["port"],
                 db=redis_config["db"],
                 password=redis_config["password"],
-                decode_responses=True,  # 自动将响应解码为字符串
+                decode_responses=False,  # 缓存值是二进制，由codec负责解码
                 socket_connect_timeout=5  # 连接超时时间
             )
             # 测试连接
@@ -50,7 +71,7 @@ class RedisCache:
             cached_data = self.client.get(key)
             if cached_data:
                 logger.info(f"缓存命中: {key}")
-                return json.loads(cached_data)
+                return self.codec.decode(cached_data)
             logger.info(f"缓存未命中: {key}")
             return None
         except Exception as e:
@@ -74,8 +95,8 @@ class RedisCache:
             if ttl is None:
                 ttl = self.default_ttl
             
-            # 使用json.dumps序列化数据，并处理datetime等特殊类型
-            serialized_value = json.dumps(value, default=str)
+            # 使用codec序列化数据，保留datetime、ObjectId等MongoDB类型
+            serialized_value = self.codec.encode(value)
             self.client.setex(key, ttl, serialized_value)
             logger.info(f"数据已存入缓存: {key}, TTL: {ttl}秒")
         except Exception as e:
@@ -92,13 +113,448 @@ class RedisCache:
         Returns:
             str: 生成的缓存键
         """
-        # 使用json.dumps并对键进行排序，以确保字典顺序不影响最终的哈希值
-        params_str = json.dumps(params, sort_keys=True, default=str)
+        return build_cache_key(prefix, params)
+
+class AsyncRedisCache:
+    """
+    Redis异步缓存操作类
+
+    与RedisCache的get/set/generate_cache_key约定一致，基于redis.asyncio实现，
+    使用有上限的阻塞式连接池，并提供基于pipeline的批量读写（一次往返）
+    """
+    
+    def __init__(self):
+        """初始化Redis连接池（不会立即建立连接，需调用initialize测试连接）"""
+        redis_config = Config.get_redis_config()
+        self.default_ttl = redis_config["default_ttl_seconds"]
+        # 缓存编解码器（BSON/msgpack/JSON，可选压缩）
+        self.codec = create_cache_codec()
+        self.pool = aioredis.BlockingConnectionPool(
+            host=redis_config["host"],
+            port=redis_config["port"],
+            db=redis_config["db"],
+            password=redis_config["password"],
+            decode_responses=False,  # 缓存值是二进制，由codec负责解码
+            socket_connect_timeout=5,  # 连接超时时间
+            max_connections=redis_config["max_connections"],
+            timeout=redis_config["pool_timeout_seconds"]
+        )
+        self.client = aioredis.Redis(connection_pool=self.pool)
+        # 命中/未命中/错误计数，用于缓存统计
+        self.stats = {"hits": 0, "misses": 0, "errors": 0}
+        self.counters = cache_counters("l2_redis")
+
+    def _count(self, result: str, amount: int = 1):
+        """计数（缓存统计和Prometheus指标）"""
+        self.stats[result] += amount
+        self.counters[result].inc(amount)
+
+    async def initialize(self):
+        """测试Redis连接，不可用时禁用缓存（应用启动时调用）"""
+        if not self.client:
+            return
+        try:
+            await self.client.ping()
+            logger.info("成功连接到Redis服务器（异步）")
+        except (redis.exceptions.ConnectionError, redis.exceptions.TimeoutError) as e:
+            logger.error(f"无法连接到Redis服务器: {e}")
+            await self.close()
+
+    async def close(self):
+        """关闭客户端并断开连接池中的所有连接"""
+        if self.client:
+            try:
+                await self.client.aclose()
+                await self.pool.disconnect()
+            except Exception as e:
+                logger.error(f"关闭Redis连接时出错: {e}")
+            self.client = None
+
+    @traced("redis.get", redis_attributes)
+    async def get(self, key: str) -> Any:
+        """
+        从缓存中获取数据
+        
+        Args:
+            key: 缓存键
+            
+        Returns:
+            Any: 缓存的数据，如果不存在或发生错误则返回None
+        """
+        if not self.client:
+            logger.warning("Redis服务不可用，跳过缓存读取。")
+            return None
+        
+        try:
+            cached_data = await self.client.get(key)
+            if cached_data:
+                self._count("hits")
+                logger.info(f"缓存命中: {key}")
+                return self.codec.decode(cached_data)
+            self._count("misses")
+            logger.info(f"缓存未命中: {key}")
+            return None
+        except Exception as e:
+            self._count("errors")
+            logger.error(f"从Redis获取数据时出错: {e}")
+            return None
+
+    @traced("redis.get_with_ttl", redis_attributes)
+    async def get_with_ttl(self, key: str) -> Tuple[Any, int, int]:
+        """
+        从缓存中获取数据及剩余过期时间（GET和TTL在同一个pipeline中，单次往返）
+        
+        Args:
+            key: 缓存键
+            
+        Returns:
+            Tuple: (缓存的数据, 剩余秒数, 序列化后的字节数)，未命中或出错时为 (None, 0, 0)
+        """
+        if not self.client:
+            logger.warning("Redis服务不可用，跳过缓存读取。")
+            return None, 0, 0
+        
+        try:
+            async with self.client.pipeline(transaction=False) as pipe:
+                pipe.get(key)
+                pipe.ttl(key)
+                cached_data, remaining_ttl = await pipe.execute()
+            if cached_data:
+                self._count("hits")
+                logger.info(f"缓存命中: {key}")
+                return self.codec.decode(cached_data), max(remaining_ttl, 0), len(cached_data)
+            self._count("misses")
+            logger.info(f"缓存未命中: {key}")
+            return None, 0, 0
+        except Exception as e:
+            self._count("errors")
+            logger.error(f"从Redis获取数据时出错: {e}")
+            return None, 0, 0
+
+    @traced("redis.set", redis_attributes)
+    async def set(self, key: str, value: Any, ttl: int = None, tags: Optional[List[str]] = None) -> int:
+        """
+        将数据存入缓存
+        
+        Args:
+            key: 缓存键
+            value: 要缓存的数据
+            ttl: 缓存时间（秒），如果为None则使用默认值
+            tags: 标签列表，缓存键会加入每个标签对应的集合，供invalidate_tag按标签批量失效
+            
+        Returns:
+            int: 序列化后的字节数，未写入时为0
+        """
+        if not self.client:
+            logger.warning("Redis服务不可用，跳过缓存写入。")
+            return 0
+            
+        try:
+            if ttl is None:
+                ttl = self.default_ttl
+            
+            # 使用codec序列化数据，保留datetime、ObjectId等MongoDB类型
+            serialized_value = self.codec.encode(value)
+            if tags:
+                # 数据和标签在同一个pipeline中写入；标签集合的过期时间不短于其中任何一个键
+                async with self.client.pipeline(transaction=False) as pipe:
+                    pipe.setex(key, ttl, serialized_value)
+                    for tag in tags:
+                        pipe.sadd(tag, key)
+                        pipe.expire(tag, ttl, nx=True)
+                        pipe.expire(tag, ttl, gt=True)
+                    await pipe.execute()
+            else:
+                await self.client.setex(key, ttl, serialized_value)
+            logger.info(f"数据已存入缓存: {key}, TTL: {ttl}秒")
+            return len(serialized_value)
+        except Exception as e:
+            self._count("errors")
+            logger.error(f"向Redis存储数据时出错: {e}")
+            return 0
+
+    async def delete(self, keys: List[str]) -> int:
+        """
+        删除缓存
+        
+        Args:
+            keys: 缓存键列表
+            
+        Returns:
+            int: 实际删除的键数量
+        """
+        if not keys or not self.client:
+            return 0
+        
+        try:
+            return await self.client.delete(*keys)
+        except Exception as e:
+            self._count("errors")
+            logger.error(f"从Redis删除数据时出错: {e}")
+            return 0
+
+    @staticmethod
+    def generation_key(tag: str) -> str:
+        """标签的失效版本号所在的键"""
+        return f"{tag}:generation"
+
+    async def pop_tagged(self, tag: str) -> List[str]:
+        """
+        取出并删除标签集合中的所有缓存键，同时递增标签的失效版本号
+        （SMEMBERS、DEL和INCR在同一个事务中执行）
         
-        # 使用MD5哈希算法来缩短键的长度，并保持唯一性
-        hash_part = hashlib.md5(params_str.encode('utf-8')).hexdigest()
+        Args:
+            tag: 标签
+            
+        Returns:
+            List[str]: 带有该标签的缓存键，Redis不可用或出错时返回空列表
+        """
+        if not self.client:
+            return []
         
-        return f"mongodb_api:{prefix}:{hash_part}"
+        try:
+            async with self.client.pipeline(transaction=True) as pipe:
+                pipe.incr(self.generation_key(tag))
+                pipe.smembers(tag)
+                pipe.delete(tag)
+                _, members, _ = await pipe.execute()
+            return [member.decode("utf-8") if isinstance(member, bytes) else member for member in members]
+        except Exception as e:
+            self._count("errors")
+            logger.error(f"从Redis读取标签时出错: {e}")
+            return []
+
+    async def get_generations(self, tags: List[str]) -> Optional[List[int]]:
+        """
+        读取标签的失效版本号（单次往返）
+        
+        Args:
+            tags: 标签列表
+            
+        Returns:
+            List[int]: 与tags一一对应的版本号，从未失效过的标签为0；Redis不可用或出错时返回None
+        """
+        if not tags or not self.client:
+            return None
+        
+        try:
+            values = await self.client.mget([self.generation_key(tag) for tag in tags])
+            return [int(value) if value else 0 for value in values]
+        except Exception as e:
+            self._count("errors")
+            logger.error(f"从Redis读取标签版本号时出错: {e}")
+            return None
+
+    async def publish(self, channel: str, message: str):
+        """
+        向频道发布消息（用于通知其他工作进程）
+        
+        Args:
+            channel: 频道名称
+            message: 消息内容
+        """
+        if not self.client:
+            return
+        
+        try:
+            await self.client.publish(channel, message)
+        except Exception as e:
+            self._count("errors")
+            logger.error(f"向Redis发布消息时出错: {e}")
+
+    async def acquire_lock(self, key: str, token: str, ttl_ms: int) -> bool:
+        """
+        尝试获取分布式锁（SET NX PX）
+        
+        Args:
+            key: 锁的键
+            token: 持有者标识，释放时校验
+            ttl_ms: 锁的过期时间（毫秒）
+            
+        Returns:
+            bool: 是否获得锁；Redis不可用或出错时返回True（退化为不加锁）
+        """
+        if not self.client:
+            return True
+        
+        try:
+            return bool(await self.client.set(key, token, nx=True, px=ttl_ms))
+        except Exception as e:
+            self._count("errors")
+            logger.error(f"获取Redis锁时出错: {e}")
+            return True
+
+    async def release_lock(self, key: str, token: str):
+        """
+        释放分布式锁（只删除自己持有的锁）
+        
+        Args:
+            key: 锁的键
+            token: 获取锁时使用的持有者标识
+        """
+        if not self.client:
+            return
+        
+        try:
+            await self.client.eval(RELEASE_LOCK_SCRIPT, 1, key, token)
+        except Exception as e:
+            self._count("errors")
+            logger.error(f"释放Redis锁时出错: {e}")
+
+    async def extend_lock(self, key: str, token: str, ttl_ms: int) -> bool:
+        """
+        延长自己持有的锁的过期时间（用于长期持有的租约）
+        
+        Args:
+            key: 锁的键
+            token: 获取锁时使用的持有者标识
+            ttl_ms: 新的过期时间（毫秒）
+            
+        Returns:
+            bool: 是否仍持有锁；Redis不可用或出错时返回True（退化为不加锁）
+        """
+        if not self.client:
+            return True
+        
+        try:
+            return bool(await self.client.eval(EXTEND_LOCK_SCRIPT, 1, key, token, ttl_ms))
+        except Exception as e:
+            self._count("errors")
+            logger.error(f"延长Redis锁时出错: {e}")
+            return True
+
+    async def exists(self, key: str) -> bool:
+        """
+        检查键是否存在
+        
+        Args:
+            key: 缓存键
+            
+        Returns:
+            bool: 是否存在，Redis不可用或出错时返回False
+        """
+        if not self.client:
+            return False
+        
+        try:
+            return bool(await self.client.exists(key))
+        except Exception as e:
+            self._count("errors")
+            logger.error(f"检查Redis键时出错: {e}")
+            return False
+
+    @traced("redis.mget", redis_attributes)
+    async def mget(self, keys: List[str]) -> List[Any]:
+        """
+        批量获取缓存数据（单次往返）
+        
+        Args:
+            keys: 缓存键列表
+            
+        Returns:
+            List: 与keys一一对应的缓存数据，不存在或出错的位置为None
+        """
+        if not keys:
+            return []
+        if not self.client:
+            logger.warning("Redis服务不可用，跳过缓存读取。")
+            return [None] * len(keys)
+        
+        try:
+            cached_list = await self.client.mget(keys)
+            results = [self.codec.decode(cached_data) if cached_data else None for cached_data in cached_list]
+            hits = sum(1 for result in results if result is not None)
+            self._count("hits", hits)
+            self._count("misses", len(keys) - hits)
+            logger.info(f"批量缓存读取: {len(keys)} 个键，命中 {hits} 个")
+            return results
+        except Exception as e:
+            self._count("errors")
+            logger.error(f"从Redis批量获取数据时出错: {e}")
+            return [None] * len(keys)
+
+    @traced("redis.mget_with_ttl", redis_attributes)
+    async def mget_with_ttl(self, keys: List[str]) -> List[Tuple[Any, int, int]]:
+        """
+        批量获取缓存数据及剩余过期时间（MGET和各键的TTL在同一个pipeline中，单次往返）
+        
+        Args:
+            keys: 缓存键列表
+            
+        Returns:
+            List: 与keys一一对应的 (缓存的数据, 剩余秒数, 序列化后的字节数)，未命中或出错的位置为 (None, 0, 0)
+        """
+        if not keys:
+            return []
+        if not self.client:
+            logger.warning("Redis服务不可用，跳过缓存读取。")
+            return [(None, 0, 0)] * len(keys)
+        
+        try:
+            async with self.client.pipeline(transaction=False) as pipe:
+                pipe.mget(keys)
+                for key in keys:
+                    pipe.ttl(key)
+                cached_list, *remaining_ttls = await pipe.execute()
+            results = []
+            for cached_data, remaining_ttl in zip(cached_list, remaining_ttls):
+                if cached_data:
+                    results.append((self.codec.decode(cached_data), max(remaining_ttl, 0), len(cached_data)))
+                else:
+                    results.append((None, 0, 0))
+            hits = sum(1 for result in results if result[0] is not None)
+            self._count("hits", hits)
+            self._count("misses", len(keys) - hits)
+            logger.info(f"批量缓存读取: {len(keys)} 个键，命中 {hits} 个")
+            return results
+        except Exception as e:
+            self._count("errors")
+            logger.error(f"从Redis批量获取数据时出错: {e}")
+            return [(None, 0, 0)] * len(keys)
+
+    @traced("redis.mset", redis_attributes)
+    async def mset(self, items: Dict[str, Any], ttl: Optional[int] = None):
+        """
+        批量写入缓存（使用pipeline，单次往返）
+        
+        Args:
+            items: 缓存键到数据的映射
+            ttl: 缓存时间（秒），如果为None则使用默认值
+        """
+        if not items:
+            return
+        if not self.client:
+            logger.warning("Redis服务不可用，跳过缓存写入。")
+            return
+        
+        try:
+            if ttl is None:
+                ttl = self.default_ttl
+            
+            async with self.client.pipeline(transaction=False) as pipe:
+                for key, value in items.items():
+                    pipe.setex(key, ttl, self.codec.encode(value))
+                await pipe.execute()
+            logger.info(f"批量数据已存入缓存: {len(items)} 个键, TTL: {ttl}秒")
+        except Exception as e:
+            self._count("errors")
+            logger.error(f"向Redis批量存储数据时出错: {e}")
+
+    def generate_cache_key(self, prefix: str, params: Dict[str, Any]) -> str:
+        """
+        根据参数生成一个稳定的缓存键
+        
+        Args:
+            prefix: 缓存键前缀 (如: "query", "aggregate")
+            params: 包含所有查询参数的字典
+            
+        Returns:
+            str: 生成的缓存键
+        """
+        return build_cache_key(prefix, params)
 
 # 创建一个全局的RedisCache实例，方便在应用中复用
-redis_cache = RedisCache() 
\ No newline at end of file
+redis_cache = RedisCache()
+
+# 创建一个全局的AsyncRedisCache实例，供异步接口使用
+async_redis_cache = AsyncRedisCache() 
\ No newline at end of file
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+请求合并（single-flight）
+热点缓存键过期时，只让一个请求查询MongoDB，其余并发请求等待并复用它的结果，避免缓存击穿
+"""
+
+import asyncio
+import time
+import uuid
+import logging
+from typing import Any, Awaitable, Callable, Dict, Optional
+from config import Config
+from redis_cache import AsyncRedisCache, async_redis_cache
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class LeaderCancelled(Exception):
+    """执行查询的请求被取消（例如客户端断开连接），等待者应重新发起合并执行"""
+
+
+class SingleFlight:
+    """
+    两级请求合并
+
+    - 进程内：同一缓存键的并发请求共享同一个Future，只有第一个请求执行查询
+    - 跨进程：执行查询前先获取Redis短期锁（SET NX PX），没拿到锁的工作进程轮询缓存，
+      直到持锁进程写入结果、锁被释放或等待超时
+    """
+
+    def __init__(self, remote: AsyncRedisCache, flight_config: Dict[str, Any] = None):
+        flight_config = flight_config or Config.get_single_flight_config()
+        self.remote = remote
+        self.enabled = flight_config["enabled"]
+        self.lock_ttl_ms = flight_config["lock_ttl_ms"]
+        self.wait_timeout_seconds = flight_config["wait_timeout_seconds"]
+        self.poll_interval_seconds = flight_config["poll_interval_ms"] / 1000
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.stats = {"leaders": 0, "coalesced_local": 0, "coalesced_remote": 0, "lock_timeouts": 0,
+                      "leader_cancelled": 0}
+
+    @staticmethod
+    def _copy(value: Any) -> Any:
+        return dict(value) if isinstance(value, dict) else value
+
+    async def do(self,
+                 key: str,
+                 compute: Callable[[], Awaitable[Any]],
+                 fetch_cached: Callable[[], Awaitable[Optional[Any]]]) -> Any:
+        """
+        合并执行同一个键的计算
+
+        Args:
+            key: 合并键（缓存键）
+            compute: 执行查询并写入缓存的协程函数，只会被一个请求调用
+            fetch_cached: 读取缓存的协程函数，等待其他进程时用于获取结果
+
+        Returns:
+            Any: 计算结果，等待者拿到的是结果字典的浅拷贝
+        """
+        if not self.enabled:
+            return await compute()
+
+        future = self._inflight.get(key)
+        if future is not None:
+            self.stats["coalesced_local"] += 1
+            logger.info(f"合并进程内并发请求: {key}")
+        while future is not None:
+            try:
+                return self._copy(await asyncio.shield(future))
+            except LeaderCancelled:
+                # 执行查询的请求被取消，不能让取消传播到无关的等待者，由第一个醒来的等待者重新执行
+                future = self._inflight.get(key)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            result = await self._run_across_workers(key, compute, fetch_cached)
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            if isinstance(e, asyncio.CancelledError):
+                self.stats["leader_cancelled"] += 1
+                future.set_exception(LeaderCancelled(key))
+            else:
+                future.set_exception(e)
+            # 没有等待者时避免出现 "Future exception was never retrieved" 警告
+            future.exception()
+            raise
+        finally:
+            self._inflight.pop(key, None)
+
+    async def _run_across_workers(self,
+                                  key: str,
+                                  compute: Callable[[], Awaitable[Any]],
+                                  fetch_cached: Callable[[], Awaitable[Optional[Any]]]) -> Any:
+        """获取跨进程锁后执行计算，拿不到锁则等待持锁进程的结果"""
+        lock_key = f"{key}:lock"
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + self.wait_timeout_seconds
+        waited = False
+
+        while True:
+            if await self.remote.acquire_lock(lock_key, token, self.lock_ttl_ms):
+                try:
+                    # 等待期间锁被释放，可能是持锁进程刚写完缓存，先再检查一次
+                    if waited:
+                        cached = await fetch_cached()
+                        if cached is not None:
+                            self.stats["coalesced_remote"] += 1
+                            return cached
+                    self.stats["leaders"] += 1
+                    return await compute()
+                finally:
+                    await self.remote.release_lock(lock_key, token)
+
+            # 其他工作进程正在查询，轮询缓存等待结果
+            waited = True
+            while await self.remote.exists(lock_key):
+                if time.monotonic() >= deadline:
+                    self.stats["lock_timeouts"] += 1
+                    logger.warning(f"等待其他进程查询结果超时，直接查询数据库: {key}")
+                    return await compute()
+                await asyncio.sleep(self.poll_interval_seconds)
+                cached = await fetch_cached()
+                if cached is not None:
+                    self.stats["coalesced_remote"] += 1
+                    logger.info(f"复用其他进程的查询结果: {key}")
+                    return cached
+
+
+# 创建一个全局的SingleFlight实例，方便在应用中复用
+single_flight = SingleFlight(async_redis_cache)
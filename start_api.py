@@ -76,6 +76,7 @@ def main():
     try:
         import fastapi
         import pymongo
+        import motor
         import uvicorn
     except ImportError as e:
         print(f"❌ 缺少依赖: {e}")
@@ -136,6 +137,7 @@ def check_environment():
     required_files = [
         "fastapi_mongodb.py",
         "mongodb_api.py",
+        "async_mongodb_api.py",
         "swagger_config.py"
     ]
     
@@ -150,6 +152,7 @@ def check_environment():
     try:
         import fastapi
         import pymongo
+        import motor
         import uvicorn
         print("✅ 所有依赖已安装")
         return True
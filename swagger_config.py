@@ -193,6 +193,22 @@ API_TAGS = [
             "url": "https://docs.mongodb.com/manual/tutorial/query-documents/"
         }
     },
+    {
+        "name": "游标会话",
+        "description": "服务端游标会话，分批读取大结果集（打开游标、获取下一批、关闭游标）",
+        "externalDocs": {
+            "description": "MongoDB游标文档",
+            "url": "https://docs.mongodb.com/manual/tutorial/iterate-a-cursor/"
+        }
+    },
+    {
+        "name": "数据写入",
+        "description": "批量写入文档（插入、更新、upsert、替换、删除），写入后自动失效受影响的缓存",
+        "externalDocs": {
+            "description": "MongoDB批量写入文档",
+            "url": "https://docs.mongodb.com/manual/core/bulk-write-operations/"
+        }
+    },
     {
         "name": "聚合查询",
         "description": "聚合管道查询，支持复杂的数据聚合操作",
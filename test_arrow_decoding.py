@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试聚合结果解码为Arrow：文档字段不一致时不能丢失列
+（直接解码构造的BSON批次，不需要MongoDB；需要安装pyarrow，分别测试pymongoarrow和bson两种解码方式）
+"""
+
+import bson
+
+import arrow_decoding
+from arrow_decoding import ArrowBatchDecoder, ArrowDecodeError
+
+
+def raw_batch(documents):
+    """构造游标批次的原始BSON"""
+    return b"".join(bson.encode(document) for document in documents)
+
+
+def report(name: str, passed: bool, detail: object = ""):
+    print(f"  [{'通过' if passed else '失败'}] {name} {detail}")
+
+
+def test_fields_differ_within_batch():
+    """同一批次中后面的文档有第一个文档没有的字段"""
+    print("1. 同一批次中文档字段不一致")
+    batch = ArrowBatchDecoder().decode(raw_batch([{"a": 1}, {"a": 2, "b": "x"}]))
+    rows = batch.to_pylist()
+    report("包含所有字段", rows == [{"a": 1, "b": None}, {"a": 2, "b": "x"}], rows)
+
+
+def test_fields_differ_across_batches():
+    """后续批次的字段与第一个批次不同：缺少的字段补null，新字段报错；声明schema时只输出声明的字段"""
+    print("2. 批次之间字段不一致")
+    decoder = ArrowBatchDecoder()
+    first = decoder.decode(raw_batch([{"a": 1, "b": "x"}]))
+    second = decoder.decode(raw_batch([{"a": 2}]))
+    report("缺少的字段补null且schema不变",
+           second.schema == first.schema and second.to_pylist() == [{"a": 2, "b": None}], second.to_pylist())
+    try:
+        decoder.decode(raw_batch([{"a": 3, "c": 1.5}]))
+        report("新字段报错", False, "没有报错")
+    except ArrowDecodeError as e:
+        report("新字段报错", True, e)
+
+    decoder = ArrowBatchDecoder({"a": "int64", "c": "double"})
+    decoder.decode(raw_batch([{"a": 1, "b": "x"}]))
+    rows = decoder.decode(raw_batch([{"a": 3, "c": 1.5}])).to_pylist()
+    report("声明schema时按声明的字段输出", rows == [{"a": 3, "c": 1.5}], rows)
+
+
+def run_with_each_decoder(test):
+    native_context = arrow_decoding.PyMongoArrowContext
+    if native_context is not None:
+        print("--- 解码方式: pymongoarrow ---")
+        test()
+    arrow_decoding.PyMongoArrowContext = None
+    try:
+        print("--- 解码方式: bson ---")
+        test()
+    finally:
+        arrow_decoding.PyMongoArrowContext = native_context
+
+
+if __name__ == "__main__":
+    if arrow_decoding.pyarrow is None:
+        print("未安装pyarrow，跳过测试")
+    else:
+        run_with_each_decoder(test_fields_differ_within_batch)
+        print("\n" + "="*50 + "\n")
+        run_with_each_decoder(test_fields_differ_across_batches)
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试批量查询功能
+"""
+
+import requests
+import json
+from datetime import datetime
+
+# API基础URL
+BASE_URL = "http://localhost:8000"
+
+def test_batch_api():
+    """测试批量查询API功能"""
+
+    print("=== 测试批量查询功能 ===\n")
+
+    connection = {
+        "connection_string": "mongodb://localhost:27017/",
+        "database_name": "test_db",
+        "collection_name": "users"
+    }
+
+    # 测试数据：一次请求包含多种操作
+    test_data = {
+        "operations": [
+            {"op": "query", **connection, "query_filter": {"age": {"$gte": 25}}, "limit": 5},
+            {"op": "query_one", **connection, "query_filter": {"name": "张三"}},
+            {"op": "aggregate", **connection, "pipeline": [
+                {"$group": {"_id": "$department", "count": {"$sum": 1}}}
+            ]},
+            {"op": "distinct", **connection, "field": "department"},
+            {"op": "query", **connection, "stream_format": "ndjson"}
+        ]
+    }
+
+    # 1. 第一次执行（缓存未命中，并发查询数据库）
+    print("1. 第一次执行批量查询")
+    print(f"请求数据: {json.dumps(test_data, ensure_ascii=False, indent=2)}")
+
+    try:
+        response = requests.post(f"{BASE_URL}/batch", json=test_data)
+        print(f"响应状态码: {response.status_code}")
+
+        if response.status_code == 200:
+            result = response.json()
+            print(f"批量结果: {result['message']}")
+            for index, item in enumerate(result["data"]):
+                print(f"  操作{index + 1}: [{item['status']}] {item['message']}")
+        else:
+            print(f"请求失败: {response.text}")
+    except Exception as e:
+        print(f"请求异常: {str(e)}")
+
+    print("\n" + "="*50 + "\n")
+
+    # 2. 第二次执行（一次批量读取缓存）
+    print("2. 再次执行相同的批量查询（应命中缓存）")
+    try:
+        result = requests.post(f"{BASE_URL}/batch", json=test_data).json()
+        print(f"批量结果: {result['message']}")
+    except Exception as e:
+        print(f"请求异常: {str(e)}")
+
+    print("\n" + "="*50 + "\n")
+
+    # 3. 无效的操作类型
+    print("3. 无效的操作类型（应返回422）")
+    try:
+        response = requests.post(f"{BASE_URL}/batch", json={"operations": [{"op": "unknown", **connection}]})
+        print(f"响应状态码: {response.status_code}")
+    except Exception as e:
+        print(f"请求异常: {str(e)}")
+
+if __name__ == "__main__":
+    print(f"开始测试批量查询功能 - {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    print("请确保MongoDB服务正在运行，并且test_db.users集合中有测试数据")
+    print("如果没有测试数据，请先运行example_usage.py创建测试数据\n")
+
+    test_batch_api()
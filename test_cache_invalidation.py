@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试查询期间集合被写入时的缓存失效：查询开始后、写入缓存前发生的失效，不能让写入前读到的结果留在缓存中
+（在进程内直接调用缓存查询流程，需要本地MongoDB和Redis）
+"""
+
+import asyncio
+from datetime import datetime
+
+from fastapi_mongodb import BulkWriteRequest, QueryRequest, bulk_write_documents, cached_query_result, query_spec
+from change_stream_invalidator import change_stream_invalidator
+from redis_cache import async_redis_cache
+from tiered_cache import tiered_cache
+
+CONNECTION = {
+    "connection_string": "mongodb://localhost:27017/",
+    "database_name": "test_db",
+    "collection_name": "users"
+}
+
+
+def report(name: str, passed: bool):
+    print(f"  [{'通过' if passed else '失败'}] {name}")
+
+
+async def invalidate_users():
+    await change_stream_invalidator.invalidate_collection(
+        CONNECTION["connection_string"], CONNECTION["database_name"], CONNECTION["collection_name"]
+    )
+
+
+async def test_invalidation_during_query():
+    """查询执行完、写入缓存前集合被写入：结果不应被缓存"""
+    print("1. 查询执行期间集合被写入")
+    request = QueryRequest(**CONNECTION, query_filter={"age": {"$gte": 25}}, limit=10, cache_ttl=3600)
+    spec = query_spec(request)
+    execute = spec["execute"]
+
+    async def execute_then_write(api):
+        result = await execute(api)
+        # 模拟查询读取数据之后，另一个请求写入集合并失效缓存（此时新的缓存键还没有加入标签）
+        await invalidate_users()
+        return result
+
+    cache_key = tiered_cache.generate_cache_key(spec["cache_prefix"], request.dict())
+    await tiered_cache.invalidate([cache_key])
+    result = await cached_query_result(request, **{**spec, "execute": execute_then_write})
+    print(f"  查询结果: [{result['status']}] {result['message']}")
+    report("查询期间失效后结果没有留在缓存中", await tiered_cache.get(cache_key) is None)
+
+    # 没有写入时正常缓存
+    result = await cached_query_result(request, **spec)
+    report("没有写入时结果被缓存", await tiered_cache.get(cache_key) is not None)
+
+
+async def test_invalidation_between_check_and_set():
+    """写入缓存前的版本号检查通过后、写入完成前集合被写入：刚写入的缓存应被删除"""
+    print("2. 写入缓存的同时集合被写入")
+    tag = change_stream_invalidator.namespace_tag(
+        CONNECTION["connection_string"], CONNECTION["database_name"], CONNECTION["collection_name"]
+    )
+    cache_key = tiered_cache.generate_cache_key("test_invalidation", {"case": 2})
+    generations = await tiered_cache.tag_generations([tag])
+
+    remote_set = async_redis_cache.set
+
+    async def set_after_invalidation(*args, **kwargs):
+        await invalidate_users()
+        return await remote_set(*args, **kwargs)
+
+    async_redis_cache.set = set_after_invalidation
+    try:
+        cached = await tiered_cache.set(cache_key, {"status": "success", "data": []}, ttl=3600,
+                                        tags=[tag], generations=generations)
+    finally:
+        async_redis_cache.set = remote_set
+    report("set返回未缓存", cached is False)
+    report("刚写入的缓存已被删除", await tiered_cache.get(cache_key) is None)
+
+
+async def test_bulk_write_during_query():
+    """查询读取数据后，/bulk_write（已确认的写入）完成并失效缓存：查询结果不应被缓存"""
+    print("3. 查询执行期间通过/bulk_write写入")
+    marker = f"cache-invalidation-{datetime.now().timestamp()}"
+    request = QueryRequest(**CONNECTION, query_filter={"name": marker}, cache_ttl=3600)
+    spec = query_spec(request)
+    execute = spec["execute"]
+
+    async def execute_then_bulk_write(api):
+        result = await execute(api)
+        response = await bulk_write_documents(BulkWriteRequest(
+            **CONNECTION, operations=[{"insert_one": {"document": {"name": marker}}}]
+        ))
+        print(f"  批量写入: [{response.status}] {response.message}")
+        return result
+
+    cache_key = tiered_cache.generate_cache_key(spec["cache_prefix"], request.dict())
+    try:
+        result = await cached_query_result(request, **{**spec, "execute": execute_then_bulk_write})
+        print(f"  查询结果（写入前读取）: 返回 {result.get('count', 0)} 个文档")
+        report("写入前读取的结果没有留在缓存中", await tiered_cache.get(cache_key) is None)
+
+        result = await cached_query_result(request, **spec)
+        report("之后的查询读到新写入的文档", result.get("count") == 1)
+    finally:
+        await bulk_write_documents(BulkWriteRequest(
+            **CONNECTION, operations=[{"delete_many": {"filter": {"name": marker}}}]
+        ))
+
+
+async def main():
+    await async_redis_cache.initialize()
+    if not async_redis_cache.client:
+        print("Redis不可用，无法测试按标签失效")
+        return
+    try:
+        await test_invalidation_during_query()
+        print("\n" + "="*50 + "\n")
+        await test_invalidation_between_check_and_set()
+        print("\n" + "="*50 + "\n")
+        await test_bulk_write_during_query()
+    finally:
+        await async_redis_cache.close()
+
+
+if __name__ == "__main__":
+    print(f"开始测试查询期间的缓存失效 - {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    print("请确保MongoDB和Redis服务正在运行，并且test_db.users集合中有测试数据")
+    print("如果没有测试数据，请先运行example_usage.py创建测试数据\n")
+
+    asyncio.run(main())
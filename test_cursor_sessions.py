@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试服务端游标会话功能
+"""
+
+import requests
+import json
+from datetime import datetime
+
+# API基础URL
+BASE_URL = "http://localhost:8000"
+
+def test_cursor_api():
+    """测试游标会话API功能"""
+
+    print("=== 测试服务端游标会话功能 ===\n")
+
+    # 使用同一个Session，保持keep-alive连接，请求落在同一个工作进程
+    session = requests.Session()
+    session.headers["X-Client-Id"] = "test-cursor-client"
+
+    # 测试数据
+    test_data = {
+        "connection_string": "mongodb://localhost:27017/",
+        "database_name": "test_db",
+        "collection_name": "users",
+        "sort": [["age", 1]],
+        "batch_size": 2
+    }
+
+    # 1. 打开游标
+    print("1. 打开游标")
+    print(f"请求数据: {json.dumps(test_data, ensure_ascii=False, indent=2)}")
+
+    cursor_id = None
+    try:
+        response = session.post(f"{BASE_URL}/cursors", json=test_data)
+        print(f"响应状态码: {response.status_code}")
+
+        if response.status_code == 200:
+            result = response.json()
+            print(f"响应结果: {json.dumps(result, ensure_ascii=False, indent=2)}")
+            if result["status"] == "success":
+                cursor_id = result["data"]["cursor_id"]
+        else:
+            print(f"请求失败: {response.text}")
+    except Exception as e:
+        print(f"请求异常: {str(e)}")
+
+    if not cursor_id:
+        return
+
+    print("\n" + "="*50 + "\n")
+
+    # 2. 分批获取，直到游标读完
+    print("2. 分批获取文档（每批2个）")
+    total = 0
+    try:
+        while True:
+            response = session.post(f"{BASE_URL}/cursors/{cursor_id}/next", params={"size": 2})
+            result = response.json()
+            if result["status"] != "success":
+                print(f"获取失败: {result['message']}")
+                break
+            total += result["count"]
+            print(f"{result['message']}，累计 {result['data']['fetched']} 个")
+            if not result["data"]["has_more"]:
+                break
+        print(f"共获取 {total} 个文档")
+    except Exception as e:
+        print(f"请求异常: {str(e)}")
+
+    print("\n" + "="*50 + "\n")
+
+    # 3. 提前关闭游标
+    print("3. 打开游标后提前关闭")
+    try:
+        result = session.post(f"{BASE_URL}/cursors", json=test_data).json()
+        cursor_id = result["data"]["cursor_id"]
+        session.post(f"{BASE_URL}/cursors/{cursor_id}/next", params={"size": 1})
+        result = session.delete(f"{BASE_URL}/cursors/{cursor_id}").json()
+        print(f"关闭结果: {result['message']}")
+
+        # 关闭后再获取应返回错误
+        result = session.post(f"{BASE_URL}/cursors/{cursor_id}/next").json()
+        print(f"关闭后获取: {result['message']}")
+    except Exception as e:
+        print(f"请求异常: {str(e)}")
+
+    print("\n" + "="*50 + "\n")
+
+    # 4. 查看游标统计
+    print("4. 查看游标会话统计")
+    try:
+        result = session.get(f"{BASE_URL}/cursors/stats").json()
+        print(f"响应结果: {json.dumps(result, ensure_ascii=False, indent=2)}")
+    except Exception as e:
+        print(f"请求异常: {str(e)}")
+
+if __name__ == "__main__":
+    print(f"开始测试服务端游标会话功能 - {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    print("请确保MongoDB服务正在运行，并且test_db.users集合中有测试数据")
+    print("如果没有测试数据，请先运行example_usage.py创建测试数据\n")
+
+    test_cursor_api()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试执行计划（explain）和索引建议功能
+"""
+
+import requests
+import json
+from datetime import datetime
+
+# API基础URL
+BASE_URL = "http://localhost:8000"
+
+def test_index_advice_api():
+    """测试explain模式和索引建议API功能"""
+
+    print("=== 测试执行计划和索引建议功能 ===\n")
+
+    # 使用同一个Session，保持keep-alive连接，请求落在同一个工作进程（查询形状按工作进程统计）
+    session = requests.Session()
+
+    connection = {
+        "connection_string": "mongodb://localhost:27017/",
+        "database_name": "test_db",
+        "collection_name": "users"
+    }
+
+    # 1. 查看查询的执行计划
+    print("1. 查看/query的执行计划")
+    test_data = {
+        **connection,
+        "query_filter": {"department": "技术部", "age": {"$gte": 25}},
+        "sort": [["name", 1]],
+        "explain": True
+    }
+    print(f"请求数据: {json.dumps(test_data, ensure_ascii=False, indent=2)}")
+
+    try:
+        response = session.post(f"{BASE_URL}/query", json=test_data)
+        print(f"响应状态码: {response.status_code}")
+
+        if response.status_code == 200:
+            result = response.json()
+            print(f"响应结果: {json.dumps(result, ensure_ascii=False, indent=2)}")
+        else:
+            print(f"请求失败: {response.text}")
+    except Exception as e:
+        print(f"请求异常: {str(e)}")
+
+    print("\n" + "="*50 + "\n")
+
+    # 2. 查看聚合管道的执行计划
+    print("2. 查看/aggregate的执行计划")
+    try:
+        result = session.post(f"{BASE_URL}/aggregate", json={
+            **connection,
+            "pipeline": [
+                {"$match": {"age": {"$gte": 25}}},
+                {"$group": {"_id": "$department", "count": {"$sum": 1}}}
+            ],
+            "explain": True
+        }).json()
+        print(f"{result['message']}")
+        if result["status"] == "success":
+            plan = result["data"]
+            print(f"扫描的键: {plan.get('keys_examined')}，扫描的文档: {plan.get('docs_examined')}，返回: {plan.get('returned')}")
+    except Exception as e:
+        print(f"请求异常: {str(e)}")
+
+    print("\n" + "="*50 + "\n")
+
+    # 3. 执行几种查询，记录查询形状
+    print("3. 执行几种查询")
+    queries = [
+        {**connection, "query_filter": {"department": "技术部", "age": {"$gte": 25}}, "sort": [["name", 1]], "cache_ttl": 0},
+        {**connection, "query_filter": {"department": "销售部", "age": {"$gte": 30}}, "sort": [["name", 1]], "cache_ttl": 0},
+        {**connection, "query_filter": {"email": "zhangsan@example.com"}, "cache_ttl": 0}
+    ]
+    try:
+        for query in queries:
+            result = session.post(f"{BASE_URL}/query", json=query).json()
+            print(f"  [{result['status']}] {result['message']}")
+    except Exception as e:
+        print(f"请求异常: {str(e)}")
+
+    print("\n" + "="*50 + "\n")
+
+    # 4. 获取索引建议
+    print("4. 获取索引建议")
+    try:
+        result = session.post(f"{BASE_URL}/index_advice", json={**connection, "sample_size": 500}).json()
+        print(f"{result['message']}")
+        for item in result.get("data", {}).get("recommendations", []):
+            print(f"  索引 {item['index']}: 查询 {item['queries']} 次，选择性 {item['selectivity']}，"
+                  f"当前计划 {item['current_plan']}，已有索引 {item['existing_index']}")
+    except Exception as e:
+        print(f"请求异常: {str(e)}")
+
+if __name__ == "__main__":
+    print(f"开始测试执行计划和索引建议功能 - {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    print("请确保MongoDB服务正在运行，并且test_db.users集合中有测试数据")
+    print("如果没有测试数据，请先运行example_usage.py创建测试数据\n")
+
+    test_index_advice_api()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试查询形状耗时统计和慢查询日志功能
+"""
+
+import requests
+import json
+from datetime import datetime
+
+# API基础URL
+BASE_URL = "http://localhost:8000"
+
+def test_query_stats_api():
+    """测试查询形状统计和慢查询日志API功能"""
+
+    print("=== 测试查询形状耗时统计功能 ===\n")
+
+    # 使用同一个Session，保持keep-alive连接，请求落在同一个工作进程（统计按工作进程保存）
+    session = requests.Session()
+
+    connection = {
+        "connection_string": "mongodb://localhost:27017/",
+        "database_name": "test_db",
+        "collection_name": "users"
+    }
+
+    # 1. 执行值不同、结构相同的查询（归为同一种形状），重复的查询命中缓存
+    print("1. 执行几种查询")
+    queries = [
+        {**connection, "query_filter": {"age": {"$gte": 25}}, "limit": 10},
+        {**connection, "query_filter": {"age": {"$gte": 30}}, "limit": 10},
+        {**connection, "query_filter": {"age": {"$gte": 25}}, "limit": 10},
+        {**connection, "query_filter": {"department": "技术部"}}
+    ]
+    try:
+        for query in queries:
+            result = session.post(f"{BASE_URL}/query", json=query).json()
+            print(f"  [{result['status']}] {result['message']}")
+    except Exception as e:
+        print(f"请求异常: {str(e)}")
+
+    print("\n" + "="*50 + "\n")
+
+    # 2. 查看各查询形状的统计
+    print("2. 查看查询形状统计")
+    try:
+        response = session.get(f"{BASE_URL}/query_stats", params={"limit": 10})
+        print(f"响应状态码: {response.status_code}")
+
+        if response.status_code == 200:
+            result = response.json()
+            print(f"{result['message']}，慢查询阈值: {result['data']['slow_query_ms']}ms")
+            for shape in result["data"]["shapes"]:
+                latency = shape["latency"]
+                print(f"  {shape['op']} {json.dumps(shape.get('filter'), ensure_ascii=False)}: "
+                      f"{shape['count']} 次，p50 {latency['p50_ms']}ms，p99 {latency['p99_ms']}ms，"
+                      f"缓存命中率 {shape['cache_hit_ratio']}，平均返回 {shape['avg_documents']} 个文档")
+        else:
+            print(f"请求失败: {response.text}")
+    except Exception as e:
+        print(f"请求异常: {str(e)}")
+
+    print("\n" + "="*50 + "\n")
+
+    # 3. 查看慢查询日志
+    print("3. 查看慢查询日志")
+    try:
+        result = session.get(f"{BASE_URL}/query_stats/slow", params={"limit": 5}).json()
+        print(f"{result['message']}")
+        for entry in result.get("data", []):
+            print(f"  {entry['timestamp']} {entry['op']} {entry['total_ms']}ms 分阶段: {entry['phases_ms']}")
+    except Exception as e:
+        print(f"请求异常: {str(e)}")
+
+if __name__ == "__main__":
+    print(f"开始测试查询形状统计功能 - {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    print("请确保MongoDB服务正在运行，并且test_db.users集合中有测试数据")
+    print("如果没有测试数据，请先运行example_usage.py创建测试数据\n")
+
+    test_query_stats_api()
@@ -0,0 +1,413 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+两级缓存
+进程内LRU（L1）位于Redis（L2）之前，热点键直接在本进程命中，省去Redis往返和反序列化；
+跨工作进程的失效通过Redis发布/订阅广播
+"""
+
+import asyncio
+import json
+import math
+import random
+import time
+import uuid
+import logging
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+from config import Config
+from redis_cache import AsyncRedisCache, async_redis_cache
+from prometheus_metrics import cache_counters
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 带软过期时间的缓存条目标记
+SWR_MARKER = "__swr__"
+
+
+class LocalLRUCache:
+    """
+    进程内LRU缓存
+
+    按条目数和估算内存（序列化后的字节数）双重上限淘汰，每个条目有独立的过期时间
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        # key -> (value, expire_at, size)
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self.total_bytes = 0
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0}
+        self.counters = cache_counters("l1_local", ("hits", "misses"))
+
+    def get(self, key: str) -> Any:
+        """获取未过期的条目，不存在或已过期返回None"""
+        entry = self._entries.get(key)
+        if entry is None:
+            self.stats["misses"] += 1
+            self.counters["misses"].inc()
+            return None
+
+        value, expire_at, _ = entry
+        if expire_at <= time.monotonic():
+            self._remove(key)
+            self.stats["expirations"] += 1
+            self.stats["misses"] += 1
+            self.counters["misses"].inc()
+            return None
+
+        self._entries.move_to_end(key)
+        self.stats["hits"] += 1
+        self.counters["hits"].inc()
+        return value
+
+    def set(self, key: str, value: Any, ttl: float, size: int):
+        """写入条目，超出上限时从最久未使用的条目开始淘汰"""
+        if ttl <= 0 or size > self.max_bytes:
+            return
+
+        self._remove(key)
+        self._entries[key] = (value, time.monotonic() + ttl, size)
+        self.total_bytes += size
+
+        while self._entries and (len(self._entries) > self.max_entries or self.total_bytes > self.max_bytes):
+            oldest_key = next(iter(self._entries))
+            self._remove(oldest_key)
+            self.stats["evictions"] += 1
+
+    def delete(self, key: str):
+        """删除条目"""
+        self._remove(key)
+
+    def clear(self):
+        """清空所有条目"""
+        self._entries.clear()
+        self.total_bytes = 0
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.total_bytes -= entry[2]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class TieredCache:
+    """
+    两级缓存：进程内LRU + Redis
+
+    - get先查L1，未命中再查Redis，并按Redis剩余TTL（不超过max_ttl_seconds）回填L1
+    - set同时写入两级，条目记录软过期时间，软过期后在stale窗口内仍可返回并后台刷新
+    - get_entry返回数据的新鲜度，供stale-while-revalidate和XFetch提前刷新使用
+    - get_entries批量读取，L1未命中的键合并为一次Redis往返
+    - invalidate删除两级缓存，并通过Redis发布/订阅通知其他工作进程删除各自的L1
+    - invalidate_tag递增标签的版本号；set传入查询前读取的版本号时，查询期间标签已失效的结果不会留在缓存中
+    - 返回的字典是浅拷贝，调用方可以修改message等顶层字段而不影响缓存
+    """
+
+    def __init__(self,
+                 remote: AsyncRedisCache,
+                 local_config: Dict[str, Any] = None,
+                 refresh_config: Dict[str, Any] = None):
+        local_config = local_config or Config.get_local_cache_config()
+        refresh_config = refresh_config or Config.get_cache_refresh_config()
+        self.remote = remote
+        self.stale_ttl_seconds = refresh_config["stale_while_revalidate_seconds"]
+        self.xfetch_beta = refresh_config["xfetch_beta"]
+        self.enabled = local_config["enabled"]
+        self.max_ttl_seconds = local_config["max_ttl_seconds"]
+        self.channel = local_config["invalidation_channel"]
+        self.local = LocalLRUCache(local_config["max_entries"], local_config["max_bytes"])
+        # 当前进程的标识，忽略自己发布的失效消息
+        self.instance_id = uuid.uuid4().hex
+        self._listener_task: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def _copy(value: Any) -> Any:
+        return dict(value) if isinstance(value, dict) else value
+
+    def generate_cache_key(self, prefix: str, params: Dict[str, Any]) -> str:
+        """
+        根据参数生成一个稳定的缓存键（与Redis缓存一致）
+        """
+        return self.remote.generate_cache_key(prefix, params)
+
+    async def _get_raw(self, key: str) -> Any:
+        """依次从L1、L2获取原始缓存内容（可能是带软过期时间的包装）"""
+        if self.enabled:
+            value = self.local.get(key)
+            if value is not None:
+                logger.info(f"本地缓存命中: {key}")
+                return value
+
+        value, remaining_ttl, size = await self.remote.get_with_ttl(key)
+        if value is not None and self.enabled:
+            self.local.set(key, value, min(remaining_ttl, self.max_ttl_seconds), size)
+        return value
+
+    def _freshness(self, envelope: Dict[str, Any], xfetch: bool) -> str:
+        """
+        判断缓存条目的新鲜度
+
+        Returns:
+            str: fresh（新鲜）、early_refresh（新鲜但按XFetch概率提前刷新）或 stale（已过软过期时间）
+        """
+        now = time.time()
+        soft_expire_at = envelope["soft_expire_at"]
+        if now >= soft_expire_at:
+            return "stale"
+        if xfetch and self.xfetch_beta > 0:
+            # XFetch：计算越慢、越接近过期，越可能提前刷新
+            # now - delta * beta * ln(rand) >= soft_expire_at 时提前刷新
+            delta = envelope.get("delta", 0.0)
+            if now - delta * self.xfetch_beta * math.log(1.0 - random.random()) >= soft_expire_at:
+                return "early_refresh"
+        return "fresh"
+
+    async def get_entry(self, key: str, xfetch: bool = False) -> Optional[Tuple[Any, str]]:
+        """
+        获取缓存数据及其新鲜度（stale-while-revalidate）
+
+        Args:
+            key: 缓存键
+            xfetch: 是否启用XFetch概率提前刷新（适合计算代价高的键）
+
+        Returns:
+            Tuple: (缓存的数据, 新鲜度)，不存在时返回None；新鲜度见_freshness
+        """
+        return self._entry(await self._get_raw(key), xfetch)
+
+    def _entry(self, raw: Any, xfetch: bool) -> Optional[Tuple[Any, str]]:
+        if raw is None:
+            return None
+        if isinstance(raw, dict) and raw.get(SWR_MARKER):
+            return self._copy(raw["value"]), self._freshness(raw, xfetch)
+        # 没有软过期信息的旧条目视为新鲜
+        return self._copy(raw), "fresh"
+
+    async def get_entries(self, keys: List[str], xfetch: Optional[List[bool]] = None) -> List[Optional[Tuple[Any, str]]]:
+        """
+        批量获取缓存数据及其新鲜度：先查L1，L1未命中的键合并为一次Redis往返
+
+        Args:
+            keys: 缓存键列表（可以重复）
+            xfetch: 与keys一一对应，是否启用XFetch概率提前刷新
+
+        Returns:
+            List: 与keys一一对应的 (缓存的数据, 新鲜度)，不存在的位置为None
+        """
+        raw_values: Dict[str, Any] = {}
+        remote_keys = []
+        for key in dict.fromkeys(keys):
+            value = self.local.get(key) if self.enabled else None
+            if value is not None:
+                raw_values[key] = value
+            else:
+                remote_keys.append(key)
+
+        if remote_keys:
+            for key, (value, remaining_ttl, size) in zip(remote_keys, await self.remote.mget_with_ttl(remote_keys)):
+                raw_values[key] = value
+                if value is not None and self.enabled:
+                    self.local.set(key, value, min(remaining_ttl, self.max_ttl_seconds), size)
+
+        xfetch = xfetch or [False] * len(keys)
+        return [self._entry(raw_values[key], use_xfetch) for key, use_xfetch in zip(keys, xfetch)]
+
+    async def get(self, key: str) -> Any:
+        """
+        依次从L1、L2获取数据（不区分新鲜度，过期的陈旧数据也会返回）
+
+        Args:
+            key: 缓存键
+
+        Returns:
+            Any: 缓存的数据，如果不存在或发生错误则返回None
+        """
+        entry = await self.get_entry(key)
+        return entry[0] if entry is not None else None
+
+    async def set(self,
+                  key: str,
+                  value: Any,
+                  ttl: int = None,
+                  broadcast: bool = False,
+                  compute_seconds: float = 0.0,
+                  tags: Optional[List[str]] = None,
+                  generations: Optional[List[int]] = None) -> bool:
+        """
+        同时写入L1和L2
+
+        数据在ttl后进入陈旧状态（软过期），但会在Redis中多保留stale_while_revalidate_seconds，
+        期间仍可返回给请求并在后台刷新
+
+        Args:
+            key: 缓存键
+            value: 要缓存的数据
+            ttl: 缓存时间（秒），如果为None则使用Redis默认值
+            broadcast: 是否通知其他工作进程丢弃该键的本地副本（覆盖已有缓存时使用，如force_refresh）
+            compute_seconds: 本次计算耗时，用于XFetch提前刷新
+            tags: Redis中的标签列表（如数据来源的集合），用于按标签批量失效
+            generations: 查询前通过tag_generations读取的标签版本号。版本号变化说明查询期间数据已被写入，
+                结果可能是写入前的数据：写入前发现则不缓存，写入后发现则立即删除
+
+        Returns:
+            bool: 是否已缓存
+        """
+        if generations is not None and await self.tag_generations(tags) != generations:
+            logger.info(f"查询期间数据已被写入，不缓存结果: {key}")
+            return False
+        if ttl is None:
+            ttl = self.remote.default_ttl
+        envelope = {
+            SWR_MARKER: 1,
+            "value": self._copy(value),
+            "soft_expire_at": time.time() + ttl,
+            "delta": compute_seconds
+        }
+        hard_ttl = ttl + self.stale_ttl_seconds
+
+        size = await self.remote.set(key, envelope, ttl=hard_ttl, tags=tags)
+        if self.enabled:
+            local_ttl = min(hard_ttl, self.max_ttl_seconds)
+            # Redis不可用时按JSON长度估算内存占用
+            self.local.set(key, envelope, local_ttl, size or len(json.dumps(envelope, default=str)))
+        if broadcast:
+            await self._publish_invalidation([key])
+
+        # 检查和写入之间标签可能已失效（失效时还没有该键），再检查一次
+        if generations is not None and await self.tag_generations(tags) != generations:
+            logger.info(f"查询期间数据已被写入，删除刚写入的缓存: {key}")
+            await self.invalidate([key])
+            return False
+        return True
+
+    async def tag_generations(self, tags: Optional[List[str]]) -> Optional[List[int]]:
+        """
+        读取标签的失效版本号（在查询数据库之前调用，传给set）
+
+        Returns:
+            List[int]: 版本号，Redis不可用时为None（此时也无法按标签失效）
+        """
+        return await self.remote.get_generations(tags) if tags else None
+
+    async def invalidate(self, keys: List[str]):
+        """
+        删除两级缓存，并通知其他工作进程
+
+        Args:
+            keys: 缓存键列表
+        """
+        if not keys:
+            return
+        for key in keys:
+            self.local.delete(key)
+        await self.remote.delete(keys)
+        await self._publish_invalidation(keys)
+
+    async def invalidate_tag(self, tag: str) -> int:
+        """
+        删除带有指定标签的所有缓存（两级），并通知其他工作进程
+        
+        Args:
+            tag: 标签
+            
+        Returns:
+            int: 失效的缓存键数量
+        """
+        keys = await self.remote.pop_tagged(tag)
+        await self.invalidate(keys)
+        return len(keys)
+
+    async def _publish_invalidation(self, keys: List[str]):
+        await self.remote.publish(self.channel, json.dumps({"sender": self.instance_id, "keys": keys}))
+
+    def _handle_invalidation(self, raw_message: str):
+        """处理其他工作进程发来的失效消息"""
+        try:
+            message = json.loads(raw_message)
+        except (TypeError, ValueError):
+            logger.warning(f"忽略无法解析的缓存失效消息: {raw_message}")
+            return
+        if message.get("sender") == self.instance_id:
+            return
+        keys = message.get("keys") or []
+        if keys == "*":
+            self.local.clear()
+        else:
+            for key in keys:
+                self.local.delete(key)
+
+    async def _listen(self):
+        """订阅失效频道，断线后自动重连"""
+        while True:
+            pubsub = None
+            try:
+                pubsub = self.remote.client.pubsub(ignore_subscribe_messages=True)
+                await pubsub.subscribe(self.channel)
+                logger.info(f"已订阅缓存失效频道: {self.channel}")
+                async for message in pubsub.listen():
+                    if message.get("type") == "message":
+                        self._handle_invalidation(message["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"缓存失效订阅中断，5秒后重连: {e}")
+                # 重连期间无法收到通知，清空本地缓存避免读到过期数据
+                self.local.clear()
+                await asyncio.sleep(5)
+            finally:
+                if pubsub is not None:
+                    try:
+                        await pubsub.aclose()
+                    except Exception:
+                        pass
+
+    def start(self):
+        """启动失效消息监听（应用启动时调用，Redis不可用或未启用本地缓存时跳过）"""
+        if self.enabled and self.remote.client and self._listener_task is None:
+            self._listener_task = asyncio.create_task(self._listen())
+
+    async def stop(self):
+        """停止失效消息监听"""
+        if self._listener_task is not None:
+            self._listener_task.cancel()
+            try:
+                await self._listener_task
+            except asyncio.CancelledError:
+                pass
+            self._listener_task = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        获取两级缓存的命中统计
+
+        Returns:
+            Dict: 每一级的命中/未命中次数和命中率
+        """
+        def with_ratio(stats: Dict[str, int]) -> Dict[str, Any]:
+            total = stats["hits"] + stats["misses"]
+            return {**stats, "hit_ratio": round(stats["hits"] / total, 4) if total else 0.0}
+
+        return {
+            "l1_local": {
+                **with_ratio(self.local.stats),
+                "enabled": self.enabled,
+                "entries": len(self.local),
+                "bytes": self.local.total_bytes,
+                "max_entries": self.local.max_entries,
+                "max_bytes": self.local.max_bytes
+            },
+            "l2_redis": {
+                **with_ratio(self.remote.stats),
+                "available": self.remote.client is not None
+            }
+        }
+
+
+# 创建一个全局的TieredCache实例，方便在应用中复用
+tiered_cache = TieredCache(async_redis_cache)
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+OpenTelemetry追踪（可选，TRACING_ENABLED=true且安装了opentelemetry-sdk时生效）
+
+- TracingMiddleware从请求头提取W3C trace context（traceparent/tracestate），为每个请求创建服务端span
+- 接口中的各阶段（cache_lookup、connect、execute、serialize，见query_metrics.timed）是请求span的子span
+- MongoDBQueryAPI/AsyncMongoDBQueryAPI的方法、连接时的ping、游标读取、BSON类型转换和Redis读写各自有span
+- span导出到OTLP采集器（OTLP/HTTP）、文件（每行一个span的JSON）或控制台
+
+未启用时span()返回空的上下文管理器，traced装饰的方法直接调用原方法
+"""
+
+import functools
+import inspect
+import logging
+import os
+from contextlib import contextmanager, nullcontext
+from typing import Any, Callable, Dict, Iterator, Optional
+from config import Config
+
+try:
+    from opentelemetry import propagate, trace
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter
+    from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
+    from opentelemetry.trace import SpanKind, Status, StatusCode
+except ImportError:  # 可选依赖
+    trace = None
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+tracing_config = Config.get_tracing_config()
+
+# setup_tracing成功后才有值
+_tracer = None
+_provider = None
+
+_NO_SPAN = nullcontext()
+
+
+def _create_exporter(config: Dict[str, Any]) -> Any:
+    """根据配置创建span导出器"""
+    exporter = config["exporter"]
+    if exporter == "otlp":
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        return OTLPSpanExporter(endpoint=config["otlp_endpoint"])
+    if exporter == "file":
+        # 各工作进程追加写入同一个文件，每行一个span
+        out = open(config["file_path"], "a", encoding="utf-8")
+        return ConsoleSpanExporter(out=out, formatter=lambda span: span.to_json(indent=None) + os.linesep)
+    if exporter == "console":
+        return ConsoleSpanExporter()
+    raise ValueError(f"不支持的追踪导出方式: {exporter}，支持: otlp、file、console")
+
+
+def setup_tracing(config: Dict[str, Any] = None) -> bool:
+    """
+    初始化追踪（应用启动时调用；直接使用MongoDBQueryAPI的脚本需要自己调用）
+
+    Args:
+        config: 追踪配置，默认使用TRACING_CONFIG
+
+    Returns:
+        bool: 追踪是否已启用
+    """
+    global _tracer, _provider
+    config = config or tracing_config
+    if _tracer is not None or not config["enabled"]:
+        return _tracer is not None
+    if trace is None:
+        logger.warning("已启用追踪，但未安装opentelemetry-sdk，追踪不生效")
+        return False
+    try:
+        exporter = _create_exporter(config)
+    except Exception as e:
+        logger.error(f"创建追踪导出器失败，追踪不生效: {e}")
+        return False
+
+    provider = TracerProvider(
+        resource=Resource.create({"service.name": config["service_name"]}),
+        # 请求带有上游trace context时沿用上游的采样决定
+        sampler=ParentBased(TraceIdRatioBased(config["sample_ratio"]))
+    )
+    provider.add_span_processor(BatchSpanProcessor(exporter))
+    trace.set_tracer_provider(provider)
+    _provider = provider
+    _tracer = provider.get_tracer(__name__)
+    logger.info(f"已启用OpenTelemetry追踪，导出方式: {config['exporter']}")
+    return True
+
+
+def shutdown_tracing():
+    """导出剩余的span并关闭（应用退出时调用）"""
+    global _tracer, _provider
+    if _provider is not None:
+        _provider.shutdown()
+    _tracer = None
+    _provider = None
+
+
+def tracing_enabled() -> bool:
+    return _tracer is not None
+
+
+def span(name: str, attributes: Optional[Dict[str, Any]] = None) -> Any:
+    """
+    创建当前span的子span
+
+    Args:
+        name: span名称
+        attributes: span属性
+
+    Returns:
+        上下文管理器（未启用追踪时为空操作）
+    """
+    if _tracer is None:
+        return _NO_SPAN
+    return _tracer.start_as_current_span(name, attributes=attributes)
+
+
+def _mark_error(current_span: Any, result: Any):
+    """方法以错误结果字典返回（而不是抛出异常）时，把span标记为错误"""
+    if isinstance(result, dict) and result.get("status") == "error":
+        current_span.set_status(Status(StatusCode.ERROR, str(result.get("message"))))
+
+
+def traced(name: str, attributes: Optional[Callable[[Any], Dict[str, Any]]] = None) -> Callable:
+    """
+    方法装饰器：把整个方法调用作为一个span（支持普通方法和协程方法）
+
+    Args:
+        name: span名称
+        attributes: 根据实例生成span属性的函数
+    """
+    def decorator(func: Callable) -> Callable:
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(self, *args, **kwargs):
+                if _tracer is None:
+                    return await func(self, *args, **kwargs)
+                with _tracer.start_as_current_span(name, attributes=attributes(self) if attributes else None) as current:
+                    result = await func(self, *args, **kwargs)
+                    _mark_error(current, result)
+                    return result
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            if _tracer is None:
+                return func(self, *args, **kwargs)
+            with _tracer.start_as_current_span(name, attributes=attributes(self) if attributes else None) as current:
+                result = func(self, *args, **kwargs)
+                _mark_error(current, result)
+                return result
+        return wrapper
+    return decorator
+
+
+def mongodb_attributes(api: Any) -> Dict[str, Any]:
+    """MongoDB查询API实例的span属性：数据库和集合"""
+    attributes = {"db.system": "mongodb"}
+    if api.collection is not None:
+        attributes["db.name"] = api.db.name
+        attributes["db.mongodb.collection"] = api.collection.name
+    return attributes
+
+
+def redis_attributes(cache: Any) -> Dict[str, Any]:
+    return {"db.system": "redis"}
+
+
+@contextmanager
+def server_span(scope: Dict[str, Any]) -> Iterator[Any]:
+    """
+    一个HTTP请求的服务端span，父span来自请求头中的W3C trace context
+
+    Args:
+        scope: ASGI scope
+    """
+    carrier = {key.decode("latin-1"): value.decode("latin-1") for key, value in scope["headers"]}
+    with _tracer.start_as_current_span(
+        scope["method"],
+        context=propagate.extract(carrier),
+        kind=SpanKind.SERVER,
+        attributes={"http.request.method": scope["method"], "url.path": scope["path"]}
+    ) as current:
+        yield current
+
+
+def finish_server_span(current_span: Any, method: str, route: str, status_code: int):
+    """路由匹配后按路径模板命名span，并记录状态码"""
+    current_span.update_name(f"{method} {route}")
+    current_span.set_attribute("http.route", route)
+    current_span.set_attribute("http.response.status_code", status_code)
+    if status_code >= 500:
+        current_span.set_status(Status(StatusCode.ERROR))